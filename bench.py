@@ -0,0 +1,356 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import timeit
+
+import numpy as np
+
+# Load, micro and regression benchmarks for the calculator API.
+#
+#   python bench.py corpus --out corpus.jsonl --size 2000
+#   python bench.py golden --corpus corpus.jsonl --record golden.jsonl
+#   python bench.py golden --corpus corpus.jsonl --check golden.jsonl
+#   python bench.py run --corpus corpus.jsonl --out results.json [--uvicorn] [--url http://host:port]
+#   python bench.py compare results.json baseline.json --threshold 0.1
+#
+# A corpus is JSONL: one InputData payload per line for /submit, or {"path": ..., "body": ...} for
+# any other POST endpoint. The load runs need httpx (the same client FastAPI's TestClient uses).
+#
+# tests/data holds a small committed corpus (bench.py corpus --size 40 --seed 14) and its golden file,
+# which tests/test_golden.py checks on every test run.
+
+ACCOUNT_TYPES = ("Government Account", "Trade Account")
+DISEASES = ("WET AMD", "DME")
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "ns_per_op")
+HIGHER_IS_BETTER = ("throughput",)
+
+
+def make_corpus(size: int, seed: int = 0) -> list:
+    """
+    Random /submit payloads spread over the scenario space.
+
+    Args:
+        size (int): Number of payloads.
+        seed (int): RNG seed.
+
+    Returns:
+        list: InputData payloads.
+    """
+    from tables import DRUGS
+
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        corpus.append({"account_type": rng.choice(ACCOUNT_TYPES),
+                       "patient_support": rng.choice(("Yes", "No")),
+                       "disease_indication": rng.choice(DISEASES),
+                       "time_horizon": str(rng.randint(1, 5)),
+                       "naive_switch": rng.choice(("Naive", "Switch")),
+                       "clinical_status": rng.choice(("Per Label", "RWE")),
+                       "drugs_selected": rng.sample(DRUGS, rng.randint(1, len(DRUGS))),
+                       "First_Drug": rng.choice(DRUGS),
+                       "Second_Drug": rng.choice(DRUGS),
+                       "procedure_cost": rng.randrange(0, 5000, 50),
+                       "oct_cost": rng.randrange(0, 1000, 10),
+                       "consulting_charges": rng.randrange(0, 1000, 10),
+                       "travel_cost": rng.randrange(0, 500, 10),
+                       "food_cost": rng.randrange(0, 500, 10),
+                       "miscellaneous_cost": rng.randrange(0, 500, 10),
+                       "patient_lost_opportunity_cost": rng.randrange(0, 5000, 50),
+                       "caregiver_lost_opportunity_cost": rng.randrange(0, 5000, 50),
+                       **{f"drug{i}_dosage": rng.randint(1, 24) for i in range(1, 6)}})
+    return corpus
+
+
+def load_corpus(path: str) -> list:
+    """
+    Read a corpus as (path, body) pairs.
+    """
+    requests = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                if "body" in item and isinstance(item["body"], dict):
+                    requests.append((item.get("path", "/submit"), item["body"]))
+                else:
+                    requests.append(("/submit", item))
+    return requests
+
+
+async def replay(client, requests: list, concurrency: int, total: int) -> dict:
+    """
+    Send total requests from the corpus (cycled) with concurrency requests in flight.
+
+    Returns:
+        dict: requests, errors, throughput (requests/s) and p50/p95/p99 latency in ms.
+    """
+    source = itertools.islice(itertools.cycle(requests), total)
+    latencies, errors = [], 0
+
+    async def worker():
+        nonlocal errors
+        for path, body in source:
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                failed = response.status_code >= 500
+            except Exception:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, (50, 95, 99)).tolist()
+    return {"requests": len(latencies), "errors": errors, "throughput": len(latencies) / elapsed,
+            "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+
+
+async def load_asgi(requests: list, levels: list, total: int) -> dict:
+    # In-process: no sockets, so this isolates the app itself
+    import httpx
+    from main import app
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            await replay(client, requests[:50], 1, min(total, 50))  # warm up
+            for level in levels:
+                results[str(level)] = await replay(client, requests, level, total)
+    return results
+
+
+async def load_http(url: str, requests: list, levels: list, total: int) -> dict:
+    import httpx
+
+    results = {}
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        await replay(client, requests[:50], 1, min(total, 50))
+        for level in levels:
+            results[str(level)] = await replay(client, requests, level, total)
+    return results
+
+
+def start_uvicorn(env: dict) -> tuple:
+    """
+    Start the app under uvicorn on a free local port.
+
+    Returns:
+        tuple: (process, base URL)
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                               cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, **env})
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process, url
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("uvicorn did not start")
+
+
+def micro_benchmarks() -> dict:
+    """
+    Per-call time of the calculation paths, best of several timeit rounds.
+    """
+    from engine import calculate_cumulative_costs, calculate_submit
+    from tables import bar_unit_vectors, apply_unit_vector
+    from vectorized import calculate_batch
+    from main import InputData
+
+    data = InputData(time_horizon="5")
+    vectors = bar_unit_vectors(6, 60000)
+    costs = (1000, 200, 200, 100, 100, 100, 1000, 1000)
+    batch = [InputData(**payload) for payload in make_corpus(1000, seed=1) if payload["clinical_status"] == "RWE"]
+    cases = {
+        "apply_unit_vector": lambda: [apply_unit_vector(vector, costs) for vector in vectors],
+        "calculate_cumulative_costs": lambda: calculate_cumulative_costs(5, (3900, 1800, 366000), (1950, 900, 183000)),
+        "calculate_cumulative_costs_30y_monthly": lambda: calculate_cumulative_costs(30, (3900, 1800, 366000), (1950, 900, 183000), 12),
+        "calculate_submit": lambda: calculate_submit(data),
+        "calculate_batch_per_scenario": lambda: calculate_batch(batch),
+    }
+    results = {}
+    for name, case in cases.items():
+        timer = timeit.Timer(case)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=5, number=number)) / number
+        if name == "calculate_batch_per_scenario":
+            best /= len(batch)
+        results[name] = {"ns_per_op": best * 1e9}
+    return results
+
+
+def run(args) -> int:
+    requests = load_corpus(args.corpus)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    env = {"LOG_SAMPLE_RATE": str(args.log_sample_rate)}
+    if args.cold:
+        env["SUBMIT_CACHE_SIZE"] = "0"
+    os.environ.update(env)
+
+    results = {"meta": {"time": time.time(), "python": platform.python_version(), "machine": platform.machine(),
+                        "cpus": os.cpu_count(), "corpus": args.corpus, "requests_per_level": args.requests, "cold": args.cold},
+               "micro": micro_benchmarks(),
+               "load": {"asgi": asyncio.run(load_asgi(requests, levels, args.requests))}}
+
+    if args.url:
+        results["load"]["http"] = asyncio.run(load_http(args.url, requests, levels, args.requests))
+    elif args.uvicorn:
+        process, url = start_uvicorn(env)
+        try:
+            results["load"]["http"] = asyncio.run(load_http(url, requests, levels, args.requests))
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    for name, result in results["micro"].items():
+        print(f"{name:<40} {result['ns_per_op'] / 1000:>10.2f} us")
+    for target, by_level in results["load"].items():
+        for level, result in by_level.items():
+            print(f"{target:<5} c={level:<4} {result['throughput']:>9.1f} req/s  p50 {result['p50_ms']:.2f} ms  "
+                  f"p95 {result['p95_ms']:.2f} ms  p99 {result['p99_ms']:.2f} ms  errors {result['errors']}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    metrics = {}
+    for key, value in results.items():
+        if key == "meta":
+            continue
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f"{prefix}{key}."))
+        elif key in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            metrics[f"{prefix}{key}"] = value
+    return metrics
+
+
+def compare(args) -> int:
+    """
+    Compare a results file with a baseline; fail if any metric regressed by more than the threshold.
+    """
+    with open(args.results) as f:
+        current = flatten(json.load(f))
+    with open(args.baseline) as f:
+        baseline = flatten(json.load(f))
+
+    regressions = 0
+    for name in sorted(set(current) & set(baseline)):
+        new, old = current[name], baseline[name]
+        change = (new - old) / old if old else 0.0
+        worse = change if name.endswith(LOWER_IS_BETTER) else -change
+        regressed = worse > args.threshold
+        regressions += regressed
+        print(f"{'REGRESSED' if regressed else 'ok':<10} {name:<55} {old:>12.3f} -> {new:>12.3f} ({change:+.1%})")
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def golden(args) -> int:
+    """
+    Record the responses to a corpus, or check that they are unchanged.
+    """
+    from fastapi.testclient import TestClient
+    from main import app
+
+    requests = load_corpus(args.corpus)
+    with TestClient(app, raise_server_exceptions=False) as client:
+        responses = []
+        for path, body in requests:
+            response = client.post(path, json=body)
+            payload = response.json()
+            if isinstance(payload, dict):
+                for key in args.ignore:
+                    payload.pop(key, None)
+            responses.append({"status": response.status_code, "body": payload})
+
+    if args.record:
+        with open(args.record, "w") as f:
+            for response in responses:
+                f.write(json.dumps(response, sort_keys=True) + "\n")
+        print(f"Recorded {len(responses)} responses")
+        return 0
+
+    with open(args.check) as f:
+        expected = [json.loads(line) for line in f if line.strip()]
+    if len(expected) != len(responses):
+        print(f"Golden file has {len(expected)} responses, corpus has {len(responses)}")
+        return 1
+    mismatches = [index for index, (want, got) in enumerate(zip(expected, responses))
+                  if json.dumps(want, sort_keys=True) != json.dumps(got, sort_keys=True)]
+    for index in mismatches[:10]:
+        print(f"Mismatch at line {index + 1}: {json.dumps(requests[index][1])}")
+    print(f"{len(mismatches)} of {len(responses)} responses differ from the golden output")
+    return 1 if mismatches else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load, micro and regression benchmarks for the calculator API")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    corpus = commands.add_parser("corpus", help="Write a random /submit corpus")
+    corpus.add_argument("--out", required=True)
+    corpus.add_argument("--size", type=int, default=2000)
+    corpus.add_argument("--seed", type=int, default=0)
+
+    runner = commands.add_parser("run", help="Micro benchmarks and load replay")
+    runner.add_argument("--corpus", required=True)
+    runner.add_argument("--out")
+    runner.add_argument("--concurrency", default="1,8,32", help="Comma separated concurrency levels")
+    runner.add_argument("--requests", type=int, default=2000, help="Requests per concurrency level")
+    runner.add_argument("--uvicorn", action="store_true", help="Also replay against a local uvicorn")
+    runner.add_argument("--url", help="Also replay against an already running server")
+    runner.add_argument("--cold", action="store_true", help="Disable the /submit response cache")
+    runner.add_argument("--log-sample-rate", type=float, default=0.0)
+
+    comparer = commands.add_parser("compare", help="Fail on regressions against a baseline")
+    comparer.add_argument("results")
+    comparer.add_argument("baseline")
+    comparer.add_argument("--threshold", type=float, default=0.1, help="Allowed relative slowdown, e.g. 0.1 for 10%%")
+
+    checker = commands.add_parser("golden", help="Record or check the responses to a corpus")
+    checker.add_argument("--corpus", required=True)
+    mode = checker.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--record")
+    mode.add_argument("--check")
+    checker.add_argument("--ignore", nargs="*", default=[], help="Top level response keys to leave out")
+
+    args = parser.parse_args(argv)
+    if args.command == "corpus":
+        with open(args.out, "w") as f:
+            for payload in make_corpus(args.size, args.seed):
+                f.write(json.dumps(payload) + "\n")
+        return 0
+    if args.command == "compare":
+        return compare(args)
+    if args.command == "golden":
+        os.environ.setdefault("LOG_SAMPLE_RATE", "0")
+        return golden(args)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+import math
+
+import numpy as np
+
+from tables import DRUGS, COST_FIELDS, current
+from vectorized import (MAX_HORIZON_YEARS, resolve_scenario, calculate_costs, calculate_yearly_costs,
+                        calculate_cumulative_series)
+
+# Break-even solver and cost frontier. Both evaluate the array forms of the cost model with one row per
+# candidate input (or per account type), so a question that took dozens of /submit round trips is a
+# handful of array operations. A drug's cost is affine in its vial price (the price only enters the
+# package amounts, which are never truncated), so vial prices are solved in closed form; truncated
+# dosage amounts and per-period rounding of discounted series are searched numerically instead.
+
+VARIABLES = ("vial_price", "dosage", "horizon")
+METRICS = ("per_patient", "cumulative")
+
+# Upper end of the numeric search
+MAX_VALUES = {"vial_price": 10 ** 12, "dosage": 10 ** 4}
+SEARCH_POINTS = 64
+# Values tried on each side of a guess
+GUESS_WINDOW = 8
+
+
+def drug_costs(r, costs, cost_per_vial, dosage, metric, years=None):
+    """
+    Cost of every drug for rows of candidate inputs.
+
+    Args:
+        r (dict): resolve_scenario output of the base scenario.
+        costs (np.ndarray): Cost inputs in COST_FIELDS order, shape (1, 8).
+        cost_per_vial (np.ndarray): Vial prices, shape (rows, drugs).
+        dosage (np.ndarray): Dosages (per label, or the RWE inputs), shape (rows, drugs).
+        metric (str): "per_patient" for the Total Cost/Patient, "cumulative" for the cumulative
+                      indirect + direct + package cost at the end of the time horizon.
+        years (int): Horizon of the cumulative series; that of the scenario by default. With a
+                     horizon the full (rows, drugs, periods) series of totals is returned.
+
+    Returns:
+        np.ndarray: int64 costs, shape (rows, drugs), or (rows, drugs, periods) if years is given.
+    """
+    if metric == "per_patient":
+        return calculate_costs(dosage, cost_per_vial, costs, total_only=True)
+    rows = len(cost_per_vial)
+    yearly = calculate_yearly_costs(np.full(rows, r["rwe"]), np.broadcast_to(np.array(r["y1"], dtype=np.int64), dosage.shape),
+                                    np.array(r["y2345"], dtype=np.int64), dosage, cost_per_vial, costs)
+    horizon = r["years"] if years is None else years
+    length = max(horizon, 1) * r["periods"]
+    totals = calculate_cumulative_series(yearly, np.full(rows, horizon), length, r["periods"], r["discount_rate"]).sum(axis=2)
+    return totals if years is not None else totals[..., -1]
+
+
+def scenario_arrays(data, pricing):
+    # Base scenario resolved once, with its cost inputs, vial prices and unmasked dosages as arrays
+    r = resolve_scenario(data, pricing)
+    costs = np.array([[getattr(data, field) for field in COST_FIELDS]], dtype=np.int64)
+    dosages = r["input_dosage"] if r["rwe"] else [r["side_bar"].get(drug, 0) for drug in DRUGS]
+    return r, costs, np.array([r["cost_per_vial"]], dtype=np.int64), np.array([dosages], dtype=np.int64)
+
+
+def search(gap, high, guess=None, points=SEARCH_POINTS, window=GUESS_WINDOW):
+    """
+    Largest integer x in [0, high] with gap(x) <= 0, for a nondecreasing gap.
+
+    A k-ary search: a geometric ladder brackets the answer, then every round evaluates gap at
+    `points` values across the bracket at once. With a guess, the values within `window` of it are
+    tried first, which settles a nearly linear gap in one evaluation.
+
+    Returns:
+        int | None: x, None if gap(0) > 0; high if gap(high) <= 0.
+    """
+    if guess is not None:
+        candidates = np.arange(max(guess - window, 0), min(guess + window, high) + 1)
+        above = gap(candidates) > 0
+        if above.any() and not above[0]:
+            return int(candidates[np.argmax(above) - 1])
+    ladder = np.unique(np.minimum(np.concatenate([[0], 2 ** np.arange(math.ceil(math.log2(high)) + 1)]), high))
+    above = np.flatnonzero(gap(ladder) > 0)
+    if len(above) == 0:
+        return int(high)
+    if above[0] == 0:
+        return None
+    low, high = int(ladder[above[0] - 1]), int(ladder[above[0]])
+    while high - low > 1:
+        candidates = np.unique(np.linspace(low, high, points + 2).astype(np.int64))[1:-1]
+        above = gap(candidates) > 0
+        if above.all():
+            high = int(candidates[0])
+        elif not above.any():
+            low = int(candidates[-1])
+        else:
+            first = int(np.argmax(above))
+            low, high = int(candidates[first - 1]), int(candidates[first])
+    return low
+
+
+def solve_break_even(data, drug, reference, variable="vial_price", metric="cumulative", pricing=None):
+    """
+    Value of one input of a drug at which the drug costs the same as a reference drug.
+
+    vial_price and dosage (an RWE dosage) move the drug's input and solve for the largest value at
+    which it costs no more than the reference, everything else as in data. horizon moves the time
+    horizon of both and finds when their cumulative costs cross, up to MAX_HORIZON_YEARS.
+
+    Vial prices are solved analytically: costs are affine in them, exactly for Total Cost/Patient
+    and undiscounted cumulative costs, so two evaluations give the line. Discounted cumulative costs
+    are rounded per period and dosage amounts are truncated, so those are searched numerically; the
+    costs never decrease in either input. Horizons are found by scanning one series of every period,
+    with the crossing of the yearly totals solved in closed form when undiscounted.
+
+    Args:
+        data (InputData): Base scenario.
+        drug (str): Drug whose input moves.
+        reference (str): Drug to break even with.
+        variable (str): "vial_price", "dosage" or "horizon".
+        metric (str): "per_patient" (Total Cost/Patient) or "cumulative" (cumulative cost at the end
+                      of the time horizon); horizon needs "cumulative".
+        pricing (PricingTables): Tables to price with; the current ones by default.
+
+    Returns:
+        dict: The question, the method ("analytic" or "numeric"), the base value and both drugs'
+              costs at it, and the outcome: "crosses" with break_even (the exact or interpolated
+              value where the costs are equal) and threshold (the largest whole price or dosage at
+              which the drug costs no more than the reference, or the first horizon in years, at the
+              resolution of the series, from which their order has changed) plus both costs there;
+              or "never_cheaper" / "always_cheaper" (vial_price, dosage), "never_crosses" / "equal"
+              (horizon).
+
+    Raises:
+        ValueError: If the question or the scenario is invalid.
+    """
+    for name in (drug, reference):
+        if name not in DRUGS:
+            raise ValueError(f"Unknown drug: {name!r}")
+    if drug == reference:
+        raise ValueError("drug and reference must differ")
+    if variable not in VARIABLES:
+        raise ValueError(f"Unknown variable: {variable!r}; expected one of {VARIABLES}")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric!r}; expected one of {METRICS}")
+    if variable == "dosage" and data.clinical_status != "RWE":
+        raise ValueError("dosage is only used in RWE mode; Per Label dosages come from the dosage tables")
+    if variable == "horizon" and metric != "cumulative":
+        raise ValueError("Total Cost/Patient does not depend on the horizon; use metric 'cumulative'")
+
+    pricing = pricing or current()
+    r, costs, cost_per_vial, dosage = scenario_arrays(data, pricing)
+    i, j = DRUGS.index(drug), DRUGS.index(reference)
+    result = {"drug": drug, "reference": reference, "variable": variable, "metric": metric}
+
+    if variable == "horizon":
+        result.update(solve_horizon(r, costs, cost_per_vial, dosage, i, j))
+        return result
+
+    inputs = cost_per_vial if variable == "vial_price" else dosage
+    base_value = int(inputs[0, i])
+    base_costs = drug_costs(r, costs, cost_per_vial, dosage, metric)[0]
+    result["base"] = {"value": base_value, "drug_cost": int(base_costs[i]), "reference_cost": int(base_costs[j])}
+
+    def costs_at(values):
+        # Both drugs' costs with the drug's input at each value
+        rows = np.repeat(inputs, len(values), axis=0)
+        rows[:, i] = values
+        moved = (rows, dosage) if variable == "vial_price" else (cost_per_vial, rows)
+        at = drug_costs(r, costs, *(np.broadcast_to(array, rows.shape) for array in moved), metric)
+        return at[:, i], at[:, j]
+
+    def gap(values):
+        drug_cost, reference_cost = costs_at(np.asarray(values, dtype=np.int64))
+        return drug_cost - reference_cost
+
+    analytic = variable == "vial_price" and (metric == "per_patient" or not r["discount_rate"])
+    result["method"] = "analytic" if analytic else "numeric"
+    if analytic:
+        at_zero, at_one = gap([0, 1]).tolist()
+        slope = at_one - at_zero
+        if at_zero > 0:
+            return dict(result, outcome="never_cheaper")
+        if slope == 0:
+            return dict(result, outcome="always_cheaper")
+        break_even = -at_zero / slope
+        threshold = -at_zero // slope
+    else:
+        guess = None
+        if variable == "vial_price":
+            # Discounting only rounds each period, so the line through two distant prices lands next to the answer
+            at_zero, at_far = gap([0, 2 ** 20]).tolist()
+            guess = int(-at_zero * 2 ** 20 // (at_far - at_zero)) if at_far > at_zero else None
+        threshold = search(gap, MAX_VALUES[variable], guess)
+        if threshold is None:
+            return dict(result, outcome="never_cheaper")
+        if threshold == MAX_VALUES[variable]:
+            return dict(result, outcome="always_cheaper")
+        # Interpolated between the last value at or below the reference and the first above it
+        below, above = gap([threshold, threshold + 1]).tolist()
+        break_even = threshold - below / (above - below)
+
+    drug_cost, reference_cost = costs_at(np.array([threshold], dtype=np.int64))
+    return dict(result, outcome="crosses", break_even=break_even, threshold=int(threshold),
+                at_threshold={"drug_cost": int(drug_cost[0]), "reference_cost": int(reference_cost[0])})
+
+
+def solve_horizon(r, costs, cost_per_vial, dosage, i, j):
+    # Cumulative totals of both drugs at every period up to MAX_HORIZON_YEARS, from one series
+    periods = r["periods"]
+    totals = drug_costs(r, costs, cost_per_vial, dosage, "cumulative", years=MAX_HORIZON_YEARS)[0]
+    difference = totals[i] - totals[j]
+    base_period = r["years"] * periods
+    at_base = totals[:, base_period - 1] if base_period > 0 else np.zeros(len(DRUGS), dtype=np.int64)
+    result = {"base": {"value": r["years"], "drug_cost": int(at_base[i]), "reference_cost": int(at_base[j])},
+              "method": "numeric" if r["discount_rate"] else "analytic"}
+
+    # The order at the first period where the two differ, and the first period after it where that order no longer holds
+    differs = np.flatnonzero(difference)
+    if len(differs) == 0:
+        return dict(result, outcome="equal")
+    sign = np.sign(difference[differs[0]])
+    changed = np.flatnonzero(np.sign(difference[differs[0]:]) != sign)
+    if len(changed) == 0:
+        return dict(result, outcome="never_crosses")
+    index = differs[0] + int(changed[0])
+
+    # Undiscounted yearly totals are F + L * (years - 1) per drug; their difference is zero at 1 - dF / dL
+    first_year = int(totals[i, periods - 1] - totals[j, periods - 1])
+    later_years = int(totals[i, 2 * periods - 1] - totals[j, 2 * periods - 1]) - first_year
+    if not r["discount_rate"] and first_year * later_years < 0:
+        result["method"], break_even = "analytic", 1 - first_year / later_years
+    else:
+        before, after = int(difference[index - 1]), int(difference[index])
+        result["method"], break_even = "numeric", (index + before / (before - after)) / periods
+    return dict(result, outcome="crosses", break_even=break_even, threshold=(index + 1) / periods,
+                at_threshold={"drug_cost": int(totals[i, index]), "reference_cost": int(totals[j, index])})
+
+
+def cost_frontier(data, pricing=None):
+    """
+    Costs of every drug under every account type, priced in one pass.
+
+    Each account type is one row of the array form, with its vial prices and everything else as in
+    data (drugs_selected is ignored: every drug is priced).
+
+    Args:
+        data (InputData): Base scenario.
+        pricing (PricingTables): Tables to price with; the current ones by default.
+
+    Returns:
+        dict: Per account type: per_patient and cumulative cost of every drug, the cheapest drug on
+              each, the frontier (drugs no other drug beats on both, cheapest per patient first) and
+              break_even_vial_price, the vial price at which each drug would match the cheapest one
+              on each metric (exact, except for discounted cumulative costs, where it is the price
+              on the unrounded series), None for a drug whose cost does not depend on its price.
+
+    Raises:
+        ValueError: If the scenario is invalid.
+    """
+    pricing = pricing or current()
+    r, costs, _, dosage = scenario_arrays(data, pricing)
+    accounts = list(pricing.vial_prices)
+    cost_per_vial = np.array([[pricing.prices(account, data.patient_support)[drug] for drug in DRUGS] for account in accounts],
+                             dtype=np.int64)
+    dosage = np.repeat(dosage, len(accounts), axis=0)
+    per_patient = drug_costs(r, costs, cost_per_vial, dosage, "per_patient")
+    cumulative = drug_costs(r, costs, cost_per_vial, dosage, "cumulative")
+
+    # Pareto frontier: a drug is dominated if another costs no more on both metrics and less on one
+    no_more = (per_patient[:, None, :] <= per_patient[:, :, None]) & (cumulative[:, None, :] <= cumulative[:, :, None])
+    less = (per_patient[:, None, :] < per_patient[:, :, None]) | (cumulative[:, None, :] < cumulative[:, :, None])
+    dominated = (no_more & less).any(axis=2)
+
+    # Cost per unit of vial price: the dosage per patient; over the horizon the package dosages, discounted per year
+    years = r["years"]
+    later_weight = sum((1 + r["discount_rate"]) ** -k for k in range(1, years))
+    slopes = {"per_patient": dosage,
+              "cumulative": np.broadcast_to((np.array(r["y1"]) + np.array(r["y2345"]) * later_weight) * (years > 0), dosage.shape)}
+
+    result = {}
+    for row, account in enumerate(accounts):
+        entry = {"per_patient": dict(zip(DRUGS, per_patient[row].tolist())),
+                 "cumulative": dict(zip(DRUGS, cumulative[row].tolist())),
+                 "cheapest": {},
+                 "frontier": [DRUGS[index] for index in np.argsort(per_patient[row], kind="stable").tolist() if not dominated[row, index]],
+                 "break_even_vial_price": {}}
+        for name, values in (("per_patient", per_patient[row]), ("cumulative", cumulative[row])):
+            entry["cheapest"][name] = DRUGS[int(np.argmin(values))]
+            slope = slopes[name][row]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                prices = cost_per_vial[row] - (values - values.min()) / slope
+            entry["break_even_vial_price"][name] = {drug: float(price) if s else None
+                                                    for drug, price, s in zip(DRUGS, prices.tolist(), slope.tolist())}
+        result[account] = entry
+    return {"drugs": list(DRUGS), "accounts": result}
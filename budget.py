@@ -0,0 +1,221 @@
+import numpy as np
+
+from tables import DRUGS, COST_FIELDS, current
+from vectorized import CUMULATIVE_SERIES, MAX_HORIZON_YEARS, resolve_scenario, calculate_yearly_costs
+from workers import simulation_pool
+
+# Budget impact of a patient cohort. Patients are simulated as arrays a chunk at a time; a chunk only
+# returns patient counts per (year, disease, treatment phase, drug), which are summed across chunks and
+# priced once with the per-patient yearly amounts of the cost model, so memory does not grow with the cohort.
+
+NAIVE_SWITCH = ("Naive", "Switch")
+
+# Treatment phase of a patient-year: a naive patient's first year on therapy, or any later (maintenance) year
+FIRST_YEAR, MAINTENANCE = 0, 1
+
+
+def check_mix(name, mix, allowed):
+    """
+    Validate a {category: weight} mix and normalise it to probabilities in the order of allowed.
+
+    Raises:
+        ValueError: If a category is unknown, a weight is negative or all weights are zero.
+    """
+    unknown = set(mix) - set(allowed)
+    if unknown:
+        raise ValueError(f"{name}: unknown {', '.join(sorted(unknown))}; expected any of {tuple(allowed)}")
+    weights = np.array([mix.get(category, 0.0) for category in allowed], dtype=np.float64)
+    if (weights < 0).any() or weights.sum() <= 0:
+        raise ValueError(f"{name}: weights must be non-negative and not all zero")
+    return weights / weights.sum()
+
+
+def check_market_share(market_share, years):
+    """
+    Market share of every drug in every year; the last year given carries on to the end of the horizon.
+
+    Returns:
+        np.ndarray: float64 shares, shape (years, drugs). The rest of each year's patients are untreated.
+
+    Raises:
+        ValueError: If a drug is unknown or a year's shares are negative or add up to more than 1.
+    """
+    if not market_share:
+        raise ValueError("market_share needs at least one year")
+    shares = []
+    for year, share in enumerate(market_share[:years], start=1):
+        unknown = set(share) - set(DRUGS)
+        if unknown:
+            raise ValueError(f"market_share year {year}: unknown drug {', '.join(sorted(unknown))}")
+        row = [share.get(drug, 0.0) for drug in DRUGS]
+        if min(row) < 0 or sum(row) > 1 + 1e-9:
+            raise ValueError(f"market_share year {year}: shares must be non-negative and add up to at most 1")
+        shares.append(row)
+    shares += [shares[-1]] * (years - len(shares))
+    return np.array(shares, dtype=np.float64)
+
+
+def yearly_amounts(data, diseases, pricing):
+    """
+    Per-patient yearly amounts of every drug, per disease.
+
+    Args:
+        data (InputData): Account, patient support, clinical status, cost inputs and RWE dosages.
+        diseases (tuple): Disease indications of the cohort.
+        pricing (PricingTables): Tables to price with.
+
+    Returns:
+        np.ndarray: int64 amounts, shape (diseases, 2, drugs, 3): CUMULATIVE_SERIES of a FIRST_YEAR
+                    and of a MAINTENANCE year.
+    """
+    costs = np.array([[getattr(data, field) for field in COST_FIELDS]], dtype=np.int64)
+    amounts = []
+    for disease in diseases:
+        # The yearly amounts do not depend on the horizon; a one year naive scenario always has per-label dosages
+        scenario = resolve_scenario(data.model_copy(update={"disease_indication": disease, "time_horizon": "1", "naive_switch": "Naive"}),
+                                    pricing)
+        yearly = calculate_yearly_costs(np.array([scenario["rwe"]]), np.array([scenario["y1"]]), np.array(scenario["y2345"]),
+                                        np.array([scenario["input_dosage"]]), np.array([scenario["cost_per_vial"]]), costs)
+        amounts.append(yearly[0].transpose(2, 0, 1))
+    return np.array(amounts, dtype=np.int64)
+
+
+def simulate_chunk(disease_mix, switch_probability, shares, discontinuation, size, seed):
+    """
+    Follow one chunk of patients through the horizon.
+
+    Every patient keeps a fixed position in the market shares, so patients only move to another drug
+    when the shares move. A patient who moves is in maintenance on the new drug; a discontinued patient
+    stays off therapy.
+
+    Args:
+        disease_mix (np.ndarray): Probability of each disease.
+        switch_probability (float): Probability that a patient is a switch patient.
+        shares (np.ndarray): Market shares, shape (years, drugs).
+        discontinuation (np.ndarray): Annual discontinuation rate per drug.
+        size (int): Patients in the chunk.
+        seed (np.random.SeedSequence): Seed of this chunk.
+
+    Returns:
+        tuple: int64 patient counts, shape (years, diseases, 2, drugs + 1) with the untreated last, and
+               discontinuations, shape (years, drugs).
+    """
+    rng = np.random.default_rng(seed)
+    years, drugs = shares.shape
+    bounds = np.cumsum(shares, axis=1)
+    rates = np.append(discontinuation, 0.0)
+
+    disease = rng.choice(len(disease_mix), size, p=disease_mix)
+    switch = rng.random(size) < switch_probability
+    position = rng.random(size)
+    active = np.ones(size, dtype=bool)
+    treated_before = np.zeros(size, dtype=bool)
+
+    counts = np.zeros((years, len(disease_mix), 2, drugs + 1), dtype=np.int64)
+    discontinued = np.zeros((years, drugs), dtype=np.int64)
+    for year in range(years):
+        drug = np.searchsorted(bounds[year], position, side="right")
+        treated = active & (drug < drugs)
+        phase = np.where(switch | treated_before, MAINTENANCE, FIRST_YEAR)
+        key = ((disease * 2 + phase) * (drugs + 1) + drug)[active]
+        counts[year] = np.bincount(key, minlength=counts[year].size).reshape(counts[year].shape)
+
+        stopped = treated & (rng.random(size) < rates[drug])
+        discontinued[year] = np.bincount(drug[stopped], minlength=drugs)
+        treated_before |= treated
+        active &= ~stopped
+
+    return counts, discontinued
+
+
+def run_budget_impact(data, patients, years, disease_mix, naive_switch_mix, market_share, discontinuation=None, seed=0,
+                      chunk_size=100000, progress=None, pricing=None):
+    """
+    Budget impact of treating a cohort over a number of years.
+
+    Draws are split into chunks of chunk_size, each with its own child of SeedSequence(seed), so the
+    result depends only on the seed and chunk size, not on how many processes run the chunks
+    (workers.simulation_pool, sized with SIMULATION_WORKERS).
+
+    Args:
+        data (InputData): Account, patient support, clinical status, cost inputs, RWE dosages and discount rate.
+        patients (int): Cohort size.
+        years (int): Horizon in years.
+        disease_mix (dict): Disease indication -> weight.
+        naive_switch_mix (dict): "Naive" / "Switch" -> weight.
+        market_share (list): {drug: share} per year; the last one carries on, the remainder is untreated.
+        discontinuation (dict): Drug -> annual discontinuation rate.
+        seed (int): RNG seed.
+        chunk_size (int): Patients per chunk; bounds the size of the intermediate arrays.
+        progress (callable): Called with the fraction of chunks done after each chunk.
+        pricing (PricingTables): Tables to price with; the current ones by default.
+
+    Returns:
+        dict: Per year the patients on each drug, untreated and discontinued, and the spend per drug
+              (Indirect_Costs, Direct_Costs, Package_Cost, Total); the spend per drug over the horizon,
+              the total and the total discounted with data.discount_rate.
+
+    Raises:
+        ValueError: If an input is invalid or the scenario cannot be priced.
+    """
+    if not 1 <= years <= MAX_HORIZON_YEARS:
+        raise ValueError(f"years must be between 1 and {MAX_HORIZON_YEARS}")
+    pricing = pricing or current()
+    diseases = tuple(pricing.cumulative_dosage_y1)
+    disease_probability = check_mix("disease_mix", disease_mix, diseases)
+    switch_probability = check_mix("naive_switch_mix", naive_switch_mix, NAIVE_SWITCH)[1]
+    shares = check_market_share(market_share, years)
+    discontinuation = discontinuation or {}
+    unknown = set(discontinuation) - set(DRUGS)
+    if unknown:
+        raise ValueError(f"discontinuation: unknown drug {', '.join(sorted(unknown))}")
+    rates = np.array([discontinuation.get(drug, 0.0) for drug in DRUGS], dtype=np.float64)
+    if ((rates < 0) | (rates > 1)).any():
+        raise ValueError("discontinuation rates must be between 0 and 1")
+    amounts = yearly_amounts(data, diseases, pricing)
+
+    sizes = [min(chunk_size, patients - start) for start in range(0, patients, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(disease_probability, switch_probability, shares, rates, size, child) for size, child in zip(sizes, seeds)]
+
+    counts = np.zeros((years, len(diseases), 2, len(DRUGS) + 1), dtype=np.int64)
+    discontinued = np.zeros((years, len(DRUGS)), dtype=np.int64)
+
+    def collect(chunks):
+        nonlocal counts, discontinued
+        for done, (chunk_counts, chunk_discontinued) in enumerate(chunks, start=1):
+            counts += chunk_counts
+            discontinued += chunk_discontinued
+            if progress:
+                progress(done / len(args))
+
+    if len(args) > 1:
+        collect(simulation_pool.map(simulate_chunk, *zip(*args)))
+    else:
+        collect(simulate_chunk(*arg) for arg in args)
+
+    # Price the patient-years: (years, diseases, phases, drugs) x (diseases, phases, drugs, series), in Python
+    # ints, as a large cohort at the largest costs and dosages spends more than int64 holds
+    spend = np.einsum("ydpk,dpks->yks", counts[..., :len(DRUGS)].astype(object), amounts.astype(object))
+    on_drug = counts.sum(axis=(1, 2))
+    yearly_totals = spend.sum(axis=(1, 2))
+    discounted_total = float((yearly_totals / (1 + data.discount_rate) ** np.arange(years)).sum())
+
+    def by_drug(rows):
+        return {drug: dict(zip(CUMULATIVE_SERIES + ("Total",), row + [sum(row)])) for drug, row in zip(DRUGS, rows)}
+
+    return {"patients": patients,
+            "years": years,
+            "seed": seed,
+            "chunks": len(sizes),
+            "per_year": [{"year": year,
+                          "patients_on_drug": dict(zip(DRUGS, drug_counts[:-1])),
+                          "untreated": drug_counts[-1],
+                          "discontinued": dict(zip(DRUGS, stopped)),
+                          "spend": by_drug(rows),
+                          "total": total}
+                         for year, drug_counts, stopped, rows, total in zip(range(1, years + 1), on_drug.tolist(), discontinued.tolist(),
+                                                                          spend.tolist(), yearly_totals.tolist())],
+            "spend": by_drug(spend.sum(axis=0).tolist()),
+            "total": int(yearly_totals.sum()),
+            "discounted_total": discounted_total}
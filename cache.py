@@ -0,0 +1,340 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Caches of encoded /submit responses, keyed on a canonical hash of the validated InputData: an
+# in-process LRU, or a memory-mapped file shared by every API worker on the host (SUBMIT_CACHE_PATH).
+
+
+def canonical_key(data):
+    """
+    Hash a validated InputData so that equivalent requests share one cache entry.
+
+    drugs_selected is only used for membership, so it is de-duplicated and sorted first.
+
+    Args:
+        data (InputData): Validated request body.
+
+    Returns:
+        str: Hex digest of the canonical JSON form.
+    """
+    fields = data.model_dump()
+    fields["drugs_selected"] = sorted(set(fields["drugs_selected"]))
+    payload = json.dumps(fields, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def make_etag(body):
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match uses the weak comparison, so a W/ prefix on the client's copy still matches
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache with a per-entry TTL.
+
+    Entries belong to one pricing table version; switching versions drops everything.
+
+    Args:
+        max_entries (int): Entries kept before the least recently used one is evicted.
+        ttl (float): Seconds an entry stays valid.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.version = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+        with self.lock:
+            self._check_version(version)
+            item = self.entries.get(key)
+            if item is not None and item[0] <= self.clock():
+                del self.entries[key]
+                self.expirations += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, version, value):
+        with self.lock:
+            self._check_version(version)
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.invalidations += 1
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.version = version
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"backend": "memory",
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations,
+                    "invalidations": self.invalidations,
+                    "size": len(self.entries),
+                    "max_entries": self.max_entries,
+                    "memory_bytes": sum(len(etag) + len(body) for _, (etag, body) in self.entries.values()),
+                    "ttl": self.ttl,
+                    "table_version": self.version}
+
+
+class SharedResponseCache:
+    """
+    Set-associative cache in a memory-mapped file, shared by every worker process that opens it.
+
+    The file is a header followed by fixed-size slots in sets of `ways`; a key can only live in the
+    slots of the set its hash picks. Each slot carries a sequence number that is odd while it is being
+    written, so reads take no lock: a reader copies the slot and retries elsewhere (a miss) if the
+    sequence changed underneath it. Writers lock the set's byte range of the file (fcntl), so workers
+    only contend when they write to the same set, and evict the least recently read slot of the set.
+
+    Entries are tagged with the pricing table version and expire on the wall clock, so the file stays
+    valid when a worker restarts or all of them do. Hit and miss counts are per process, like /metrics;
+    size and memory_bytes describe the shared file. Every process must open it with the same settings
+    (they come from the same environment); a file of another layout is reinitialised.
+
+    Args:
+        path (str): Cache file, e.g. under /dev/shm.
+        slots (int): Number of slots; rounded up to a whole number of sets.
+        slot_size (int): Bytes per slot, slot header included; responses that do not fit are not cached.
+        ttl (float): Seconds an entry stays valid.
+        ways (int): Slots per set.
+        clock (callable): Wall clock the expiry times are on.
+
+    Raises:
+        ValueError: If a slot cannot hold its own header plus a byte, or ways is not positive.
+    """
+
+    MAGIC = b"IOPNRC01"
+    HEADER = struct.Struct("<8sIII")  # magic, slots, slot size, ways
+    HEADER_SIZE = 64
+    # sequence, key, table version, expires, last read, etag length, body length
+    SLOT = struct.Struct("<Q16s16sddII")
+    LAST_READ = struct.calcsize("<Q16s16sd")
+    EMPTY = bytes(16)
+
+    def __init__(self, path, slots=1024, slot_size=16384, ttl=300.0, ways=8, clock=time.time):
+        if fcntl is None:
+            raise RuntimeError("SharedResponseCache needs fcntl (POSIX)")
+        if slot_size <= self.SLOT.size:
+            raise ValueError(f"slot_size must be larger than the {self.SLOT.size} byte slot header, got {slot_size}")
+        if ways < 1:
+            raise ValueError(f"ways must be at least 1, got {ways}")
+        self.path = path
+        self.ways = ways
+        self.sets = max(1, -(-slots // ways))
+        self.slots = self.sets * ways
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self.clock = clock
+        self.size_bytes = self.HEADER_SIZE + self.slots * slot_size
+        self.fd = None
+        self.map = None
+        self.lock = threading.Lock()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.too_large = 0
+
+    def mapping(self):
+        # The file is only opened on first use, so importing the app never writes to disk
+        if self.map is None:
+            with self.lock:
+                if self.map is None:
+                    self.open()
+        return self.map
+
+    def open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        header = self.HEADER.pack(self.MAGIC, self.slots, self.slot_size, self.ways)
+        fcntl.lockf(fd, fcntl.LOCK_EX, self.HEADER_SIZE, 0)
+        try:
+            if os.pread(fd, self.HEADER.size, 0) != header or os.fstat(fd).st_size != self.size_bytes:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.size_bytes)
+                os.pwrite(fd, header, 0)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, self.HEADER_SIZE, 0)
+        self.map = mmap.mmap(fd, self.size_bytes)
+        self.fd = fd
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                os.close(self.fd)
+                self.map = self.fd = None
+
+    @staticmethod
+    def tag(text):
+        return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+    def set_offset(self, digest):
+        return self.HEADER_SIZE + int.from_bytes(digest[:8], "little") % self.sets * self.ways * self.slot_size
+
+    def _check_version(self, version):
+        # Entries of other versions are never returned; this only keeps the count like ResponseCache
+        if version != self.version:
+            if self.version is not None:
+                self.invalidations += 1
+            self.version = version
+
+    def get(self, key, version):
+        mm = self.mapping()
+        self._check_version(version)
+        digest, version_tag, now = self.tag(key), self.tag(str(version)), self.clock()
+        base = self.set_offset(digest)
+        for offset in range(base, base + self.ways * self.slot_size, self.slot_size):
+            sequence, slot_key, slot_version, expires, _, etag_length, body_length = self.SLOT.unpack_from(mm, offset)
+            if slot_key != digest or sequence & 1 or slot_version != version_tag:
+                continue
+            if expires <= now:
+                self.expirations += 1
+                continue
+            start = offset + self.SLOT.size
+            etag, body = mm[start:start + etag_length], mm[start + etag_length:start + etag_length + body_length]
+            if self.SLOT.unpack_from(mm, offset)[0] != sequence:
+                continue
+            struct.pack_into("<d", mm, offset + self.LAST_READ, now)
+            self.hits += 1
+            return etag.decode(), body
+        self.misses += 1
+        return None
+
+    def put(self, key, version, value):
+        etag, body = value
+        etag = etag.encode()
+        if self.SLOT.size + len(etag) + len(body) > self.slot_size:
+            self.too_large += 1
+            return
+        mm = self.mapping()
+        self._check_version(version)
+        digest, version_tag, now = self.tag(key), self.tag(str(version)), self.clock()
+        base = self.set_offset(digest)
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, self.ways * self.slot_size, base)
+            try:
+                target, oldest = None, None
+                for offset in range(base, base + self.ways * self.slot_size, self.slot_size):
+                    sequence, slot_key, slot_version, expires, last_read, _, _ = self.SLOT.unpack_from(mm, offset)
+                    if slot_key == digest:
+                        target = offset
+                        break
+                    if target is None and (slot_key == self.EMPTY or sequence & 1 or slot_version != version_tag or expires <= now):
+                        target = offset
+                    if oldest is None or last_read < oldest[0]:
+                        oldest = (last_read, offset)
+                if target is None:
+                    target = oldest[1]
+                    self.evictions += 1
+                self.write(mm, target, digest, version_tag, now + self.ttl, now, etag, body)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, self.ways * self.slot_size, base)
+
+    def write(self, mm, offset, digest, version_tag, expires, last_read, etag, body):
+        # Odd sequence while the slot is inconsistent; a writer that died half way leaves it odd until the next write
+        sequence = self.SLOT.unpack_from(mm, offset)[0] | 1
+        struct.pack_into("<Q", mm, offset, sequence)
+        start = offset + self.SLOT.size
+        mm[start:start + len(etag) + len(body)] = etag + body
+        self.SLOT.pack_into(mm, offset, sequence + 1, digest, version_tag, expires, last_read, len(etag), len(body))
+
+    def clear(self):
+        mm = self.mapping()
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 0, self.HEADER_SIZE)
+            try:
+                for offset in range(self.HEADER_SIZE, self.size_bytes, self.slot_size):
+                    sequence = self.SLOT.unpack_from(mm, offset)[0] | 1
+                    struct.pack_into("<Q16s", mm, offset, sequence, self.EMPTY)
+                    struct.pack_into("<Q", mm, offset, sequence + 1)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 0, self.HEADER_SIZE)
+            self.invalidations += 1
+
+    def entries(self):
+        # Live entries in the shared file, of the current version once this process has seen one
+        mm = self.mapping()
+        version_tag, now = self.version and self.tag(str(self.version)), self.clock()
+        count = 0
+        for offset in range(self.HEADER_SIZE, self.size_bytes, self.slot_size):
+            sequence, slot_key, slot_version, expires, _, _, _ = self.SLOT.unpack_from(mm, offset)
+            count += slot_key != self.EMPTY and not sequence & 1 and version_tag in (None, slot_version) and expires > now
+        return count
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"backend": "shared",
+                "path": self.path,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "too_large": self.too_large,
+                "size": self.entries(),
+                "max_entries": self.slots,
+                "slot_size": self.slot_size,
+                "memory_bytes": self.size_bytes,
+                "ttl": self.ttl,
+                "table_version": self.version}
+
+
+def cache_from_environment():
+    # SUBMIT_CACHE_PATH switches to the cache shared by every worker on the host
+    max_entries = int(os.environ.get("SUBMIT_CACHE_SIZE", "1024"))
+    ttl = float(os.environ.get("SUBMIT_CACHE_TTL", "300"))
+    path = os.environ.get("SUBMIT_CACHE_PATH")
+    if path and max_entries > 0:
+        return SharedResponseCache(path, slots=max_entries, slot_size=int(os.environ.get("SUBMIT_CACHE_SLOT_SIZE", "16384")), ttl=ttl)
+    return ResponseCache(max_entries=max_entries, ttl=ttl)
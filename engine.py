@@ -0,0 +1,208 @@
+import numpy as np
+
+from tables import (DRUGS, COST_FIELDS, current, support_key, rwe_dosages, bar_unit_vectors, rwe_cumulative_unit_vectors,
+                    apply_unit_vector)
+from telemetry import Timings
+from vectorized import COMPARISONS, CUMULATIVE_SERIES, resolve_horizon, calculate_cumulative_series, compare_cumulative
+
+# Pure-Python cost engine behind /submit. Everything is built from plain tuples and lists so the
+# request path never touches pandas; only the all-drugs comparison goes through numpy.
+
+NO_COSTS = (0, 0, 0, 0, 0, 0)
+
+
+def calculate_cumulative_costs(Time_Horizon_value, first_year, later_years, periods_per_year=1, discount_rate=0.0):
+    """
+    Running (indirect, direct, package) totals over the time horizon, zero padded to 5 years.
+
+    Scalar form of vectorized.calculate_cumulative_series (same closed form and rounding): for a
+    single drug numpy's per-call overhead outweighs the work unless the series is long.
+
+    Args:
+        Time_Horizon_value (str | int): Number of years.
+        first_year (tuple): (indirect, direct, package) added in the first year.
+        later_years (tuple): (indirect, direct, package) added in every later year.
+        periods_per_year (int): 1 for yearly, 4 for quarterly or 12 for monthly totals.
+        discount_rate (float): Annual discount rate applied from the second year on.
+
+    Returns:
+        dict: Indirect_Costs, Direct_Costs and Package_Cost lists.
+    """
+    years = int(Time_Horizon_value)
+    periods = periods_per_year
+    if years * periods > 60:
+        # Long monthly/quarterly horizons: the array form wins
+        series = calculate_cumulative_series(np.array([first_year, later_years], dtype=np.int64).T, np.array(years),
+                                             max(5, years) * periods, periods, discount_rate)
+        return dict(zip(CUMULATIVE_SERIES, series.tolist()))
+
+    padding = [0] * ((max(5, years) - max(years, 0)) * periods)
+    factors = [(1 + discount_rate) ** ((j - 1) // periods) for j in range(1, years * periods + 1)] if discount_rate else None
+
+    result = {}
+    for name, first, later in zip(CUMULATIVE_SERIES, first_year, later_years):
+        if periods == 1:
+            series = [first + later * k for k in range(years)]
+        else:
+            series = [first * min(j, periods) // periods + later * max(j - periods, 0) // periods for j in range(1, years * periods + 1)]
+        if factors:
+            total, previous = 0.0, 0
+            for j, value in enumerate(series):
+                total += (value - previous) / factors[j]
+                previous, series[j] = value, round(total)
+        result[name] = series + padding
+    return result
+
+
+def check_series_settings(data):
+    """
+    Validate the settings only the cumulative series depend on: First_Drug, Second_Drug, comparison
+    and the time horizon.
+
+    Returns:
+        tuple: (years, periods per year, annual discount rate)
+
+    Raises:
+        ValueError: If any of them is invalid.
+    """
+    for drug in (data.First_Drug, data.Second_Drug):
+        if drug not in DRUGS:
+            raise ValueError(f"Unknown drug: {drug!r}")
+    if data.comparison not in COMPARISONS:
+        raise ValueError(f"Unknown comparison: {data.comparison!r}; expected one of {COMPARISONS[1:]}")
+    return resolve_horizon(data)
+
+
+def rwe_unit_vectors(data, pricing, drug, dosage):
+    # Bar graph rows (None when the drug is not selected) and cumulative rows of one drug at an RWE dosage
+    prices = pricing.prices(data.account_type, support_key(data.patient_support))
+    bar = bar_unit_vectors(int(dosage), prices[drug]) if drug in data.drugs_selected else None
+    return bar, rwe_cumulative_unit_vectors(pricing.cumulative_dosage_y1[data.disease_indication][drug],
+                                            pricing.cumulative_dosage_y2345[drug], dosage, prices[drug])
+
+
+def scenario_unit_vectors(data, pricing=None):
+    """
+    Validate one scenario and collect the unit-cost vectors of every drug.
+
+    Per-Label vectors come from the precompiled index of the pricing tables; RWE vectors are built
+    from the user's dosages.
+
+    Args:
+        data (InputData): Validated request body.
+        pricing (PricingTables): Tables to price with; the current ones by default.
+
+    Returns:
+        tuple: (drug_dosages_side_bar_data,
+                {drug: bar graph rows, or None when the drug is not selected},
+                {drug: (first year rows, later year rows) of the cumulative costs})
+
+    Raises:
+        ValueError: If the scenario is outside the pricing tables.
+    """
+    pricing = pricing or current()
+    clinical_status = data.clinical_status
+    account_type = data.account_type
+    patient_support = support_key(data.patient_support)
+    disease_indication = data.disease_indication
+
+    if account_type not in pricing.vial_prices:
+        raise ValueError(f"Unknown account_type: {account_type!r}")
+    if disease_indication not in pricing.cumulative_dosage_y1:
+        raise ValueError(f"Unknown disease_indication: {disease_indication!r}")
+    check_series_settings(data)
+
+    selected = [drug for drug in DRUGS if drug in data.drugs_selected]
+
+    if clinical_status == "Per Label":
+        key = (account_type, patient_support, disease_indication, data.time_horizon if data.naive_switch == "Naive" else None, data.naive_switch)
+        entry = pricing.per_label_index.get(key)
+        if entry is None and selected:
+            raise ValueError(f"No per-label dosages for {key!r}")
+        drug_dosages_side_bar_data = entry["dosages"] if entry else {}
+        bar = {drug: entry["bar"][drug] if drug in selected else None for drug in DRUGS}
+        cumulative = pricing.cumulative_index[(account_type, patient_support, disease_indication)]
+
+    elif clinical_status == "RWE":
+        drug_dosages_side_bar_data = rwe_dosages(data)
+        vectors = {drug: rwe_unit_vectors(data, pricing, drug, drug_dosages_side_bar_data[drug]) for drug in DRUGS}
+        bar = {drug: bar_rows for drug, (bar_rows, _) in vectors.items()}
+        cumulative = {drug: cumulative_rows for drug, (_, cumulative_rows) in vectors.items()}
+
+    else:
+        raise ValueError(f"Unknown clinical_status: {clinical_status!r}")
+
+    return drug_dosages_side_bar_data, bar, cumulative
+
+
+def bar_outputs(drug_costs):
+    """
+    bar_gragh_data and Total_Package_Cost from each drug's (package, consulting, oct, travel_food, opportunity, total).
+    """
+    bar_graph_data = [{"data": list(column)} for column in zip(*drug_costs)]
+    Total_Package_Cost_data = [{"data": [package, consulting + oct, travel_food + opportunity]}
+                               for package, consulting, oct, travel_food, opportunity, _ in drug_costs]
+    return bar_graph_data, Total_Package_Cost_data
+
+
+def calculate_submit(data, timings=None, pricing=None):
+    """
+    Compute the /submit response for one scenario.
+
+    Args:
+        data (InputData): Validated request body.
+        timings (Timings): Collects the time spent in each stage, if given.
+        pricing (PricingTables): Tables to price with; the current ones by default.
+
+    Returns:
+        dict: drug_dosages_side_bar_data, bar_gragh_data, Total_Package_Cost, First_Drug_data and Second_Drug_data,
+              plus Cumulative_Costs (and Cumulative_Pairs) for every selected drug when data.comparison is set.
+
+    Raises:
+        ValueError: If the scenario is outside the pricing tables.
+    """
+    timings = timings or Timings()
+
+    with timings.stage("lookup"):
+        drug_dosages_side_bar_data, bar, cumulative = scenario_unit_vectors(data, pricing)
+        years, periods, discount_rate = resolve_horizon(data)
+        costs = tuple(getattr(data, field) for field in COST_FIELDS)
+
+    # ------------------------------------------- bar graph data ----------------------------------------------
+
+    with timings.stage("costs"):
+        drug_costs = []
+        for drug in DRUGS:
+            if bar[drug] is None:
+                drug_costs.append(NO_COSTS)
+            else:
+                rows = [apply_unit_vector(vector, costs) for vector in bar[drug]]
+                drug_costs.append((*rows, sum(rows)))
+
+    with timings.stage("assemble"):
+        bar_graph_data, Total_Package_Cost_data = bar_outputs(drug_costs)
+
+    # ------------------------------------------ Cumulative Costs Comparison ------------------------------------------
+
+    def cumulative_costs(drug):
+        first_year, later_years = cumulative[drug]
+        return calculate_cumulative_costs(years,
+                                          tuple(apply_unit_vector(vector, costs) for vector in first_year),
+                                          tuple(apply_unit_vector(vector, costs) for vector in later_years),
+                                          periods, discount_rate)
+
+    with timings.stage("cumulative"):
+        result = {"drug_dosages_side_bar_data": drug_dosages_side_bar_data,
+                  "bar_gragh_data": bar_graph_data,
+                  "Total_Package_Cost": Total_Package_Cost_data,
+                  "First_Drug_data": cumulative_costs(data.First_Drug),
+                  "Second_Drug_data": cumulative_costs(data.Second_Drug)}
+
+        # --------------------------------------- All selected drugs / all pairs ---------------------------------------
+
+        if data.comparison:
+            selected = [drug for drug in DRUGS if bar[drug] is not None]
+            yearly = [[[apply_unit_vector(vector, costs) for vector in amounts] for amounts in zip(*cumulative[drug])] for drug in selected]
+            result.update(compare_cumulative(selected, yearly, years, data.comparison, periods, discount_rate))
+
+    return result
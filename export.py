@@ -0,0 +1,122 @@
+import itertools
+import math
+import zlib
+from typing import Annotated
+
+from pydantic import TypeAdapter
+
+from formats import dumps_json, to_columnar
+from tables import current
+from vectorized import resolve_scenario, calculate_resolved
+
+# Streaming export of scenario grids. The grid is never materialised: scenario i is decoded from its
+# index (mixed radix over the axes, last axis fastest, like itertools.product), priced with the
+# vectorized calculator one batch at a time and written out as NDJSON, so memory stays at one batch
+# however large the grid is.
+
+
+def grid_axes(base, values, ranges):
+    """
+    Validate the axes of a grid.
+
+    Args:
+        base (InputData): Scenario every grid point starts from.
+        values (dict): InputData field -> list of values.
+        ranges (dict): Integer InputData field -> range of values.
+
+    Returns:
+        list: (field, sequence of values) per axis, in the order given.
+
+    Raises:
+        ValueError: If a field is unknown, a value does not fit its field or an axis is empty.
+    """
+    fields = type(base).model_fields
+    axes = []
+    for name, axis in list(values.items()) + list(ranges.items()):
+        if name not in fields:
+            raise ValueError(f"Unknown grid axis {name!r}")
+        if any(name == existing for existing, _ in axes):
+            raise ValueError(f"Grid axis {name!r} is given twice")
+        # With the field's constraints, so an axis cannot leave the bounds of InputData
+        metadata = fields[name].metadata
+        adapter = TypeAdapter(Annotated[fields[name].annotation, *metadata] if metadata else fields[name].annotation)
+        if name in ranges:
+            if fields[name].annotation is not int:
+                raise ValueError(f"Grid axis {name!r} is not an integer field; list its values instead")
+            for value in (*axis[:1], *axis[-1:]):
+                adapter.validate_python(value)
+        else:
+            axis = [adapter.validate_python(value) for value in axis]
+        if len(axis) == 0:
+            raise ValueError(f"Grid axis {name!r} has no values")
+        axes.append((name, axis))
+    return axes
+
+
+def grid_size(axes):
+    return math.prod(len(axis) for _, axis in axes)
+
+
+def iterate_grid(base, axes):
+    """
+    Lazily yield (index, varied fields, InputData) for every point of the grid.
+    """
+    sizes = [len(axis) for _, axis in axes]
+    for index in range(grid_size(axes)):
+        positions = []
+        rest = index
+        for size in reversed(sizes):
+            rest, position = divmod(rest, size)
+            positions.append(position)
+        varied = {name: axis[position] for (name, axis), position in zip(axes, reversed(positions))}
+        yield index, varied, base.model_copy(update=varied)
+
+
+def batches(rows, batch_size, first_batch=16):
+    # Small batches first so the first lines go out at once, then doubling up to batch_size
+    rows = iter(rows)
+    size = min(first_batch, batch_size)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+        size = min(size * 2, batch_size)
+
+
+def export_lines(base, axes, batch_size=512, columnar=False, pricing=None):
+    """
+    Price every grid point and yield NDJSON, one encoded chunk per batch.
+
+    Each line is {"index", "scenario": the varied fields, "result": the /submit response, in the
+    columnar layout if columnar is set} or, for a point outside the pricing tables,
+    {"index", "scenario", "error"}. The whole grid is priced with one version of the tables,
+    pricing or the current one when the export starts.
+    """
+    pricing = pricing or current()
+    for batch in batches(iterate_grid(base, axes), batch_size):
+        resolved, errors = [], {}
+        for index, _, data in batch:
+            try:
+                resolved.append(resolve_scenario(data, pricing))
+            except ValueError as e:
+                errors[index] = str(e)
+        results = iter(calculate_resolved([data for index, _, data in batch if index not in errors], resolved))
+
+        lines = []
+        for index, varied, _ in batch:
+            line = {"index": index, "scenario": varied}
+            if index in errors:
+                line["error"] = errors[index]
+            else:
+                line["result"] = to_columnar(next(results)) if columnar else next(results)
+            lines.append(dumps_json(line))
+        yield b"\n".join(lines) + b"\n"
+
+
+def gzip_stream(chunks, level=6):
+    # One gzip member; every chunk is flushed on its own so the client can decode it right away
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
@@ -0,0 +1,96 @@
+import json
+
+from tables import DRUGS
+from vectorized import BAR_COMPONENTS, PACKAGE_COMPONENTS, columnar_comparison
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Response encodings picked from the Accept header. Plain JSON in the current shape stays the default;
+# a client may instead ask for MessagePack and/or the columnar layout, which has one array per cost
+# component instead of a {"data": [...]} object per row (see vectorized.calculate_batch_columnar for
+# batches, where the keys are written once for all scenarios).
+# orjson and msgpack are optional: without orjson JSON is written by the standard library (same bytes),
+# without msgpack the MessagePack types are simply not offered.
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.iopen.columnar+json"
+MSGPACK = "application/msgpack"
+COLUMNAR_MSGPACK = "application/vnd.iopen.columnar+msgpack"
+
+ALIASES = {"application/x-msgpack": MSGPACK, "application/vnd.msgpack": MSGPACK}
+
+
+def media_types():
+    if msgpack is None:
+        return (JSON, COLUMNAR_JSON)
+    return (JSON, COLUMNAR_JSON, MSGPACK, COLUMNAR_MSGPACK)
+
+
+def negotiate(accept):
+    """
+    Pick the response media type for an Accept header.
+
+    The supported type with the highest q-value wins, the first listed on a tie. Anything else
+    (no header, */*, only unsupported types) gets JSON, so existing clients are unaffected.
+    """
+    if not accept:
+        return JSON
+    supported = media_types()
+    best, best_q = JSON, 0.0
+    for part in accept.split(","):
+        media, *params = [item.strip() for item in part.split(";")]
+        media = ALIASES.get(media.lower(), media.lower())
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media in supported and q > best_q:
+            best, best_q = media, q
+    return best
+
+
+def is_columnar(media_type):
+    return media_type in (COLUMNAR_JSON, COLUMNAR_MSGPACK)
+
+
+def dumps_json(value):
+    # Compact UTF-8 like JSONResponse; orjson writes the same bytes for the ints, strings and lists used here
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def encode(value, media_type):
+    if media_type in (MSGPACK, COLUMNAR_MSGPACK):
+        return msgpack.packb(value)
+    return dumps_json(value)
+
+
+def to_columnar(result):
+    """
+    Columnar layout of one /submit response.
+
+    bar_gragh_data and Total_Package_Cost become {component: [value per drug]}; Cumulative_Costs and
+    Cumulative_Pairs take the vectorized.columnar_comparison layout. Other keys are unchanged.
+    """
+    columnar = {"drugs": list(DRUGS)}
+    for key, value in result.items():
+        if key == "bar_gragh_data":
+            value = {name: row["data"] for name, row in zip(BAR_COMPONENTS, value)}
+        elif key == "Total_Package_Cost":
+            value = {name: [drug["data"][i] for drug in value] for i, name in enumerate(PACKAGE_COMPONENTS)}
+        columnar[key] = value
+    if "Cumulative_Costs" in result:
+        columnar.update(columnar_comparison(result))
+    return columnar
@@ -0,0 +1,260 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from workers import process_context
+
+# Background jobs for analyses that outlive an HTTP request. Jobs run on a process pool and everything
+# about them (status, progress, result) lives in a SQLite file, so any API worker sharing the file can
+# report on or serve a job, whichever worker started it. No broker is involved: the worker that owns a
+# queued or running job renews its lease, and a job whose lease ran out (its worker or pool process was
+# killed) is claimed again by the next identical request.
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled."""
+
+
+def job_key(kind, payload, version):
+    # Identical requests for the same version of the pricing tables map to the same job
+    text = json.dumps({"kind": kind, "payload": payload}, sort_keys=True, separators=(",", ":"))
+    return f"{version}-{hashlib.sha256(text.encode()).hexdigest()}"
+
+
+def encode_result(result):
+    # Same encoding as JSONResponse, so a stored result can be served as is
+    return json.dumps(result, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class JobStore:
+    """
+    SQLite table of jobs, safe to share between processes.
+
+    Every state change is a conditional UPDATE, so a job that was cancelled is never marked running
+    or done afterwards.
+
+    Args:
+        path (str): Database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ready = False
+
+    @contextmanager
+    def connect(self):
+        # The file is only created on first use, so importing the app never writes to disk
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            if not self.ready:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+                           "progress REAL NOT NULL, error TEXT, result BLOB, created REAL NOT NULL, updated REAL NOT NULL)")
+                self.ready = True
+            yield db
+        finally:
+            db.close()
+
+    def update(self, job_id, condition, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.connect() as db:
+            cursor = db.execute(f"UPDATE jobs SET {assignments} WHERE id = ? AND {condition}", (*fields.values(), job_id))
+            return cursor.rowcount == 1
+
+    def claim(self, job_id, kind, lease):
+        """
+        Queue a job unless an identical one is done, or queued or running with a live lease.
+
+        Args:
+            job_id (str): Job id.
+            kind (str): Job kind.
+            lease (float): Seconds after its last update a queued or running job counts as abandoned.
+
+        Returns:
+            bool: True if the caller must run the job, False if an existing one is reused.
+        """
+        now = time.time()
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT status, updated FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            rerun = row is not None and (row[0] in ("failed", "cancelled") or row[0] in ("queued", "running") and row[1] < now - lease)
+            if row is None:
+                db.execute("INSERT INTO jobs VALUES (?, ?, 'queued', 0, NULL, NULL, ?, ?)", (job_id, kind, now, now))
+            elif rerun:
+                db.execute("UPDATE jobs SET status = 'queued', progress = 0, error = NULL, result = NULL, created = ?, updated = ? "
+                           "WHERE id = ?", (now, now, job_id))
+            db.execute("COMMIT")
+        return row is None or rerun
+
+    def renew(self, job_ids):
+        # Extend the lease of jobs that are still queued or running
+        with self.connect() as db:
+            db.execute(f"UPDATE jobs SET updated = ? WHERE status IN ('queued', 'running') AND id IN ({', '.join('?' * len(job_ids))})",
+                       (time.time(), *job_ids))
+
+    def get(self, job_id):
+        with self.connect() as db:
+            row = db.execute("SELECT id, kind, status, progress, error, created, updated FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "kind", "status", "progress", "error", "created", "updated"), row))
+
+    def result(self, job_id):
+        with self.connect() as db:
+            row = db.execute("SELECT result FROM jobs WHERE id = ? AND status = 'done'", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def start(self, job_id):
+        return self.update(job_id, "status = 'queued'", status="running")
+
+    def progress(self, job_id, fraction):
+        if not self.update(job_id, "status = 'running'", progress=fraction):
+            raise JobCancelled(job_id)
+
+    def finish(self, job_id, body):
+        return self.update(job_id, "status = 'running'", status="done", progress=1.0, result=body)
+
+    def fail(self, job_id, error):
+        return self.update(job_id, "status IN ('queued', 'running')", status="failed", error=error)
+
+    def cancel(self, job_id):
+        return self.update(job_id, "status IN ('queued', 'running')", status="cancelled")
+
+    def stats(self):
+        with self.connect() as db:
+            return dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+def execute(path, job_id, fn, args):
+    """
+    Run one job in a pool process and record the outcome in the store.
+
+    fn(*args, progress=callback) reports progress as a fraction; the callback raises JobCancelled
+    once the job is cancelled, which ends the run at its next progress report.
+    """
+    store = JobStore(path)
+    if not store.start(job_id):
+        return
+    try:
+        result = fn(*args, progress=lambda fraction: store.progress(job_id, fraction))
+    except JobCancelled:
+        return
+    except ValueError as e:
+        store.fail(job_id, str(e))
+        return
+    except Exception as e:
+        store.fail(job_id, f"{type(e).__name__}: {e}")
+        return
+    store.finish(job_id, encode_result(result))
+
+
+class JobManager:
+    """
+    Submit, track and cancel jobs.
+
+    Args:
+        path (str): SQLite file shared by every API worker.
+        max_workers (int): Jobs running at once in this API worker.
+        lease (float): Seconds a queued or running job is kept without being renewed; this worker
+                       renews its own jobs every lease / 3 seconds.
+    """
+
+    def __init__(self, path, max_workers=2, lease=30.0):
+        self.store = JobStore(path)
+        self.max_workers = max_workers
+        self.lease = lease
+        self.executor = None
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=process_context())
+            self.stopping.clear()
+            threading.Thread(target=self.renew_leases, name="job-leases", daemon=True).start()
+        return self.executor
+
+    def restart(self, broken):
+        # A pool whose process died refuses any new job; the first caller to notice replaces it
+        with self.lock:
+            if self.executor is broken:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=process_context())
+                broken.shutdown(wait=False, cancel_futures=True)
+            return self.executor
+
+    def run(self, job_id, fn, args):
+        executor = self.start()
+        try:
+            return executor.submit(execute, self.store.path, job_id, fn, args)
+        except BrokenProcessPool:
+            return self.restart(executor).submit(execute, self.store.path, job_id, fn, args)
+
+    def renew_leases(self):
+        while not self.stopping.wait(self.lease / 3):
+            with self.lock:
+                job_ids = list(self.futures)
+            if job_ids:
+                self.store.renew(job_ids)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.stopping.set()
+            for job_id in list(self.futures):
+                self.store.cancel(job_id)
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def submit(self, kind, payload, version, fn, *args):
+        """
+        Start fn(*args) as a job, or reuse the identical job if it is done, queued or running.
+
+        fn must be a module-level function (or a functools.partial of one) accepting a progress
+        keyword argument, and must price with the tables of the given version.
+
+        Args:
+            kind (str): Job kind.
+            payload (dict): Request, which with kind and version identifies the job.
+            version (str): Version of the pricing tables the job prices with.
+
+        Returns:
+            dict: Job status.
+        """
+        job_id = job_key(kind, payload, version)
+        if self.store.claim(job_id, kind, self.lease):
+            try:
+                future = self.run(job_id, fn, args)
+            except Exception as e:
+                # Release the claim, so the next identical request runs the job instead of waiting out the lease
+                self.store.fail(job_id, f"{type(e).__name__}: {e}")
+                return self.store.get(job_id)
+            with self.lock:
+                self.futures[job_id] = future
+            future.add_done_callback(lambda done: self.finished(job_id, done))
+        return self.store.get(job_id)
+
+    def finished(self, job_id, future):
+        with self.lock:
+            self.futures.pop(job_id, None)
+        # A pool process that died never got to record the outcome itself
+        if not future.cancelled() and future.exception() is not None:
+            self.store.fail(job_id, f"{type(future.exception()).__name__}: {future.exception()}")
+
+    def cancel(self, job_id):
+        if self.store.cancel(job_id):
+            with self.lock:
+                future = self.futures.get(job_id)
+            if future is not None:
+                future.cancel()
+        return self.store.get(job_id)
+
+    def stats(self):
+        with self.lock:
+            local = len(self.futures)
+        return {"max_workers": self.max_workers, "lease": self.lease, "local_jobs": local, "jobs": self.store.stats()}
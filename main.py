@@ -1,32 +1,51 @@
-from fastapi import FastAPI
-import pandas as pd
-from typing import List
-from pydantic import BaseModel
+import asyncio
+import math
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import Annotated, Any, Dict, List, Optional
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
+import tables
+from cache import cache_from_environment, canonical_key, make_etag, etag_matches
+from engine import calculate_submit
+from vectorized import MAX_DISCOUNT_RATE, calculate_batch, calculate_batch_columnar
+from montecarlo import run_monte_carlo
+from sensitivity import run_sweep
+from budget import run_budget_impact
+from breakeven import solve_break_even, cost_frontier
+from formats import JSON, negotiate, is_columnar, encode, to_columnar
+from export import grid_axes, grid_size, export_lines, gzip_stream
+from workers import Overloaded, pool_from_environment, simulation_pool
+from jobs import JobManager
+from whatif import SessionStore
+from telemetry import Gauge, MetricsMiddleware, RequestLog, Timings, registry
 
 app = FastAPI()
 
 
 
-# Function to calculate total cost for a drug
-def calculate_total_cost(dosage, cost_per_vial, procedure_cost, consulting_charges, oct_cost, travel_cost, food_cost, miscellaneous_cost, patient_lost_opportunity_cost, caregiver_lost_opportunity_cost):
-    dosage = int(dosage)
-    dosage_half = dosage / 2
+from fastapi import FastAPI, Form
 
-    total_package_cost = int((cost_per_vial + procedure_cost) * dosage)
-    total_consulting_charges = int(consulting_charges * (dosage + dosage_half))
-    total_oct_charges = int(oct_cost * (dosage + dosage_half))
-    total_travel_food_cost = int((travel_cost + food_cost + miscellaneous_cost) * (dosage + dosage_half))
-    total_opportunity_cost_lost = int((patient_lost_opportunity_cost * (dosage + dosage_half)) + (caregiver_lost_opportunity_cost * (dosage + dosage_half)))
 
-    total_cost_per_patient = (total_package_cost + total_consulting_charges + total_oct_charges +
-                            total_travel_food_cost + total_opportunity_cost_lost)
-    
-    return total_package_cost, total_consulting_charges, total_oct_charges, total_travel_food_cost, total_opportunity_cost_lost, total_cost_per_patient
+@asynccontextmanager
+async def lifespan(app):
+    request_log.start()
+    yield
+    request_log.stop()
+    # Process pool workers inherit the listening socket; stop them with the server
+    calculator_pool.shutdown()
+    job_manager.shutdown()
+    simulation_pool.shutdown()
 
-from fastapi import FastAPI, Form
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://10.1.75.50:3000",
@@ -80,284 +99,430 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
+
+def finite(value):
+    # Non-finite floats as strings, since JSON has no literal for them
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    if isinstance(value, dict):
+        return {key: finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [finite(item) for item in value]
+    return value
+
+
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    # FastAPI's 422 body, except that a rejected Infinity or NaN is echoed back as a string instead of failing to encode
+    return JSONResponse(status_code=422, content={"detail": finite(jsonable_encoder(exc.errors()))})
+
 @app.get("/")
 async def status_check():    
     return {"status": "Healthy and running project is on live"}
 
 
+Cost = Annotated[int, Field(ge=-tables.MAX_COST, le=tables.MAX_COST)]
+Dosage = Annotated[int, Field(ge=-tables.MAX_DOSAGE, le=tables.MAX_DOSAGE)]
+Finite = Annotated[float, Field(allow_inf_nan=False)]
+
+
 class InputData(BaseModel):
     account_type: str = "Government Account"
-    drugs_selected: List[str] = ["Drug 1", "Drug 2", "Drug 3", "Drug 4", "Drug 5"]
+    drugs_selected: List[str] = list(tables.DRUGS)
     disease_indication: str = "WET AMD"
     time_horizon: str = "1"
     government_ac: str = "Yes"
     patient_support: str = "Yes"
     naive_switch: str = "Naive"
     clinical_status: str = "Per Label"
-    drug1_dosage: int = 6
-    drug2_dosage: int = 8
-    drug3_dosage: int = 8
-    drug4_dosage: int = 12
-    drug5_dosage: int = 12
-    procedure_cost: int = 1000
-    oct_cost: int = 200
-    consulting_charges: int = 200
-    miscellaneous_cost: int = 100
-    travel_cost: int = 100
-    food_cost: int = 100
-    patient_lost_opportunity_cost: int = 1000
-    caregiver_lost_opportunity_cost: int = 1000
+    drug1_dosage: Dosage = 6
+    drug2_dosage: Dosage = 8
+    drug3_dosage: Dosage = 8
+    drug4_dosage: Dosage = 12
+    drug5_dosage: Dosage = 12
+    procedure_cost: Cost = 1000
+    oct_cost: Cost = 200
+    consulting_charges: Cost = 200
+    miscellaneous_cost: Cost = 100
+    travel_cost: Cost = 100
+    food_cost: Cost = 100
+    patient_lost_opportunity_cost: Cost = 1000
+    caregiver_lost_opportunity_cost: Cost = 1000
     First_Drug: str = "Drug 1"
     Second_Drug: str = "Drug 2"
+    # RWE dosage per drug; overrides drugN_dosage and covers drugs added to the tables after those fields
+    drug_dosages: Dict[str, Dosage] = {}
+    # "selected": cumulative costs of every selected drug, "pairs": also the difference of every pair
+    comparison: Optional[str] = None
+    # Cumulative series per "yearly", "quarterly" or "monthly" period, optionally discounted (annual rate, e.g. 0.03)
+    resolution: str = "yearly"
+    discount_rate: float = Field(0.0, ge=0, le=MAX_DISCOUNT_RATE, allow_inf_nan=False)
+
+response_cache = cache_from_environment()
+
+calculator_pool = pool_from_environment()
+
+request_log = RequestLog("submit", sample_rate=float(os.environ.get("LOG_SAMPLE_RATE", "1")))
+
+# Background jobs are kept in JOB_STORE, by default i-open-jobs.sqlite3 in DATA_DIR (the system temp directory unless set);
+# every API worker that should see the same jobs needs the same file
+job_store = os.environ.get("JOB_STORE", os.path.join(os.environ.get("DATA_DIR", tempfile.gettempdir()), "i-open-jobs.sqlite3"))
+job_manager = JobManager(os.path.abspath(job_store), max_workers=int(os.environ.get("JOB_WORKERS", "2")),
+                         lease=float(os.environ.get("JOB_LEASE", "30")))
+
+session_store = SessionStore(max_sessions=int(os.environ.get("WHATIF_SESSIONS", "1000")),
+                             idle_ttl=float(os.environ.get("WHATIF_IDLE_TTL", "900")))
+
+
+async def calculate(fn, *args):
+    # Run a calculation on the worker pool and map its failures to HTTP errors
+    try:
+        return await calculator_pool.run(fn, *args)
+    except Overloaded:
+        raise HTTPException(status_code=503, detail="Calculator is at capacity, retry shortly", headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Calculation timed out")
+    except (ValueError, OverflowError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def priced(fn, *args):
+    # Worker side: run fn with one version of the pricing tables and report which one
+    pricing = tables.current()
+    return pricing.version, fn(*args, pricing=pricing)
+
+
+def render_submit(data, media_type=JSON):
+    # Worker side of /submit: compute and encode, so only bytes (and stage timings) travel back to the event loop
+    timings = Timings()
+    pricing = tables.current()
+    result = calculate_submit(data, timings, pricing)
+    with timings.stage("serialize"):
+        body = encode(to_columnar(result) if is_columnar(media_type) else result, media_type)
+    return pricing.version, result["drug_dosages_side_bar_data"], body, timings.stages
+
 
 @app.post("/submit")
-async def submit_form(data: InputData):
-    
-    for i in data:
-        print(i)
-    
-    account_type = data.account_type
-    drugs_selected = data.drugs_selected
-    disease_indication = data.disease_indication
-    time_horizon = data.time_horizon
-    government_ac = data.government_ac
-    patient_support = data.patient_support
-    naive_switch = data.naive_switch
-    clinical_status = data.clinical_status
-    drug1_dosage = data.drug1_dosage
-    drug2_dosage = data.drug2_dosage
-    drug3_dosage = data.drug3_dosage
-    drug4_dosage = data.drug4_dosage
-    drug5_dosage = data.drug5_dosage
-    procedure_cost = data.procedure_cost
-    oct_cost = data.oct_cost
-    consulting_charges = data.consulting_charges
-    miscellaneous_cost = data.miscellaneous_cost
-    travel_cost = data.travel_cost
-    food_cost = data.food_cost
-    patient_lost_opportunity_cost = data.patient_lost_opportunity_cost
-    caregiver_lost_opportunity_cost = data.caregiver_lost_opportunity_cost
-    First_Drug = data.First_Drug
-    Second_Drug = data.Second_Drug
-    
-    
-    
-    if account_type == "Government Account":
-        drug1_cost_per_vial=60000  #---Drug 1 = Faricimab
-        drug2_cost_per_vial=45000 #---Drug 2 = Aflibercept
-        drug3_cost_per_vial=25000 #---Drug 3 = Brolucizumab
-        drug4_cost_per_vial=18000  #---Drug 4 = Ranibizumab
-        drug5_cost_per_vial=10000  #---Drug 5 = Rani Biosimilar
-        
-    if account_type == "Trade Account":
-        if patient_support == "Yes":
-            drug1_cost_per_vial=30000 
-            drug2_cost_per_vial=24000 
-            drug3_cost_per_vial=35000 
-            drug4_cost_per_vial=25000 
-            drug5_cost_per_vial=20000 
-            
-        else:
-            drug1_cost_per_vial=75000  
-            drug2_cost_per_vial=60000 
-            drug3_cost_per_vial=35000 
-            drug4_cost_per_vial=25000  
-            drug5_cost_per_vial=20000 
-    
-    
-    drug_dosages = {
-        ("WET AMD", "1", "Naive", "Per Label"): {"Drug 1": 6, "Drug 2": 8, "Drug 3": 8, "Drug 4": 12, "Drug 5": 12},
-        ("WET AMD", "2", "Naive", "Per Label"): {"Drug 1": 9, "Drug 2": 14, "Drug 3": 12, "Drug 4": 24, "Drug 5": 24},
-        ("WET AMD", "3", "Naive", "Per Label"): {"Drug 1": 12, "Drug 2": 20, "Drug 3": 16, "Drug 4": 36, "Drug 5": 36},
-        ("WET AMD", "4", "Naive", "Per Label"): {"Drug 1": 15, "Drug 2": 26, "Drug 3": 20, "Drug 4": 48, "Drug 5": 48},
-        ("WET AMD", "5", "Naive", "Per Label"): {"Drug 1": 18, "Drug 2": 32, "Drug 3": 24, "Drug 4": 60, "Drug 5": 60},
-        ("DME", "1", "Naive", "Per Label"): {"Drug 1": 6, "Drug 2": 9, "Drug 3": 9, "Drug 4": 12, "Drug 5": 12},
-        ("DME", "2", "Naive", "Per Label"): {"Drug 1": 9, "Drug 2": 15, "Drug 3": 13, "Drug 4": 24, "Drug 5": 24},
-        ("DME", "3", "Naive", "Per Label"): {"Drug 1": 12, "Drug 2": 21, "Drug 3": 17, "Drug 4": 36, "Drug 5": 36},
-        ("DME", "4", "Naive", "Per Label"): {"Drug 1": 15, "Drug 2": 27, "Drug 3": 21, "Drug 4": 48, "Drug 5": 48},
-        ("DME", "5", "Naive", "Per Label"): {"Drug 1": 18, "Drug 2": 33, "Drug 3": 25, "Drug 4": 60, "Drug 5": 60},
-        ("WET AMD", None, "Switch", "Per Label"): {"Drug 1": 3, "Drug 2": 6, "Drug 3": 4, "Drug 4": 12, "Drug 5": 12},
-        ("DME", None, "Switch", "Per Label"): {"Drug 1": 3, "Drug 2": 6, "Drug 3": 4, "Drug 4": 12, "Drug 5": 12},
-    }
-    
-    if clinical_status == "Per Label":
-        
-        key = (disease_indication, time_horizon if naive_switch == "Naive" else None, naive_switch, clinical_status)
-        dosage_info = drug_dosages.get(key, {})
-        
-        drug_dosages_side_bar_data = dosage_info
-        
-        dosage_info = { i:j for i,j in dosage_info.items() if i in drugs_selected }
-
-        try:drug1_dosage = dosage_info.get("Drug 1") 
-        except: drug1_dosage = 0
-        try:drug2_dosage = dosage_info.get("Drug 2") 
-        except: drug2_dosage = 0
-        try:drug3_dosage = dosage_info.get("Drug 3") 
-        except: drug3_dosage = 0
-        try:drug4_dosage = dosage_info.get("Drug 4") 
-        except: drug4_dosage = 0
-        try:drug5_dosage = dosage_info.get("Drug 5") 
-        except: drug5_dosage = 0
-
-    if clinical_status == "RWE":
-        drug_dosages_side_bar_data = {'Drug 1': drug1_dosage, 'Drug 2': drug2_dosage, 'Drug 3': drug3_dosage, 'Drug 4': drug4_dosage, 'Drug 5': drug5_dosage}
-    
-    # ------------------------------------------- bar graph data ----------------------------------------------
-    
-    # Dictionary to hold drug details
-    drugs = {
-        'Drug 1': {'dosage': drug1_dosage, 'cost_per_vial': drug1_cost_per_vial},
-        'Drug 2': {'dosage': drug2_dosage, 'cost_per_vial': drug2_cost_per_vial},
-        'Drug 3': {'dosage': drug3_dosage, 'cost_per_vial': drug3_cost_per_vial},
-        'Drug 4': {'dosage': drug4_dosage, 'cost_per_vial': drug4_cost_per_vial},
-        'Drug 5': {'dosage': drug5_dosage, 'cost_per_vial': drug5_cost_per_vial}
-    }
-    
-    drugs = {i: (j if i in drugs_selected else None) for i, j in drugs.items()}
-    
-    # Dictionary to hold calculated costs
-    drug_costs = {}
-
-    # Calculate costs for each drug
-    for drug, details in drugs.items():
-        if details != None:
-            drug_costs[drug] = calculate_total_cost(details['dosage'], details['cost_per_vial'], procedure_cost, consulting_charges, oct_cost, travel_cost, food_cost, miscellaneous_cost, patient_lost_opportunity_cost, caregiver_lost_opportunity_cost)
-        if details == None:
-            drug_costs[drug] = (0, 0, 0, 0, 0, 0)
-
-    # Unpack costs for individual drugs if needed
-    drug1_total_package_cost, drug1_total_consulting_charges, drug1_total_oct_charges, drug1_total_travel_food_cost, drug1_total_opportunity_cost_lost, drug1_total_cost_per_patient = drug_costs['Drug 1']
-    drug2_total_package_cost, drug2_total_consulting_charges, drug2_total_oct_charges, drug2_total_travel_food_cost, drug2_total_opportunity_cost_lost, drug2_total_cost_per_patient = drug_costs['Drug 2']
-    drug3_total_package_cost, drug3_total_consulting_charges, drug3_total_oct_charges, drug3_total_travel_food_cost, drug3_total_opportunity_cost_lost, drug3_total_cost_per_patient = drug_costs['Drug 3']
-    drug4_total_package_cost, drug4_total_consulting_charges, drug4_total_oct_charges, drug4_total_travel_food_cost, drug4_total_opportunity_cost_lost, drug4_total_cost_per_patient = drug_costs['Drug 4']
-    drug5_total_package_cost, drug5_total_consulting_charges, drug5_total_oct_charges, drug5_total_travel_food_cost, drug5_total_opportunity_cost_lost, drug5_total_cost_per_patient = drug_costs['Drug 5']
-
-    bar_graph_data = pd.DataFrame(columns=["Total Package Cost","Consulting Charges","OCT Charges","Travel and Food Costs","Total Opportunity Cost Lost","Total Cost/Patient"])
-    bar_graph_data.loc[0] = [drug1_total_package_cost, drug1_total_consulting_charges, drug1_total_oct_charges, drug1_total_travel_food_cost, drug1_total_opportunity_cost_lost, drug1_total_cost_per_patient]
-    bar_graph_data.loc[1] = [drug2_total_package_cost, drug2_total_consulting_charges, drug2_total_oct_charges, drug2_total_travel_food_cost, drug2_total_opportunity_cost_lost, drug2_total_cost_per_patient]
-    bar_graph_data.loc[2] = [drug3_total_package_cost, drug3_total_consulting_charges, drug3_total_oct_charges, drug3_total_travel_food_cost, drug3_total_opportunity_cost_lost, drug3_total_cost_per_patient]
-    bar_graph_data.loc[3] = [drug4_total_package_cost, drug4_total_consulting_charges, drug4_total_oct_charges, drug4_total_travel_food_cost, drug4_total_opportunity_cost_lost, drug4_total_cost_per_patient]
-    bar_graph_data.loc[4] = [drug5_total_package_cost, drug5_total_consulting_charges, drug5_total_oct_charges, drug5_total_travel_food_cost, drug5_total_opportunity_cost_lost, drug5_total_cost_per_patient]
-    
-    # ------------------------------------------ Total Package Cost ------------------------------------------
-    
-    Total_Package_Cost_data = pd.DataFrame(columns=["Total Package Cost", "Direct Costs", "Indirect Costs","Total Cost"])
-    
-    
-    for i in range(len(bar_graph_data)):
-        val = bar_graph_data.iloc[i]
-        Total_Package_Cost_value = val["Total Package Cost"]
-        Direct_Costs = val["Consulting Charges"] + val["OCT Charges"]
-        Indirect_Costs = val["Travel and Food Costs"] + val["Total Opportunity Cost Lost"]
-        total_costs = Total_Package_Cost_value + Direct_Costs + Indirect_Costs
-        Total_Package_Cost_data.loc[i] = [Total_Package_Cost_value, Direct_Costs, Indirect_Costs, total_costs]
-
-    # ------------------------------------------ Cumulative Costs Comparison ------------------------------------------
-    
-    cumulative_predefined_drug1_perlabel_dosage_y1=6
-    
-    if disease_indication=="WET AMD":
-        cumulative_predefined_drug1_perlabel_dosage_y1=6
-        cumulative_predefined_drug2_perlabel_dosage_y1=8
-        cumulative_predefined_drug3_perlabel_dosage_y1=8
-        cumulative_predefined_drug4_perlabel_dosage_y1=12
-        cumulative_predefined_drug5_perlabel_dosage_y1=12
-    elif disease_indication=="DME":
-        cumulative_predefined_drug1_perlabel_dosage_y1=6
-        cumulative_predefined_drug2_perlabel_dosage_y1=9
-        cumulative_predefined_drug3_perlabel_dosage_y1=9
-        cumulative_predefined_drug4_perlabel_dosage_y1=12
-        cumulative_predefined_drug5_perlabel_dosage_y1=12
-
-    dist_y1 = {"Drug 1": cumulative_predefined_drug1_perlabel_dosage_y1, "Drug 2": cumulative_predefined_drug2_perlabel_dosage_y1, "Drug 3": cumulative_predefined_drug3_perlabel_dosage_y1, "Drug 4": cumulative_predefined_drug4_perlabel_dosage_y1, "Drug 5": cumulative_predefined_drug5_perlabel_dosage_y1}
-    
-    cumulative_predefined_drug1_perlabel_dosage_y2345=3
-    cumulative_predefined_drug2_perlabel_dosage_y2345=6
-    cumulative_predefined_drug3_perlabel_dosage_y2345=4
-    cumulative_predefined_drug4_perlabel_dosage_y2345=12
-    cumulative_predefined_drug5_perlabel_dosage_y2345=12
-    
-    dist_y2345 = {"Drug 1": cumulative_predefined_drug1_perlabel_dosage_y2345, "Drug 2": cumulative_predefined_drug2_perlabel_dosage_y2345, "Drug 3": cumulative_predefined_drug3_perlabel_dosage_y2345, "Drug 4": cumulative_predefined_drug4_perlabel_dosage_y2345, "Drug 5": cumulative_predefined_drug5_perlabel_dosage_y2345}
-    
-    dist_cost_per_vial = {"Drug 1": drug1_cost_per_vial, "Drug 2": drug2_cost_per_vial, "Drug 3": drug3_cost_per_vial, "Drug 4": drug4_cost_per_vial, "Drug 5": drug5_cost_per_vial}
-    dist_dosage = {"Drug 1": drug1_dosage, "Drug 2": drug2_dosage, "Drug 3": drug3_dosage, "Drug 4": drug4_dosage, "Drug 5": drug5_dosage}
-    
-    def calculate_cumulative_costs( Time_Horizon_value, cumulative_predefined_value_drug_num,cumulative_predefined_value_drug_num_2345,drug_cost_per_vial_value,drug_dosage_value):
-        dist_all = {}
-        indirect_cost = 0
-        direct_cost = 0
-        total_package_cost = 0
-        indirect_cost_list = []
-        direct_cost_list = []
-        total_package_cost_list = []
-        
-        for i in range(0,int(Time_Horizon_value)):
-            
-            if clinical_status=="Per Label":
-                
-                
-                if i == 0 : 
-                    
-                    cumulative_direct_cost_y1=(consulting_charges*cumulative_predefined_value_drug_num)+(consulting_charges*(cumulative_predefined_value_drug_num//2))+(oct_cost*cumulative_predefined_value_drug_num)+(oct_cost*(cumulative_predefined_value_drug_num//2))
-            
-                    cumulative_indirect_cost_y1=((travel_cost+miscellaneous_cost+food_cost)*cumulative_predefined_value_drug_num)+((travel_cost+miscellaneous_cost+food_cost)*(cumulative_predefined_value_drug_num//2))+(patient_lost_opportunity_cost*cumulative_predefined_value_drug_num)+(patient_lost_opportunity_cost*(cumulative_predefined_value_drug_num//2))+(caregiver_lost_opportunity_cost*cumulative_predefined_value_drug_num)+(caregiver_lost_opportunity_cost*(cumulative_predefined_value_drug_num//2))
-
-                    cumulative_total_package_cost_y1=(drug_cost_per_vial_value+procedure_cost)*cumulative_predefined_value_drug_num
-                    
-                if i == 1 or i == 2 or i == 3 or i == 4:
-                    
-                    cumulative_direct_cost_y1=int(((consulting_charges*cumulative_predefined_value_drug_num_2345)+(consulting_charges*(cumulative_predefined_value_drug_num_2345/2))+(oct_cost*cumulative_predefined_value_drug_num_2345)+(oct_cost*(cumulative_predefined_value_drug_num_2345/2))))
-
-                    cumulative_indirect_cost_y1=int((((travel_cost+miscellaneous_cost+food_cost)*cumulative_predefined_value_drug_num_2345)+((travel_cost+miscellaneous_cost+food_cost)*(cumulative_predefined_value_drug_num_2345/2))+(patient_lost_opportunity_cost*cumulative_predefined_value_drug_num_2345)+(patient_lost_opportunity_cost*(cumulative_predefined_value_drug_num_2345/2))+(caregiver_lost_opportunity_cost*cumulative_predefined_value_drug_num_2345)+(caregiver_lost_opportunity_cost*(cumulative_predefined_value_drug_num_2345/2))))
-
-                    cumulative_total_package_cost_y1=(drug_cost_per_vial_value+procedure_cost)*cumulative_predefined_value_drug_num_2345
-                
-            
-            if  clinical_status =="RWE":
-                
-                if i == 0 : 
-                    
-                    cumulative_direct_cost_y1=int((consulting_charges*drug_dosage_value)+(consulting_charges*(drug_dosage_value/2))+(oct_cost*drug_dosage_value)+(oct_cost*(drug_dosage_value/2)))
-                    cumulative_indirect_cost_y1=int(((travel_cost+miscellaneous_cost+food_cost)*drug_dosage_value)+((travel_cost+miscellaneous_cost+food_cost)*(drug_dosage_value/2))+(patient_lost_opportunity_cost*drug_dosage_value)+(caregiver_lost_opportunity_cost*(drug_dosage_value/2)))   
-                    cumulative_total_package_cost_y1=(drug_cost_per_vial_value+procedure_cost)*cumulative_predefined_value_drug_num
-                
-                if i == 1 or i == 2 or i == 3 or i == 4:
-                    
-                    cumulative_direct_cost_y1=int(((consulting_charges*drug_dosage_value)+(consulting_charges*(drug_dosage_value/2))+(oct_cost*drug_dosage_value)+(oct_cost*(drug_dosage_value/2))))
-                    cumulative_indirect_cost_y1=int(((travel_cost+miscellaneous_cost+food_cost)*drug_dosage_value)+((travel_cost+miscellaneous_cost+food_cost)*(drug_dosage_value/2))+(patient_lost_opportunity_cost*drug_dosage_value)+(caregiver_lost_opportunity_cost*(drug_dosage_value/2)))   
-                    cumulative_total_package_cost_y1=(drug_cost_per_vial_value+procedure_cost)*cumulative_predefined_value_drug_num_2345
-
-            
-            indirect_cost += cumulative_indirect_cost_y1
-            direct_cost += cumulative_direct_cost_y1
-            total_package_cost += cumulative_total_package_cost_y1
-            
-            indirect_cost_list.append(indirect_cost)
-            direct_cost_list.append(direct_cost)
-            total_package_cost_list.append(total_package_cost)
-         
-        dist_all["Indirect_Costs"] = indirect_cost_list + [0]*(5 - len(indirect_cost_list))
-        dist_all["Direct_Costs"] = direct_cost_list + [0]*(5 - len(direct_cost_list))
-        dist_all["Package_Cost"] = total_package_cost_list + [0]*(5 - len(total_package_cost_list))
-            
-
-        return dist_all
-    
-        
-    d1 = calculate_cumulative_costs( time_horizon, dist_y1[First_Drug],dist_y2345[First_Drug],dist_cost_per_vial[First_Drug],dist_dosage[First_Drug])
-    d2 = calculate_cumulative_costs( time_horizon,dist_y1[Second_Drug],dist_y2345[Second_Drug],dist_cost_per_vial[Second_Drug],dist_dosage[Second_Drug])
-
-        
-    
-    bar_graph_data = [ {"data": list(j.values()) } for i,j in bar_graph_data.to_dict().items() ]
-    dir_indir_total_cost = {0:"Direct Costs",1:"Indirect Costs",2:"Package Cost"}
-    Total_Package_Cost_data = [ {"data":[ i for ids,i in enumerate(list(i.values())) if ids != 3 ] } for i in Total_Package_Cost_data.to_dict(orient="records")]
-    print('--------------')
-    print(drug_dosages_side_bar_data)
-    return {"drug_dosages_side_bar_data" : drug_dosages_side_bar_data,
-            "bar_gragh_data": bar_graph_data,
-            "Total_Package_Cost": Total_Package_Cost_data,
-            "First_Drug_data" : d1,
-            "Second_Drug_data" : d2}
-            
+async def submit_form(data: InputData, request: Request):
+    # Stages go back in the Server-Timing header and into the /metrics histograms
+    timings = request.state.timings = Timings()
+    timings.add("validate", time.perf_counter() - request.state.started)
+
+    media_type = negotiate(request.headers.get("accept"))
+    with timings.stage("cache"):
+        # One entry (and ETag) per encoding of the same scenario; a new version of the tables misses everything
+        key = canonical_key(data) if media_type == JSON else f"{canonical_key(data)}:{media_type}"
+        version = tables.current().version
+        cached = response_cache.get(key, version)
+
+    drug_dosages_side_bar_data = None
+    if cached is None:
+        start = time.perf_counter()
+        version, drug_dosages_side_bar_data, body, stages = await calculate(render_submit, data, media_type)
+        for name, seconds in stages.items():
+            timings.add(name, seconds)
+        timings.add("queue", time.perf_counter() - start - sum(stages.values()))
+
+        cached = (make_etag(body), body)
+        response_cache.put(key, version, cached)
+
+    if request_log.sampled():
+        request_log.log("submit", input=data.model_dump(), cache="hit" if drug_dosages_side_bar_data is None else "miss",
+                        drug_dosages_side_bar_data=drug_dosages_side_bar_data, table_version=version, timings=timings.stages)
+
+    etag, body = cached
+    headers = {"ETag": etag, "Vary": "Accept", "X-Table-Version": version}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return response_cache.stats()
+
+
+@app.get("/tables")
+async def table_stats():
+    # Version of the pricing tables this API worker serves and the state of its reloads
+    return tables.source.stats()
+
+
+@app.get("/pool/stats")
+async def pool_stats():
+    return calculator_pool.stats()
+
+
+registry.register(Gauge("calculator_pool_in_flight", "Calculations running or queued on the pool.", lambda: calculator_pool.in_flight))
+registry.register(Gauge("calculator_pool_rejected_total", "Calculations rejected because the pool was full.",
+                        lambda: calculator_pool.rejected, kind="counter"))
+registry.register(Gauge("calculator_pool_timeouts_total", "Calculations that timed out.", lambda: calculator_pool.timeouts, kind="counter"))
+registry.register(Gauge("submit_cache_hits_total", "/submit responses served from the cache.", lambda: response_cache.hits, kind="counter"))
+registry.register(Gauge("submit_cache_misses_total", "/submit responses computed.", lambda: response_cache.misses, kind="counter"))
+registry.register(Gauge("pricing_tables_reloads_total", "New versions of the pricing tables loaded.", lambda: tables.source.reloads,
+                        kind="counter"))
+registry.register(Gauge("pricing_tables_errors_total", "Changed pricing table files that failed to load.", lambda: tables.source.errors,
+                        kind="counter"))
+registry.register(Gauge("submit_cache_entries", "Live /submit cache entries (shared by all workers with SUBMIT_CACHE_PATH).",
+                        lambda: response_cache.stats()["size"]))
+registry.register(Gauge("whatif_sessions", "What-if sessions held by this worker.", lambda: len(session_store.sessions)))
+registry.register(Gauge("submit_cache_memory_bytes", "Memory held by the /submit cache.", lambda: response_cache.stats()["memory_bytes"]))
+
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text format; each API worker process reports its own requests
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+def render_batch(data, media_type=JSON, pricing=None):
+    return encode(calculate_batch_columnar(data, pricing) if is_columnar(media_type) else calculate_batch(data, pricing), media_type)
+
+
+@app.post("/submit/batch")
+async def submit_batch(data: List[InputData], request: Request):
+    # Every scenario is priced in one vectorized pass; each item matches the /submit response for it
+    media_type = negotiate(request.headers.get("accept"))
+    version, body = await calculate(priced, render_batch, data, media_type)
+    return Response(body, media_type=media_type, headers={"Vary": "Accept", "X-Table-Version": version})
+
+
+class Distribution(BaseModel):
+    kind: str = "fixed"
+    value: Optional[Finite] = None
+    mean: Optional[Finite] = None
+    sd: Optional[Finite] = None
+    low: Optional[Finite] = None
+    high: Optional[Finite] = None
+    mode: Optional[Finite] = None
+    min: Optional[Finite] = None
+    max: Optional[Finite] = None
+
+
+class MonteCarloRequest(BaseModel):
+    base: InputData = InputData()
+    distributions: Dict[str, Distribution] = {}
+    draws: int = Field(100000, ge=1, le=1000000)
+    seed: int = 0
+    chunk_size: int = Field(50000, ge=1000, le=1000000)
+    percentiles: List[float] = [2.5, 50, 97.5]
+
+
+@app.post("/submit/montecarlo")
+async def submit_montecarlo(request: MonteCarloRequest):
+    distributions = {field: spec.model_dump() for field, spec in request.distributions.items()}
+    version, result = await calculate(priced, run_monte_carlo, request.base, distributions, request.draws, request.seed,
+                                      request.chunk_size, request.percentiles)
+    return JSONResponse(result, headers={"X-Table-Version": version})
+
+
+class SweepParameter(BaseModel):
+    name: str
+    low: Optional[int] = None
+    high: Optional[int] = None
+    points: int = Field(2, ge=2, le=200)
+    values: Optional[List[int]] = None
+
+
+class SensitivityRequest(BaseModel):
+    base: InputData = InputData()
+    parameters: List[SweepParameter]
+
+
+@app.post("/submit/sensitivity")
+async def submit_sensitivity(request: SensitivityRequest):
+    version, result = await calculate(priced, run_sweep, request.base, [parameter.model_dump() for parameter in request.parameters])
+    # The grid is plain lists of ints already; skip jsonable_encoder, which dominates large sweeps
+    return JSONResponse(result, headers={"X-Table-Version": version})
+
+
+class BudgetImpactRequest(BaseModel):
+    base: InputData = InputData()
+    patients: int = Field(10000, ge=1, le=10000000)
+    years: int = Field(5, ge=1, le=30)
+    disease_mix: Dict[str, float] = {"WET AMD": 1.0}
+    naive_switch_mix: Dict[str, float] = {"Naive": 1.0}
+    market_share: List[Dict[str, float]] = [{drug: 1 / len(tables.DRUGS) for drug in tables.DRUGS}]
+    discontinuation: Dict[str, float] = {}
+    seed: int = 0
+    chunk_size: int = Field(100000, ge=1000, le=1000000)
+
+
+@app.post("/submit/budget")
+async def submit_budget(request: BudgetImpactRequest):
+    version, result = await calculate(priced, run_budget_impact, request.base, request.patients, request.years, request.disease_mix,
+                                      request.naive_switch_mix, request.market_share, request.discontinuation, request.seed,
+                                      request.chunk_size)
+    return JSONResponse(result, headers={"X-Table-Version": version})
+
+
+class BreakEvenRequest(BaseModel):
+    base: InputData = InputData()
+    drug: str = "Drug 2"
+    reference: str = "Drug 1"
+    # "vial_price", "dosage" (RWE) or "horizon"
+    variable: str = "vial_price"
+    # "per_patient" (Total Cost/Patient) or "cumulative" (cumulative cost at the end of the horizon)
+    metric: str = "cumulative"
+
+
+@app.post("/submit/breakeven")
+async def submit_breakeven(request: BreakEvenRequest):
+    version, result = await calculate(priced, solve_break_even, request.base, request.drug, request.reference, request.variable,
+                                      request.metric)
+    return JSONResponse(result, headers={"X-Table-Version": version})
+
+
+@app.post("/submit/frontier")
+async def submit_frontier(data: InputData):
+    version, result = await calculate(priced, cost_frontier, data)
+    return JSONResponse(result, headers={"X-Table-Version": version})
+
+
+class GridRange(BaseModel):
+    low: int
+    high: int
+    step: int = Field(1, ge=1)
+
+
+class ExportRequest(BaseModel):
+    base: InputData = InputData()
+    axes: Dict[str, List[Any]] = {}
+    ranges: Dict[str, GridRange] = {}
+    batch_size: int = Field(512, ge=1, le=10000)
+    gzip: bool = False
+    columnar: bool = False
+
+
+@app.post("/submit/export")
+def submit_export(request: ExportRequest):
+    # NDJSON, one line per grid point, written batch by batch as the grid is priced
+    try:
+        axes = grid_axes(request.base, request.axes, {name: range(r.low, r.high + 1, r.step) for name, r in request.ranges.items()})
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    pricing = tables.current()
+    body = export_lines(request.base, axes, request.batch_size, request.columnar, pricing)
+    headers = {"X-Grid-Size": str(grid_size(axes)), "X-Table-Version": pricing.version}
+    if request.gzip:
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
+
+
+# ------------------------------------------ Background jobs ------------------------------------------
+#
+# Same requests as the endpoints above, run in the background. Identical requests share one job.
+
+def submit_job(kind, request, fn, *args):
+    # The job prices with the tables of the version in its id, even if a new version is loaded before it runs
+    pricing = tables.current()
+    job = job_manager.submit(kind, {"request": request.model_dump()}, pricing.version, partial(fn, pricing=pricing), *args)
+    return JSONResponse(job, status_code=202, headers={"Location": f"/jobs/{job['id']}"})
+
+
+@app.post("/jobs/montecarlo")
+def submit_montecarlo_job(request: MonteCarloRequest):
+    distributions = {field: spec.model_dump() for field, spec in request.distributions.items()}
+    return submit_job("montecarlo", request, run_monte_carlo, request.base, distributions, request.draws, request.seed,
+                      request.chunk_size, request.percentiles)
+
+
+@app.post("/jobs/sensitivity")
+def submit_sensitivity_job(request: SensitivityRequest):
+    return submit_job("sensitivity", request, run_sweep, request.base, [parameter.model_dump() for parameter in request.parameters])
+
+
+@app.post("/jobs/budget")
+def submit_budget_job(request: BudgetImpactRequest):
+    return submit_job("budget", request, run_budget_impact, request.base, request.patients, request.years, request.disease_mix,
+                      request.naive_switch_mix, request.market_share, request.discontinuation, request.seed, request.chunk_size)
+
+
+@app.get("/jobs/stats")
+def job_stats():
+    return job_manager.stats()
+
+
+def get_job(job_id):
+    job = job_manager.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return get_job(job_id)
+
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = get_job(job_id)
+    if job["status"] in ("queued", "running"):
+        return JSONResponse(job, status_code=202)
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job {job['status']}: {job['error']}" if job["error"] else f"Job {job['status']}")
+    return Response(job_manager.store.result(job_id), media_type="application/json")
+
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    get_job(job_id)
+    return job_manager.cancel(job_id)
+
+
+# ------------------------------------------ What-if sessions ------------------------------------------
+#
+# A session holds one scenario; PATCH a few of its fields and get back a JSON Patch of the /submit
+# response, computed from only the outputs those fields affect.
+
+def get_session(session_id):
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return session
+
+
+@app.post("/whatif", status_code=201)
+def create_session(data: InputData):
+    pricing = tables.current()
+    try:
+        session_id, session = session_store.create(data, pricing)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    body = encode({"session_id": session_id, "table_version": pricing.version, "result": session.result}, JSON)
+    return Response(body, status_code=201, media_type=JSON, headers={"Location": f"/whatif/{session_id}", "X-Table-Version": pricing.version})
+
+
+@app.get("/whatif/stats")
+def session_stats():
+    return session_store.stats()
+
+
+@app.get("/whatif/{session_id}")
+def session_result(session_id: str):
+    session = get_session(session_id)
+    body = encode({"session_id": session_id, "inputs": session.data.model_dump(), "result": session.result}, JSON)
+    return Response(body, media_type=JSON, headers={"X-Table-Version": session.pricing.version})
+
+
+@app.patch("/whatif/{session_id}")
+def update_session(session_id: str, patch: Dict[str, Any]):
+    session = get_session(session_id)
+    try:
+        changed, operations = session.update(patch, tables.current())
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return Response(encode({"changed": changed, "patch": operations}, JSON), media_type=JSON,
+                    headers={"X-Table-Version": session.pricing.version})
+
+
+@app.delete("/whatif/{session_id}")
+def delete_session(session_id: str):
+    if not session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return {"session_id": session_id, "deleted": True}
@@ -0,0 +1,200 @@
+import numpy as np
+
+from tables import DRUGS, COST_FIELDS, MAX_COST, MAX_DOSAGE, dosage_drug
+from vectorized import resolve_scenario, calculate_costs, calculate_yearly_costs
+from workers import simulation_pool
+
+# Probabilistic sensitivity analysis: cost inputs (and RWE dosages) are drawn from user supplied
+# distributions and pushed through the vectorized cost model chunk by chunk.
+
+DISTRIBUTIONS = ("fixed", "normal", "lognormal", "gamma", "uniform", "triangular")
+PARAMETERS = ("value", "mean", "sd", "low", "high", "mode", "min", "max")
+
+
+def parameter_bound(field):
+    # Same bounds as the InputData field the draws replace
+    return MAX_DOSAGE if dosage_drug(field) else MAX_COST
+
+
+def check_distribution(field, spec, rwe):
+    """
+    Validate one distribution spec before any draw is made.
+
+    Args:
+        field (str): Cost field, or the drug (or legacy drugN_dosage field) whose RWE dosage is sampled.
+        spec (dict): kind plus its parameters (mean/sd, low/high, mode, value) and optional min/max clipping,
+                     each finite and within the bounds of the field.
+        rwe (bool): Whether the base scenario is RWE (dosages are only sampled in RWE mode).
+
+    Raises:
+        ValueError: If the field cannot be sampled or the parameters are invalid.
+    """
+    if dosage_drug(field):
+        if not rwe:
+            raise ValueError(f"{field} is only used in RWE mode; Per Label dosages come from the dosage tables")
+    elif field not in COST_FIELDS:
+        raise ValueError(f"Cannot sample {field!r}; expected a drug or one of {COST_FIELDS}")
+
+    kind = spec.get("kind")
+    if kind not in DISTRIBUTIONS:
+        raise ValueError(f"{field}: unknown distribution {kind!r}; expected one of {DISTRIBUTIONS}")
+    required = {"fixed": ("value",), "normal": ("mean", "sd"), "lognormal": ("mean", "sd"), "gamma": ("mean", "sd"),
+                "uniform": ("low", "high"), "triangular": ("low", "mode", "high")}[kind]
+    missing = [name for name in required if spec.get(name) is None]
+    if missing:
+        raise ValueError(f"{field}: {kind} distribution needs {', '.join(missing)}")
+    bound = parameter_bound(field)
+    for name in PARAMETERS:
+        # Written so that NaN fails too
+        if spec.get(name) is not None and not -bound <= spec[name] <= bound:
+            raise ValueError(f"{field}: {name} must be between {-bound} and {bound}")
+    if kind in ("lognormal", "gamma") and (spec["mean"] <= 0 or spec["sd"] <= 0):
+        raise ValueError(f"{field}: {kind} distribution needs a positive mean and sd")
+    if kind in ("normal",) and spec["sd"] < 0:
+        raise ValueError(f"{field}: sd must not be negative")
+    if kind in ("uniform", "triangular") and spec["low"] > spec["high"]:
+        raise ValueError(f"{field}: low must not exceed high")
+    if kind == "triangular" and not spec["low"] <= spec["mode"] <= spec["high"]:
+        raise ValueError(f"{field}: mode must lie between low and high")
+
+
+def sample(rng, spec, size):
+    kind = spec["kind"]
+    if kind == "fixed":
+        values = np.full(size, float(spec["value"]))
+    elif kind == "normal":
+        values = rng.normal(spec["mean"], spec["sd"], size)
+    elif kind == "lognormal":
+        # Parameterised by the mean and sd of the cost itself, not of its logarithm
+        sigma2 = np.log1p((spec["sd"] / spec["mean"]) ** 2)
+        values = rng.lognormal(np.log(spec["mean"]) - sigma2 / 2, np.sqrt(sigma2), size)
+    elif kind == "gamma":
+        shape = (spec["mean"] / spec["sd"]) ** 2
+        values = rng.gamma(shape, spec["mean"] / shape, size)
+    elif kind == "uniform":
+        values = rng.uniform(spec["low"], spec["high"], size)
+    else:
+        values = rng.triangular(spec["low"], spec["mode"], spec["high"], size)
+    if spec.get("min") is not None or spec.get("max") is not None:
+        values = np.clip(values, spec.get("min"), spec.get("max"))
+    return values
+
+
+def simulate_chunk(scenario, base_costs, distributions, size, seed):
+    """
+    Run one chunk of draws.
+
+    Args:
+        scenario (dict): Output of resolve_scenario for the base InputData.
+        base_costs (dict): Base value of every COST_FIELDS entry and of every drug's RWE dosage.
+        distributions (dict): Cost field or drug -> distribution spec.
+        size (int): Number of draws in the chunk.
+        seed (np.random.SeedSequence): Seed of this chunk.
+
+    Returns:
+        np.ndarray: float64 outputs, shape (size, drugs + 2): Total Cost/Patient per drug, then the
+                    cumulative total over the horizon for First_Drug and Second_Drug.
+    """
+    rng = np.random.default_rng(seed)
+    # Tails of the distributions are clipped to the bounds of the field, so no draw overflows the int64 costs
+    draws = {field: np.clip(sample(rng, distributions[field], size), -parameter_bound(field), parameter_bound(field))
+             for field in sorted(distributions)}
+
+    def column(field):
+        return draws[field] if field in draws else np.full(size, float(base_costs[field]))
+
+    # Costs are whole currency units, like the InputData fields they replace
+    costs = np.rint(np.stack([column(field) for field in COST_FIELDS], axis=1)).astype(np.int64)
+    selected = np.array(scenario["selected"])
+
+    # Dosages are whole vials; sampled RWE dosages are rounded and kept non-negative
+    input_dosage = np.stack([np.maximum(np.rint(column(drug)), 0).astype(np.int64) for drug in DRUGS], axis=1)
+    if scenario["rwe"]:
+        dosage = np.where(selected, input_dosage, 0)
+    else:
+        dosage = np.broadcast_to(np.array(scenario["dosage"], dtype=np.int64), (size, len(DRUGS)))
+
+    cost_per_vial = np.array(scenario["cost_per_vial"], dtype=np.int64)
+    totals = calculate_costs(dosage, cost_per_vial, costs, total_only=True)
+
+    # Cumulative totals only for the two compared drugs
+    pair = [scenario["first"], scenario["second"]]
+    yearly = calculate_yearly_costs(np.full(size, scenario["rwe"]), np.array(scenario["y1"])[pair], np.array(scenario["y2345"])[pair],
+                                    input_dosage[:, pair], cost_per_vial[pair], costs)
+    # Horizon total: the first year plus every later year, each later year discounted to the start of the horizon
+    years = scenario["years"]
+    later_weight = sum((1 + scenario["discount_rate"]) ** -year for year in range(1, years))
+    cumulative = (yearly[..., 0] + later_weight * yearly[..., 1]).sum(axis=2) if years > 0 else np.zeros((size, 2))
+
+    return np.concatenate([totals, cumulative], axis=1).astype(np.float64)
+
+
+def summarize(values, percentiles):
+    return {"mean": float(values.mean()),
+            "sd": float(values.std(ddof=1)) if len(values) > 1 else 0.0,
+            "percentiles": dict(zip((f"{p:g}" for p in percentiles), np.percentile(values, percentiles).tolist()))}
+
+
+def run_monte_carlo(data, distributions, draws=100000, seed=0, chunk_size=50000, percentiles=(2.5, 50, 97.5),
+                    progress=None, pricing=None):
+    """
+    Probabilistic sensitivity analysis over one base scenario.
+
+    Draws are split into chunks of chunk_size, each with its own child of SeedSequence(seed), so the
+    result depends only on the seed and chunk size, not on how many processes run the chunks
+    (workers.simulation_pool, sized with SIMULATION_WORKERS).
+
+    Args:
+        data (InputData): Base scenario; every field without a distribution keeps its value.
+        distributions (dict): Cost field or drug -> distribution spec (see check_distribution).
+        draws (int): Number of draws.
+        seed (int): RNG seed.
+        chunk_size (int): Draws per chunk; bounds the size of the intermediate arrays.
+        percentiles (tuple): Percentiles to report.
+        progress (callable): Called with the fraction of chunks done after each chunk.
+        pricing (PricingTables): Tables to price with; the current ones by default.
+
+    Returns:
+        dict: Mean, sd and percentiles of Total Cost/Patient for every selected drug and of the
+              cumulative totals of First_Drug and Second_Drug (discounted with data.discount_rate), plus
+              the probability that First_Drug is cheaper than Second_Drug over the time horizon.
+
+    Raises:
+        ValueError: If the base scenario or a distribution is invalid.
+    """
+    scenario = resolve_scenario(data, pricing)
+    for field, spec in distributions.items():
+        check_distribution(field, spec, scenario["rwe"])
+    # Dosage distributions are keyed by drug, whichever name they were given under
+    distributions = {dosage_drug(field) or field: spec for field, spec in distributions.items()}
+
+    base_costs = {field: getattr(data, field) for field in COST_FIELDS}
+    base_costs.update(zip(DRUGS, scenario["input_dosage"]))
+    sizes = [min(chunk_size, draws - start) for start in range(0, draws, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(scenario, base_costs, distributions, size, child) for size, child in zip(sizes, seeds)]
+
+    outputs = np.empty((draws, len(DRUGS) + 2))
+    starts = np.cumsum([0] + sizes[:-1])
+
+    def collect(chunks):
+        for done, (start, chunk) in enumerate(zip(starts, chunks), start=1):
+            outputs[start:start + len(chunk)] = chunk
+            if progress:
+                progress(done / len(args))
+
+    if len(args) > 1:
+        collect(simulation_pool.map(simulate_chunk, *zip(*args)))
+    else:
+        collect(simulate_chunk(*arg) for arg in args)
+
+    first, second = outputs[:, len(DRUGS)], outputs[:, len(DRUGS) + 1]
+    return {"draws": draws,
+            "seed": seed,
+            "chunks": len(sizes),
+            "Total_Cost_Per_Patient": {drug: summarize(outputs[:, index], percentiles)
+                                       for index, drug in enumerate(DRUGS) if scenario["selected"][index]},
+            "First_Drug_cumulative": summarize(first, percentiles),
+            "Second_Drug_cumulative": summarize(second, percentiles),
+            "difference": summarize(first - second, percentiles),
+            "probability_first_cheaper": float(np.mean(first < second))}
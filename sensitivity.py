@@ -0,0 +1,148 @@
+import numpy as np
+
+from tables import DRUGS, COST_FIELDS, MAX_COST, MAX_DOSAGE, current, unit_vector, unit_vector_sum, rwe_dosages, dosage_drug
+from engine import scenario_unit_vectors
+from vectorized import CUMULATIVE_SERIES
+
+# One-way sensitivity sweeps. Every output of the model is constant + truncate(S / 2), where the
+# constant and the half-unit sum S are affine in any single cost input (and in an RWE dosage), so a
+# sweep only needs the base (constant, S) plus their slope per parameter; no grid point re-runs the model.
+
+NO_VECTOR = unit_vector()
+
+
+def linear_outputs(data, pricing):
+    """
+    Constant and half-unit sum of every output of one scenario.
+
+    Args:
+        data (InputData): Validated scenario.
+        pricing (PricingTables): Tables to price with.
+
+    Returns:
+        tuple: Two int64 arrays shaped (drugs, 11): the 5 bar graph rows, then the first year and the
+               later year (indirect, direct, package) cumulative amounts.
+    """
+    _, bar, cumulative = scenario_unit_vectors(data, pricing)
+    costs = tuple(getattr(data, field) for field in COST_FIELDS)
+    sums = np.array([[unit_vector_sum(vector, costs) for vector in (bar[drug] or (NO_VECTOR,) * 5) + cumulative[drug][0] + cumulative[drug][1]]
+                     for drug in DRUGS], dtype=np.int64)
+    return sums[..., 0], sums[..., 1]
+
+
+def evaluate(constant, total):
+    return constant + np.where(total >= 0, total // 2, -(-total // 2))
+
+
+def sweep_values(parameter, base, bound):
+    if parameter.get("values"):
+        values = sorted(set(parameter["values"]))
+        low, high = values[0], values[-1]
+    else:
+        low = base if parameter.get("low") is None else parameter["low"]
+        high = base if parameter.get("high") is None else parameter["high"]
+    if low > high:
+        raise ValueError(f"{parameter['name']}: low must not exceed high")
+    if low < -bound or high > bound:
+        raise ValueError(f"{parameter['name']}: values must be between {-bound} and {bound}")
+    if parameter.get("values"):
+        return values
+    return sorted(set(np.rint(np.linspace(low, high, parameter.get("points") or 2)).astype(int).tolist()))
+
+
+def run_sweep(data, parameters, max_points=10000, progress=None, pricing=None):
+    """
+    One-way sweep of each parameter around a base scenario.
+
+    Args:
+        data (InputData): Base scenario.
+        parameters (list): {name, low, high, points} or {name, values} per swept cost field or drug dosage.
+        max_points (int): Upper bound on the total number of grid points.
+        progress (callable): Called with the fraction of parameters done after each parameter.
+        pricing (PricingTables): Tables to price with; the current ones by default.
+
+    Returns:
+        dict: Base totals, a tornado dataset per selected drug (sorted by swing, on Total Cost/Patient
+              and on the cumulative total over the time horizon) and, per parameter, the grid with every
+              drug's Total Cost/Patient and cumulative Indirect/Direct/Package series at each point.
+
+    Raises:
+        ValueError: If a parameter cannot be swept or the grid is too large.
+    """
+    # Discounted or sub-yearly series are rounded per period, which breaks the linear form
+    if data.resolution != "yearly" or data.discount_rate:
+        raise ValueError("Sweeps report yearly, undiscounted cumulative costs; use resolution 'yearly' and no discount_rate")
+    pricing = pricing or current()
+    base_constant, base_total = linear_outputs(data, pricing)
+    years = int(data.time_horizon)
+    length = max(5, years)
+    selected = [drug for drug in DRUGS if drug in data.drugs_selected]
+    rwe = data.clinical_status == "RWE"
+
+    dosages = rwe_dosages(data)
+
+    def shifted(name, base):
+        # data with the parameter moved one unit up; dosages are set through drug_dosages
+        drug = dosage_drug(name)
+        if drug:
+            return data.model_copy(update={"drug_dosages": {**data.drug_dosages, drug: base + 1}})
+        return data.model_copy(update={name: base + 1})
+
+    grids = []
+    for parameter in parameters:
+        name = parameter["name"]
+        drug = dosage_drug(name)
+        if drug and not rwe:
+            raise ValueError(f"{name} is only used in RWE mode; Per Label dosages come from the dosage tables")
+        if not drug and name not in COST_FIELDS:
+            raise ValueError(f"Cannot sweep {name!r}; expected a drug or one of {COST_FIELDS}")
+        base = dosages[drug] if drug else getattr(data, name)
+        grids.append((name, base, sweep_values(parameter, base, MAX_DOSAGE if drug else MAX_COST)))
+    if sum(len(values) for _, _, values in grids) > max_points:
+        raise ValueError(f"Sweep has more than {max_points} grid points")
+
+    k = np.arange(length)
+    in_horizon = k < years
+
+    def totals_and_series(constant, total):
+        outputs = evaluate(constant, total)
+        cost_per_patient = outputs[..., :5].sum(axis=-1)
+        series = np.where(in_horizon, outputs[..., 5:8, None] + k * outputs[..., 8:11, None], 0)
+        return cost_per_patient, series
+
+    base_cost, base_series = totals_and_series(base_constant, base_total)
+
+    results = {}
+    tornado = {drug: [] for drug in selected}
+    cumulative_tornado = {drug: [] for drug in selected}
+    for name, base, values in grids:
+        # Slope of (constant, S) in this parameter, from one extra evaluation of the linear form
+        constant_step, total_step = (step - at_base for step, at_base in zip(linear_outputs(shifted(name, base), pricing),
+                                                                             (base_constant, base_total)))
+        delta = (np.array(values, dtype=np.int64) - base)[:, None, None]
+        cost_per_patient, series = totals_and_series(base_constant + constant_step * delta, base_total + total_step * delta)
+        horizon_total = series[..., years - 1].sum(axis=-1) if years > 0 else np.zeros_like(cost_per_patient)
+
+        results[name] = {"base": base,
+                         "values": values,
+                         "Total_Cost_Per_Patient": dict(zip(DRUGS, cost_per_patient.T.tolist())),
+                         "cumulative": {drug: dict(zip(CUMULATIVE_SERIES, rows)) for drug, rows in zip(DRUGS, series.transpose(1, 2, 0, 3).tolist())}}
+
+        for drug in selected:
+            index = DRUGS.index(drug)
+            for target, metric in ((tornado, cost_per_patient), (cumulative_tornado, horizon_total)):
+                low, high = int(metric[0, index]), int(metric[-1, index])
+                target[drug].append({"parameter": name, "low_value": values[0], "high_value": values[-1],
+                                     "low": low, "high": high, "swing": abs(high - low)})
+        if progress:
+            progress(len(results) / len(grids))
+
+    for target in (tornado, cumulative_tornado):
+        for bars in target.values():
+            bars.sort(key=lambda bar: bar["swing"], reverse=True)
+
+    return {"base": {"Total_Cost_Per_Patient": dict(zip(DRUGS, base_cost.tolist())),
+                     "cumulative_total": dict(zip(DRUGS, base_series[..., years - 1].sum(axis=-1).tolist() if years > 0 else [0] * len(DRUGS)))},
+            "tornado": tornado,
+            "cumulative_tornado": cumulative_tornado,
+            "sweeps": results}
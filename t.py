@@ -1,5 +1,19 @@
 from git import Repo, GitCommandError
+import ast
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import unittest
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 def create_feature_branch(repo_path: str, feature_name: str) -> str:
     """
@@ -70,31 +84,395 @@ def commit_and_push(repo_path: str, commit_message: str, branch: str) -> bool:
         return False
 
 
-def run_tests(repo_path: str) -> bool:
+# ------------------------------------------ Test runner ------------------------------------------
+#
+# run_tests finds the unittest modules of a repository, skips those whose dependencies have not changed
+# since they last passed, and runs the rest on worker processes, printing each test's time as it
+# finishes. A module depends on the repository modules it imports, transitively, and on the data files
+# they name; its cache key is built from the git blob ids of those files as they are in the working tree,
+# so it needs no remote. Results are kept in the git directory, which every worktree of a repository shares;
+# each module keeps the last few keys it passed with, so worktrees on different revisions don't evict each other.
+
+TEST_PATTERN = "test*.py"
+TEST_CACHE = "test-results.json"
+TEST_CACHE_KEYS = 16
+
+
+def git(repo_path, *args, input=None):
+    return subprocess.run(["git", *args], cwd=repo_path, input=input, capture_output=True, text=True, check=True).stdout
+
+
+def discover_test_modules(repo_path):
+    # The modules `unittest discover repo_path` loads: test*.py at the top level and in packages below it
+    modules = []
+    for directory, subdirectories, files in os.walk(repo_path):
+        relative = os.path.relpath(directory, repo_path)
+        package = "" if relative == "." else relative.replace(os.sep, ".") + "."
+        subdirectories[:] = sorted(name for name in subdirectories if os.path.isfile(os.path.join(directory, name, "__init__.py")))
+        modules.extend(package + name[:-3] for name in sorted(files)
+                       if fnmatch.fnmatch(name, TEST_PATTERN) and name.endswith(".py") and name[:-3].isidentifier())
+    return modules
+
+
+def file_ids(repo_path):
+    """
+    Git blob id of every file of the working tree that git tracks or would add.
+
+    Tracked files come from the index; modified and untracked files are hashed as they are on disk.
+
+    Returns:
+        dict: Repository-relative path (with /) -> blob id.
+    """
+    ids = {}
+    for entry in git(repo_path, "ls-files", "--stage", "-z").split("\0"):
+        if entry:
+            info, path = entry.split("\t", 1)
+            ids[path] = info.split()[1]
+    for path in git(repo_path, "ls-files", "--deleted", "-z").split("\0"):
+        ids.pop(path, None)
+    changed = [path for path in git(repo_path, "ls-files", "--modified", "--others", "--exclude-standard", "-z").split("\0")
+               if path and os.path.isfile(os.path.join(repo_path, path))]
+    if changed:
+        ids.update(zip(changed, git(repo_path, "hash-object", "--stdin-paths", input="\n".join(changed) + "\n").split()))
+    return ids
+
+
+def dependency_keys(repo_path, test_modules, ids):
+    """
+    Cache key of every test module.
+
+    The key hashes the Python version and the blob id of every file the module depends on: the test
+    module, the repository modules it imports, directly or through others (with the __init__.py of
+    their packages), and the repository files whose name appears as a string in any of them.
+
+    Returns:
+        dict: Test module -> key.
+    """
+    modules = {}
+    data_files = {}
+    for path in ids:
+        if path.endswith(".py"):
+            name = path[:-3].replace("/", ".")
+            modules[name[:-len(".__init__")] if name.endswith(".__init__") else name] = path
+        else:
+            data_files.setdefault(path.rsplit("/", 1)[-1], []).append(path)
+
+    def with_parents(name):
+        # a.b.c imports a and a.b first
+        parts = name.split(".")
+        return [".".join(parts[:end]) for end in range(1, len(parts) + 1)]
+
+    direct = {}
+
+    def imports(path):
+        if path in direct:
+            return direct[path]
+        package = path[:-3].replace("/", ".").rsplit(".", 1)[0] if "/" in path else ""
+        if path.endswith("/__init__.py"):
+            package = path[:-len("/__init__.py")].replace("/", ".")
+        names, files = set(), set()
+        try:
+            with open(os.path.join(repo_path, path), encoding="utf-8") as f:
+                tree = ast.parse(f.read(), path)
+        except (OSError, SyntaxError, ValueError):
+            tree = ast.Module(body=[], type_ignores=[])
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names.update(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                base = node.module or ""
+                if node.level:
+                    parent = package.split(".") if package else []
+                    parent = parent[:len(parent) - node.level + 1]
+                    base = ".".join(parent + ([base] if base else []))
+                if base:
+                    names.add(base)
+                names.update(f"{base}.{alias.name}" if base else alias.name for alias in node.names)
+            elif isinstance(node, ast.Constant) and isinstance(node.value, str) and len(node.value) < 256:
+                files.update(data_files.get(node.value.replace("\\", "/").rsplit("/", 1)[-1], ()))
+        found = {modules[part] for name in names for part in with_parents(name) if part in modules}
+        direct[path] = found | files
+        return direct[path]
+
+    version = sys.version
+    keys = {}
+    for test_module in test_modules:
+        start = modules.get(test_module)
+        if start is None:
+            keys[test_module] = None
+            continue
+        seen, stack = {start}, [start]
+        for part in with_parents(test_module)[:-1]:
+            if part in modules:
+                seen.add(modules[part])
+                stack.append(modules[part])
+        while stack:
+            for dependency in imports(stack.pop()):
+                if dependency not in seen:
+                    seen.add(dependency)
+                    if dependency.endswith(".py"):
+                        stack.append(dependency)
+        digest = hashlib.sha1(version.encode())
+        for path in sorted(seen):
+            digest.update(f"\n{path} {ids[path]}".encode())
+        keys[test_module] = digest.hexdigest()
+    return keys
+
+
+def test_cache_path(repo_path):
+    return os.path.join(repo_path, git(repo_path, "rev-parse", "--git-common-dir").strip(), TEST_CACHE)
+
+
+def load_test_cache(path):
+    # {module: {"passed": [keys it passed with, oldest first], "tests": count, "duration": seconds}}
+    try:
+        with open(path, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Entries of the older one key per module layout are dropped; those modules just run once more
+    return {module: entry for module, entry in cache.items() if isinstance(entry, dict) and isinstance(entry.get("passed"), list)}
+
+
+def save_test_cache(path, results):
+    # Merged into what is on disk, so runs in other worktrees keep their entries; a lost race only costs a rerun
+    cache = load_test_cache(path)
+    for module, result in results.items():
+        passed = [key for key in cache.get(module, {}).get("passed", []) if key != result["key"]]
+        if result["passed"] and result["key"]:
+            passed.append(result["key"])
+        cache[module] = {"passed": passed[-TEST_CACHE_KEYS:], "tests": result["tests"], "duration": result["duration"]}
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(temporary, path)
+
+
+class StreamingResult(unittest.TestResult):
+    """
+    Test result that reports every finished test as an event.
+
+    Output of the tests is buffered, and added to the details of a test that fails.
+
+    Args:
+        emit (callable): Called with {"event": "test", "test", "status", "duration", "details"}.
+    """
+
+    def __init__(self, emit):
+        super().__init__()
+        self.buffer = True
+        self.emit = emit
+        self.started = None
+
+    def startTest(self, test):
+        super().startTest(test)
+        self.started = time.perf_counter()
+        self.status, self.details = "ok", None
+
+    def stopTest(self, test):
+        super().stopTest(test)
+        self.emit({"event": "test", "test": test.id(), "status": self.status, "duration": time.perf_counter() - self.started,
+                   "details": self.details})
+        self.started = None
+
+    def record(self, test, status, problems):
+        # The buffered output is in the details already; do not also echo it to the worker's stderr
+        self._mirrorOutput = False
+        if self.started is None:
+            # setUpClass / setUpModule failures are reported outside of any test
+            self.emit({"event": "test", "test": str(test), "status": status, "duration": 0.0, "details": problems[-1][1]})
+        elif self.status in ("ok", "skipped"):
+            self.status, self.details = status, problems[-1][1]
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self.record(test, "error", self.errors)
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self.record(test, "fail", self.failures)
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            self.record(test, "fail" if issubclass(err[0], test.failureException) else "error",
+                        self.failures if issubclass(err[0], test.failureException) else self.errors)
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self.status = "skipped"
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self.status = "expected failure"
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self.status, self.details = "unexpected success", None
+
+
+def test_worker(repo_path):
+    """
+    Worker process of run_tests: runs the test modules named on stdin, one per line, and writes a
+    JSON event per finished test, then one for the module, to stdout.
+    """
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    # Anything the tests print goes to stderr, so it cannot corrupt the events
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    os.chdir(repo_path)
+    sys.path.insert(0, os.path.abspath(repo_path))
+
+    def emit(event):
+        channel.write(json.dumps(event) + "\n")
+
+    for line in sys.stdin:
+        module = line.strip()
+        start = time.perf_counter()
+        result = StreamingResult(emit)
+        try:
+            unittest.defaultTestLoader.loadTestsFromName(module).run(result)
+            passed = result.wasSuccessful()
+        except Exception:
+            emit({"event": "test", "test": module, "status": "error", "duration": time.perf_counter() - start, "details": traceback.format_exc()})
+            passed = False
+        emit({"event": "module", "module": module, "passed": passed, "tests": result.testsRun, "duration": time.perf_counter() - start})
+
+
+def run_test_modules(repo_path, modules, workers, report):
+    """
+    Run test modules on worker processes, each taking the next module as soon as it is free.
+
+    Args:
+        repo_path (str): Repository the modules are imported from.
+        modules (list): Module names, in the order they should start (longest first balances best).
+        workers (int): Number of worker processes.
+        report (callable): Called with every test and module event, from the threads reading the workers.
+
+    Returns:
+        dict: Module -> its module event: {"passed", "tests", "duration"}.
     """
-    Run tests for the project using unittest.
+    pending = deque(modules)
+    lock = threading.Lock()
+    results = {}
+    command = [sys.executable, os.path.abspath(__file__), "--test-worker", os.path.abspath(repo_path)]
+
+    def work():
+        process = None
+        while True:
+            with lock:
+                if not pending:
+                    break
+                module = pending.popleft()
+            if process is None:
+                process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+            start = time.perf_counter()
+            process.stdin.write(module + "\n")
+            process.stdin.flush()
+            for line in process.stdout:
+                event = dict(json.loads(line), module=module)
+                report(event)
+                if event["event"] == "module":
+                    results[module] = event
+                    break
+            else:
+                # The worker died (a crash or an exit from a test): fail the module, start a new worker for the rest
+                event = {"event": "module", "module": module, "passed": False, "tests": 0, "duration": time.perf_counter() - start,
+                         "error": f"worker exited with status {process.wait()}"}
+                report(event)
+                results[module] = event
+                process = None
+        if process is not None:
+            process.stdin.close()
+            process.wait()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(work) for _ in range(workers)]:
+            future.result()
+    return results
+
+
+def run_tests(repo_path: str, workers: int = None, slowest: int = 10, use_cache: bool = True, log=None) -> bool:
+    """
+    Run the unittest suite of the project on parallel worker processes.
+
+    Test modules whose dependencies are unchanged since they last passed are skipped (failures are
+    always rerun). Every test is printed with its time as it finishes, then a summary with the
+    slowest tests and the details of any failure.
 
     Args:
         repo_path (str): Path to the local Git repository.
+        workers (int): Worker processes; one per CPU by default, at most one per module.
+        slowest (int): Number of slowest tests to print.
+        use_cache (bool): Skip unchanged modules that passed; False runs everything.
+        log (callable): Called with each line of output instead of print.
 
     Returns:
         bool: True if all tests pass, False otherwise.
     """
+    log = log or (lambda line: print(line, flush=True))
     try:
-        # Placeholder for actual test command; replace with your project's test runner
-        result = subprocess.run(['python', '-m', 'unittest', 'discover', repo_path], 
-                                capture_output=True, text=True)
-
-        if result.returncode == 0:
-            print("All tests passed successfully!")
+        start = time.perf_counter()
+        modules = discover_test_modules(repo_path)
+        if not modules:
+            log("No test modules found.")
             return True
-        else:
-            print("Tests failed. Please fix the issues before merging.")
-            print(result.stdout)
-            print(result.stderr)
+
+        try:
+            keys = dependency_keys(repo_path, modules, file_ids(repo_path))
+            cache_path = test_cache_path(repo_path)
+        except subprocess.CalledProcessError:
+            log("Not a git repository; running every test module.")
+            keys, cache_path = {}, None
+        cache = load_test_cache(cache_path) if cache_path else {}
+
+        unchanged = [module for module in modules
+                     if use_cache and keys.get(module) and keys[module] in cache.get(module, {}).get("passed", [])]
+        # Longest first (by the last run), new modules before all
+        to_run = sorted(set(modules) - set(unchanged), key=lambda module: -cache.get(module, {}).get("duration", float("inf")))
+        workers = max(1, min(workers or os.cpu_count() or 1, len(to_run)))
+        log(f"{len(modules)} test modules: {len(unchanged)} unchanged since they passed, running {len(to_run)} on {workers} workers")
+
+        tests, problems = [], []
+        print_lock = threading.Lock()
+
+        def report(event):
+            with print_lock:
+                if event["event"] == "test":
+                    tests.append(event)
+                    log(f"{event['duration']:8.3f}s  {event['status']:<7} {event['test']}")
+                    if event["details"]:
+                        problems.append(event)
+                elif "error" in event:
+                    log(f"{event['duration']:8.3f}s  error   {event['module']}: {event['error']}")
+                    problems.append({"test": event["module"], "status": "error", "details": event["error"]})
+
+        results = run_test_modules(repo_path, to_run, workers, report) if to_run else {}
+        if cache_path:
+            save_test_cache(cache_path, {module: {"key": keys.get(module), "passed": event["passed"], "tests": event["tests"],
+                                                  "duration": event["duration"]}
+                                         for module, event in results.items()})
+
+        counts = {}
+        for test in tests:
+            counts[test["status"]] = counts.get(test["status"], 0) + 1
+        failed = [module for module, event in results.items() if not event["passed"]]
+        log(f"\nRan {len(tests)} tests in {time.perf_counter() - start:.2f}s "
+              f"({', '.join(f'{count} {status}' for status, count in sorted(counts.items())) or 'none run'}); "
+              f"{len(unchanged)} modules skipped as unchanged")
+        if slowest and tests:
+            log("Slowest tests:")
+            for test in sorted(tests, key=lambda test: test["duration"], reverse=True)[:slowest]:
+                log(f"{test['duration']:8.3f}s  {test['test']}")
+        for problem in problems:
+            log(f"\n{problem['status'].upper()}: {problem['test']}\n{problem['details']}")
+
+        if failed:
+            log(f"Tests failed in {', '.join(sorted(failed))}. Please fix the issues before merging.")
             return False
+        log("All tests passed successfully!")
+        return True
     except Exception as e:
-        print(f"An error occurred while running tests: {e}")
+        log(f"An error occurred while running tests: {e}")
         return False
 
 
@@ -169,8 +547,194 @@ def task_branching_workflow(repo_path: str, feature_name: str, commit_message: s
         return False
 
 
+# ------------------------------------------ Batch workflow ------------------------------------------
+#
+# Several features at once, each in its own git worktree instead of taking turns checking out one working
+# copy: the batch fetches once, prepares and tests the features side by side, merges the green ones in
+# order in an integration worktree and pushes everything in one go. The user's working copy is never
+# touched, and origin may be any remote, including a local bare repository.
+
+
+def prefixed(prefix, lock):
+    # Line printer for output from concurrent stages
+    def log(text):
+        with lock:
+            for line in str(text).splitlines() or [""]:
+                print(f"[{prefix}] {line}", flush=True)
+    return log
+
+
+def prepare_feature(repo_path, root, feature, base, lock):
+    """
+    Create the worktree and branch of one feature from base, apply its changes and commit them.
+
+    Returns:
+        tuple: (branch, worktree path)
+
+    Raises:
+        GitCommandError, ValueError: If a step fails; the worktree and branch are removed again.
+    """
+    name = feature["name"]
+    branch = f"feature/{name}"
+    path = os.path.join(root, name.replace("/", "-"))
+    repo = Repo(repo_path)
+    # Adding and removing worktrees updates shared files of the repository; one at a time
+    with lock:
+        repo.git.worktree("add", "-b", branch, path, base)
+    try:
+        worktree = Repo(path)
+        if feature.get("patch"):
+            worktree.git.apply(os.path.abspath(feature["patch"]))
+        if feature.get("apply"):
+            feature["apply"](path)
+        if not worktree.is_dirty(untracked_files=True):
+            raise ValueError("No changes to commit.")
+        worktree.git.add(A=True)
+        worktree.index.commit(feature["message"])
+    except Exception:
+        with lock:
+            repo.git.worktree("remove", "--force", path)
+            repo.git.branch("-D", branch)
+        raise
+    return branch, path
+
+
+def batch_branching_workflow(repo_path: str, features: list, main_branch: str = 'main', workers: int = 2,
+                             worktree_root: str = None) -> dict:
+    """
+    Run the task branching workflow for several features at once in isolated worktrees.
+
+    Stages: fetch origin once; create a worktree and branch per feature from origin/<main_branch>,
+    apply and commit its changes (in parallel); run the tests of every feature on a pool of `workers`
+    features at a time; merge the green branches in the given order into an integration worktree,
+    retesting each merge after the first (unchanged test modules are skipped, see run_tests) and
+    dropping a merge that conflicts or fails; push the feature branches and the merged main branch
+    in one push; remove the worktrees.
+
+    Args:
+        repo_path (str): Path to the local Git repository.
+        features (list): One dict per feature: name, message (commit message) and its changes, as
+                         patch (path of a diff for `git apply`) and/or apply (callable taking the
+                         worktree path and editing files in it).
+        main_branch (str): Name of the main branch. Defaults to 'main'.
+        workers (int): Features tested at the same time; their test processes share the CPUs.
+        worktree_root (str): Directory for the worktrees; a new temporary directory by default.
+
+    Returns:
+        dict: merged (feature names, in merge order), failed (name -> reason), pushed (bool) and
+              timings (seconds per stage, and per feature for its preparation and tests).
+    """
+    timings, failed, merged = {}, {}, []
+    lock = threading.Lock()
+    log = prefixed("batch", lock)
+    root = worktree_root or tempfile.mkdtemp(prefix="batch-")
+    os.makedirs(root, exist_ok=True)
+    repo = Repo(repo_path)
+    worktrees = {}
+    pushed = False
+
+    def stage(name, started):
+        timings[name] = time.perf_counter() - started
+        log(f"{name} done in {timings[name]:.2f}s")
+
+    try:
+        started = time.perf_counter()
+        repo.git.fetch("origin")
+        base = f"origin/{main_branch}"
+        stage("fetch", started)
+
+        started = time.perf_counter()
+
+        def prepare(feature):
+            begun = time.perf_counter()
+            try:
+                worktrees[feature["name"]] = prepare_feature(repo_path, root, feature, base, lock)
+            except Exception as e:
+                failed[feature["name"]] = f"prepare: {e}"
+            timings[f"prepare {feature['name']}"] = time.perf_counter() - begun
+
+        with ThreadPoolExecutor(max_workers=max(1, len(features))) as pool:
+            list(pool.map(prepare, features))
+        stage("worktrees", started)
+
+        started = time.perf_counter()
+        test_workers = max(1, (os.cpu_count() or 1) // max(1, workers))
+
+        def test(name):
+            begun = time.perf_counter()
+            if not run_tests(worktrees[name][1], workers=test_workers, log=prefixed(name, lock)):
+                failed[name] = "tests failed"
+            timings[f"tests {name}"] = time.perf_counter() - begun
+
+        ready = [feature["name"] for feature in features if feature["name"] in worktrees]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            list(pool.map(test, ready))
+        stage("tests", started)
+
+        started = time.perf_counter()
+        # A dot name cannot clash with a feature's worktree
+        integration = os.path.join(root, ".integration")
+        repo.git.worktree("add", "--detach", integration, base)
+        worktrees[".integration"] = (None, integration)
+        target = Repo(integration)
+        for name in ready:
+            if name in failed:
+                continue
+            branch = worktrees[name][0]
+            before = target.head.commit.hexsha
+            try:
+                target.git.merge("--no-ff", "-m", f"Merge branch '{branch}'", branch)
+            except GitCommandError:
+                conflicts = target.git.diff("--name-only", "--diff-filter=U").split()
+                target.git.merge("--abort")
+                failed[name] = f"merge conflict in {', '.join(conflicts) or 'the working tree'}"
+                continue
+            # The first merge has the tree its branch was tested with; later ones combine features
+            if merged and not run_tests(integration, log=prefixed(f"merge {name}", lock)):
+                target.git.reset("--hard", before)
+                failed[name] = "tests failed after merging"
+                continue
+            merged.append(name)
+        stage("merge", started)
+
+        started = time.perf_counter()
+        refs = [worktrees[name][0] for name in ready]
+        if merged:
+            refs.append(f"HEAD:refs/heads/{main_branch}")
+        if refs:
+            target.git.push("origin", *refs)
+            pushed = True
+        stage("push", started)
+    except GitCommandError as e:
+        log(f"Git command error in the batch: {e}")
+    except Exception as e:
+        log(f"An error occurred in the batch: {e}")
+    finally:
+        started = time.perf_counter()
+        for _, path in worktrees.values():
+            try:
+                repo.git.worktree("remove", "--force", path)
+            except GitCommandError:
+                pass
+        repo.git.worktree("prune")
+        if worktree_root is None:
+            shutil.rmtree(root, ignore_errors=True)
+        stage("cleanup", started)
+
+    log(f"{len(merged)} of {len(features)} features merged into '{main_branch}'" + (" and pushed" if pushed and merged else ""))
+    for name, reason in failed.items():
+        log(f"  {name}: {reason}")
+    for name, seconds in timings.items():
+        log(f"  {name:<32}{seconds:8.2f}s")
+    return {"merged": merged, "failed": failed, "pushed": pushed, "timings": timings}
+
+
 # Example usage
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["--test-worker"]:
+        test_worker(sys.argv[2])
+        sys.exit(0)
+
     repo_path = 'D:/i-Open_backend'
     feature_name = 'new-awesome-feature'
     commit_message = 'Implemented new awesome feature'
@@ -0,0 +1,341 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+# Pricing and dosage tables shared by the /submit and /submit/batch calculators
+
+# Registry of drugs: DRUGS (set at the bottom of this module) is the keys of cumulative_dosage_y2345 in
+# the data file, in order, and every other table must define exactly those, so a new agent or
+# biosimilar only needs a row in each table of the file and a restart.
+
+# ---Drug 1 = Faricimab
+# ---Drug 2 = Aflibercept
+# ---Drug 3 = Brolucizumab
+# ---Drug 4 = Ranibizumab
+# ---Drug 5 = Rani Biosimilar
+
+# The vial prices, per-label dosages and cumulative dosages live in a data file (PRICING_TABLES, by
+# default pricing_tables.json next to this module) and are loaded into a PricingTables below.
+
+
+def dosage_key(disease_indication, time_horizon, naive_switch, clinical_status):
+    return (disease_indication, time_horizon if naive_switch == "Naive" else None, naive_switch, clinical_status)
+
+
+# RWE dosages: the original per-drug InputData fields, overridden by InputData.drug_dosages, which accepts any drug
+DOSAGE_FIELDS = {"Drug 1": "drug1_dosage", "Drug 2": "drug2_dosage", "Drug 3": "drug3_dosage", "Drug 4": "drug4_dosage", "Drug 5": "drug5_dosage"}
+
+
+def rwe_dosages(data):
+    unknown = set(data.drug_dosages) - set(DRUGS)
+    if unknown:
+        raise ValueError(f"Unknown drug in drug_dosages: {', '.join(sorted(unknown))}")
+    dosages = {drug: getattr(data, field) for drug, field in DOSAGE_FIELDS.items()}
+    dosages.update(data.drug_dosages)
+    return {drug: dosages.get(drug, 0) for drug in DRUGS}
+
+
+def dosage_drug(name):
+    # Drug whose RWE dosage a parameter name refers to (its legacy field or the drug name), else None
+    for drug, field in DOSAGE_FIELDS.items():
+        if name == field:
+            return drug if drug in DRUGS else None
+    return name if name in DRUGS else None
+
+
+# ------------------------------------------ Per-Label lookup index ------------------------------------------
+#
+# Everything a Per-Label request needs is a function of a small finite key, so each version of the
+# tables is compiled once, when it is loaded, into per-drug unit-cost vectors. Each vector holds half-unit coefficients
+# over COST_FIELDS plus a constant, so a request only needs one integer dot product per output and
+# the x.5 amounts truncate exactly like the original int(float) expressions.
+
+COST_FIELDS = ("procedure_cost", "consulting_charges", "oct_cost", "travel_cost", "food_cost", "miscellaneous_cost",
+               "patient_lost_opportunity_cost", "caregiver_lost_opportunity_cost")
+
+# Bounds of the cost inputs and RWE dosages (either sign): with them the largest cumulative amount, or
+# difference of two drugs, stays well inside int64 at the longest monthly horizon
+MAX_COST = 10 ** 9
+MAX_DOSAGE = 10 ** 4
+
+PATIENT_SUPPORT = ("Yes", "No")
+MAX_HORIZON_YEARS = 30
+TIME_HORIZONS = tuple(str(years) for years in range(1, MAX_HORIZON_YEARS + 1))
+NAIVE_SWITCH = ("Naive", "Switch")
+
+
+def support_key(patient_support):
+    return "Yes" if patient_support == "Yes" else "No"
+
+
+def unit_vector(constant=0, procedure=0, consulting=0, oct=0, travel_food_misc=0, patient=0, caregiver=0):
+    # Coefficients are in half units: the output is truncate(sum(coef * cost) / 2) + constant
+    return (constant, (procedure, consulting, oct, travel_food_misc, travel_food_misc, travel_food_misc, patient, caregiver))
+
+
+def bar_unit_vectors(dosage, cost_per_vial):
+    # Bar graph rows (package, consulting, OCT, travel and food, opportunity cost lost) except the total,
+    # which is the sum of the truncated rows
+    return (unit_vector(constant=cost_per_vial * dosage, procedure=2 * dosage),
+            unit_vector(consulting=3 * dosage),
+            unit_vector(oct=3 * dosage),
+            unit_vector(travel_food_misc=3 * dosage),
+            unit_vector(patient=3 * dosage, caregiver=3 * dosage))
+
+
+def cumulative_unit_vectors(y1, y2345, cost_per_vial):
+    # Per Label (indirect, direct, package) added in the first year and in every later year
+    visits_y1 = 2 * (y1 + y1 // 2)
+    first_year = (unit_vector(travel_food_misc=visits_y1, patient=visits_y1, caregiver=visits_y1),
+                  unit_vector(consulting=visits_y1, oct=visits_y1),
+                  unit_vector(constant=cost_per_vial * y1, procedure=2 * y1))
+    later_years = (unit_vector(travel_food_misc=3 * y2345, patient=3 * y2345, caregiver=3 * y2345),
+                   unit_vector(consulting=3 * y2345, oct=3 * y2345),
+                   unit_vector(constant=cost_per_vial * y2345, procedure=2 * y2345))
+    return first_year, later_years
+
+
+def rwe_cumulative_unit_vectors(y1, y2345, dosage, cost_per_vial):
+    # RWE direct/indirect amounts use the user dosage every year (the caregiver cost only counts the half visits)
+    indirect = unit_vector(travel_food_misc=3 * dosage, patient=2 * dosage, caregiver=dosage)
+    direct = unit_vector(consulting=3 * dosage, oct=3 * dosage)
+    return ((indirect, direct, unit_vector(constant=cost_per_vial * y1, procedure=2 * y1)),
+            (indirect, direct, unit_vector(constant=cost_per_vial * y2345, procedure=2 * y2345)))
+
+
+def unit_vector_sum(vector, costs):
+    # (constant, half-unit sum) before truncation; both are affine in every single input
+    constant, coefficients = vector
+    return constant, sum(coefficient * cost for coefficient, cost in zip(coefficients, costs))
+
+
+def truncate_half(total):
+    return total // 2 if total >= 0 else -(-total // 2)
+
+
+def apply_unit_vector(vector, costs):
+    constant, total = unit_vector_sum(vector, costs)
+    return constant + truncate_half(total)
+
+
+def check_drug_table(name, table, drugs):
+    if set(table) != set(drugs):
+        raise ValueError(f"{name} must define exactly {drugs}, got {tuple(table)}")
+    for drug, value in table.items():
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise ValueError(f"{name}[{drug!r}] must be a non-negative integer, got {value!r}")
+
+
+class PricingTables:
+    """
+    One version of the pricing and dosage tables, validated and compiled into the Per-Label lookup index.
+
+    Never changed once built: a new version of the data file becomes a new PricingTables, and a
+    calculation keeps using the one it started with.
+
+    Args:
+        vial_prices (dict): Cost per vial by account type, then by patient support flag (None is the
+                            fallback for any other value), then by drug.
+        drug_dosages (dict): Per-label dosages keyed on (disease_indication, time_horizon or None for
+                             Switch, naive_switch, clinical_status).
+        cumulative_dosage_y1 (dict): Per-label first year dosages of the cumulative costs comparison, by disease.
+        cumulative_dosage_y2345 (dict): Per-label dosages of every later year; its keys are the drugs.
+
+    Raises:
+        ValueError: If any combination is missing from the tables or holds an invalid value.
+    """
+
+    def __init__(self, vial_prices, drug_dosages, cumulative_dosage_y1, cumulative_dosage_y2345):
+        self.vial_prices = vial_prices
+        self.drug_dosages = drug_dosages
+        self.cumulative_dosage_y1 = cumulative_dosage_y1
+        self.cumulative_dosage_y2345 = cumulative_dosage_y2345
+        self.drugs = tuple(cumulative_dosage_y2345)
+        self.per_label_dosages, self.per_label_index, self.cumulative_index = self.compile_per_label_index()
+        self.version = self.fingerprint()
+
+    def prices(self, account_type, patient_support):
+        prices = self.vial_prices[account_type]
+        return prices.get(patient_support, prices[None])
+
+    def compile_per_label_index(self):
+        """
+        Check every Per-Label key combination and build the lookup index.
+
+        Naive dosages over n years are the first year's plus n - 1 later years' (the rows of the data
+        file follow this exactly), so a Naive row the file does not give is derived, for every
+        horizon up to MAX_HORIZON_YEARS; a row the file does give is used as is.
+
+        Returns:
+            tuple: (per-label dosages keyed like drug_dosages, derived Naive rows included,
+                    bar index keyed on (account_type, patient_support, disease_indication, time_horizon or None, naive_switch),
+                    cumulative index keyed on (account_type, patient_support, disease_indication))
+        """
+        if not self.drugs:
+            raise ValueError("cumulative_dosage_y2345 defines no drugs")
+        check_drug_table("cumulative_dosage_y2345", self.cumulative_dosage_y2345, self.drugs)
+        for disease, y1 in self.cumulative_dosage_y1.items():
+            check_drug_table(f"cumulative_dosage_y1[{disease!r}]", y1, self.drugs)
+        for key, dosages in self.drug_dosages.items():
+            check_drug_table(f"drug_dosages[{key!r}]", dosages, self.drugs)
+        for account_type, prices in self.vial_prices.items():
+            if None not in prices:
+                raise ValueError(f"vial_prices[{account_type!r}] has no default patient_support entry")
+            for patient_support, table in prices.items():
+                check_drug_table(f"vial_prices[{account_type!r}][{patient_support!r}]", table, self.drugs)
+
+        per_label_dosages = {(disease, time_horizon, "Naive", "Per Label"):
+                             {drug: y1[drug] + (int(time_horizon) - 1) * self.cumulative_dosage_y2345[drug] for drug in self.drugs}
+                             for disease, y1 in self.cumulative_dosage_y1.items() for time_horizon in TIME_HORIZONS}
+        per_label_dosages.update(self.drug_dosages)
+
+        bar_index = {}
+        cumulative_index = {}
+        for account_type in self.vial_prices:
+            for patient_support in PATIENT_SUPPORT:
+                prices = self.prices(account_type, patient_support)
+                for disease, y1 in self.cumulative_dosage_y1.items():
+                    cumulative_index[(account_type, patient_support, disease)] = {
+                        drug: cumulative_unit_vectors(y1[drug], self.cumulative_dosage_y2345[drug], prices[drug]) for drug in self.drugs}
+
+                    for naive_switch in NAIVE_SWITCH:
+                        for time_horizon in (TIME_HORIZONS if naive_switch == "Naive" else (None,)):
+                            key = (disease, time_horizon, naive_switch, "Per Label")
+                            if key not in per_label_dosages:
+                                raise ValueError(f"drug_dosages is missing {key!r}")
+                            dosages = per_label_dosages[key]
+                            bar_index[(account_type, patient_support, disease, time_horizon, naive_switch)] = {
+                                "dosages": dosages,
+                                "bar": {drug: bar_unit_vectors(dosages[drug], prices[drug]) for drug in self.drugs}}
+
+        return per_label_dosages, bar_index, cumulative_index
+
+    def fingerprint(self):
+        # Version of the tables; anything cached against them is keyed on it
+        tables = [self.vial_prices, sorted(self.drug_dosages.items(), key=repr), self.cumulative_dosage_y1, self.cumulative_dosage_y2345]
+        return hashlib.sha256(repr(tables).encode()).hexdigest()[:16]
+
+
+def parse_tables(text):
+    """
+    Build a PricingTables from the JSON data file.
+
+    The file has vial_prices ({account type: {patient support or "default": {drug: price}}}),
+    drug_dosages (a list of {disease_indication, time_horizon (null for Switch), naive_switch,
+    clinical_status, dosages: {drug: dosage}}; Naive rows may be left out, see compile_per_label_index),
+    cumulative_dosage_y1 ({disease: {drug: dosage}})
+    and cumulative_dosage_y2345 ({drug: dosage}; its keys, in order, are the drugs).
+
+    Raises:
+        ValueError: If the file is not valid JSON or the tables are incomplete or invalid.
+    """
+    try:
+        document = json.loads(text)
+        vial_prices = {account_type: {None if support == "default" else support: prices for support, prices in by_support.items()}
+                       for account_type, by_support in document["vial_prices"].items()}
+        drug_dosages = {}
+        for row in document["drug_dosages"]:
+            key = (row["disease_indication"], row["time_horizon"], row["naive_switch"], row["clinical_status"])
+            if key in drug_dosages:
+                raise ValueError(f"drug_dosages lists {key!r} twice")
+            drug_dosages[key] = row["dosages"]
+        return PricingTables(vial_prices, drug_dosages, document["cumulative_dosage_y1"], document["cumulative_dosage_y2345"])
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Malformed pricing tables: {type(e).__name__}: {e}")
+
+
+def load_tables(path):
+    with open(path, "rb") as file:
+        return parse_tables(file.read())
+
+
+class TableSource:
+    """
+    The current PricingTables, reloaded when its data file changes.
+
+    The file's stat signature is checked at most every `interval` seconds, on the next call to get(),
+    so every process using the tables (API workers, calculator and job pool processes) picks up a new
+    file by itself. The drugs are fixed for the life of the process (DRUGS): a file that changes them
+    is rejected like an invalid one until a restart. A changed file is parsed and validated off to the side and swapped in by rebinding
+    one reference, so no request is blocked or sees half of it; a file that fails to load is logged
+    and the previous tables stay in use. Replace the file atomically (write elsewhere, then rename).
+
+    Args:
+        path (str): JSON data file.
+        interval (float): Seconds between checks of the file; 0 disables reloading.
+    """
+
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.signature = self.stat()
+        self.tables = load_tables(path)
+        self.checked = time.monotonic()
+        self.loaded_at = time.time()
+        self.reloads = 0
+        self.errors = 0
+        self.last_error = None
+
+    def stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def get(self):
+        if self.interval and time.monotonic() - self.checked >= self.interval:
+            self.refresh()
+        return self.tables
+
+    def refresh(self):
+        # Only one thread checks; the others keep serving the current tables meanwhile
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            self.checked = time.monotonic()
+            signature = self.stat()
+            if signature is None or signature == self.signature:
+                return
+            self.signature = signature
+            try:
+                tables = load_tables(self.path)
+                if tables.drugs != self.tables.drugs:
+                    raise ValueError(f"the drugs change from {self.tables.drugs} to {tables.drugs}; restart to load them")
+            except (OSError, ValueError) as e:
+                self.errors += 1
+                self.last_error = str(e)
+                logging.getLogger("tables").error("Keeping pricing tables %s; %s failed to load: %s", self.tables.version, self.path, e)
+                return
+            if tables.version != self.tables.version:
+                self.tables = tables
+                self.loaded_at = time.time()
+                self.reloads += 1
+            self.last_error = None
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        return {"version": self.tables.version,
+                "path": self.path,
+                "loaded_at": self.loaded_at,
+                "reloads": self.reloads,
+                "errors": self.errors,
+                "last_error": self.last_error,
+                "interval": self.interval}
+
+
+source = TableSource(os.environ.get("PRICING_TABLES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pricing_tables.json")),
+                     interval=float(os.environ.get("PRICING_TABLES_POLL", "1")))
+
+# Every drug the calculators know, in display order
+DRUGS = source.tables.drugs
+
+
+def current():
+    # Take this once per calculation and pass it down, so a calculation never mixes two versions
+    return source.get()
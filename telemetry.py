@@ -0,0 +1,229 @@
+import bisect
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+# Request telemetry: per-stage timings (returned as a Server-Timing header), Prometheus text metrics
+# and sampled structured request logs. Logs are formatted and written by a background thread, so the
+# request path only puts a record on a queue.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Timings:
+    """Wall time per named stage of one request, in seconds."""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+
+def server_timing(stages):
+    return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in stages.items())
+
+
+# ------------------------------------------ Prometheus metrics ------------------------------------------
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in values:
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+
+class Gauge:
+    # Value read from a callback at scrape time
+    def __init__(self, name, help, read, kind="gauge"):
+        self.name, self.help, self.read, self.kind = name, help, read, kind
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield f"{self.name} {self.read()}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        with self.lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self.series.items())
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels(self.labels + ('le',), labels + (bound,))} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.register(Histogram("http_request_duration_seconds", "Request latency by route and method.",
+                                               ("path", "method")))
+stage_duration = registry.register(Histogram("submit_stage_duration_seconds", "Latency of each stage of /submit.", ("stage",)))
+requests_total = registry.register(Counter("http_requests_total", "Responses by route, method and status.",
+                                           ("path", "method", "status")))
+request_errors = registry.register(Counter("http_request_errors_total", "Responses with a 4xx or 5xx status, or an unhandled exception.",
+                                           ("path", "method", "status")))
+in_flight = 0
+registry.register(Gauge("http_requests_in_flight", "Requests being handled.", lambda: in_flight))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, status and in-flight counts of every HTTP request.
+
+    A handler may store a Timings in request.state.timings; its stages are then observed and sent
+    back, with the total, in a Server-Timing header. The start time is kept in request.state.started.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global in_flight
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        state = scope.setdefault("state", {})
+        state["started"] = start
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timings = state.get("timings")
+                stages = dict(timings.stages) if timings else {}
+                stages["total"] = time.perf_counter() - start
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", server_timing(stages).encode())])
+            await send(message)
+
+        in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            in_flight -= 1
+            route = scope.get("route")
+            labels = (route.path if route is not None else "unmatched", scope["method"])
+            request_duration.observe(time.perf_counter() - start, *labels)
+            requests_total.inc(*labels, status)
+            if status >= 400:
+                request_errors.inc(*labels, status)
+            timings = state.get("timings")
+            if timings:
+                for name, seconds in timings.stages.items():
+                    stage_duration.observe(seconds, name)
+
+
+# ------------------------------------------ Request logging ------------------------------------------
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": record.created, "level": record.levelname, "logger": record.name, "event": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str)
+
+
+class RequestLog:
+    """
+    Sampled structured logging through a queue.
+
+    Records are put on a queue by the request path and written as JSON lines to stdout by a listener
+    thread, so a slow stdout never blocks a request.
+
+    Args:
+        name (str): Logger name.
+        sample_rate (float): Fraction of requests that are logged, 0 to 1.
+    """
+
+    def __init__(self, name, sample_rate=1.0):
+        self.sample_rate = sample_rate
+        self.queue = SimpleQueue()
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.queue, handler)
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.handlers = [QueueHandler(self.queue)]
+        self.running = False
+
+    def start(self):
+        if not self.running:
+            self.listener.start()
+            self.running = True
+
+    def stop(self):
+        # Flushes the records still on the queue
+        if self.running:
+            self.listener.stop()
+            self.running = False
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def log(self, event, **fields):
+        self.logger.info(event, extra={"fields": fields})
@@ -0,0 +1,33 @@
+import unittest
+
+from fastapi.testclient import TestClient
+
+import main
+import tables
+from budget import FIRST_YEAR, MAINTENANCE, yearly_amounts
+
+
+class BudgetBoundsTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(main.app)
+
+    def test_largest_cohort_at_the_largest_inputs(self):
+        base = {"clinical_status": "RWE", **{field: tables.MAX_COST for field in tables.COST_FIELDS},
+                "drug_dosages": {drug: tables.MAX_DOSAGE for drug in tables.DRUGS}}
+        patients, years = 10 ** 7, 5
+        response = self.client.post("/submit/budget", json={"base": base, "patients": patients, "years": years,
+                                                            "market_share": [{"Drug 1": 1.0}], "chunk_size": 10 ** 6})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+
+        # Every patient is naive on Drug 1 with WET AMD: one first year, then maintenance years
+        amounts = yearly_amounts(main.InputData(**base), ("WET AMD",), tables.current())[0]
+        expected = [patients * (int(first) + (years - 1) * int(later)) for first, later in zip(amounts[FIRST_YEAR, 0], amounts[MAINTENANCE, 0])]
+        spend = result["spend"]["Drug 1"]
+        self.assertEqual([spend[series] for series in ("Indirect_Costs", "Direct_Costs", "Package_Cost")], expected)
+        self.assertEqual(result["total"], sum(expected))
+        self.assertGreater(result["total"], 2 ** 63)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+import os
+import struct
+import tempfile
+import threading
+import unittest
+
+from fastapi.testclient import TestClient
+
+import main
+from cache import ResponseCache, SharedResponseCache, etag_matches, make_etag
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def entry(text):
+    body = text.encode()
+    return make_etag(body), body
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = ResponseCache(max_entries=2, ttl=10, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get("a", "v1"))
+        self.cache.put("a", "v1", entry("a"))
+        self.assertEqual(self.cache.get("a", "v1"), entry("a"))
+        self.assertEqual((self.cache.stats()["hits"], self.cache.stats()["misses"]), (1, 1))
+
+    def test_expiry(self):
+        self.cache.put("a", "v1", entry("a"))
+        self.clock.now += 9.9
+        self.assertIsNotNone(self.cache.get("a", "v1"))
+        self.clock.now += 0.1
+        self.assertIsNone(self.cache.get("a", "v1"))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put("a", "v1", entry("a"))
+        self.cache.put("b", "v1", entry("b"))
+        self.cache.get("a", "v1")
+        self.cache.put("c", "v1", entry("c"))
+        self.assertIsNone(self.cache.get("b", "v1"))
+        self.assertIsNotNone(self.cache.get("a", "v1"))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_new_table_version_drops_everything(self):
+        self.cache.put("a", "v1", entry("a"))
+        self.assertIsNone(self.cache.get("a", "v2"))
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+
+
+class SharedResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "cache")
+        self.clock = Clock()
+        # One set of 4 ways, so every key collides with every other
+        self.cache = self.open()
+
+    def open(self, **settings):
+        cache = SharedResponseCache(self.path, **{"slots": 4, "slot_size": 256, "ttl": 10, "ways": 4, "clock": self.clock, **settings})
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_slot_size_must_hold_the_header(self):
+        for slot_size in (0, SharedResponseCache.SLOT.size):
+            with self.assertRaises(ValueError):
+                SharedResponseCache(self.path, slot_size=slot_size)
+        self.assertRaises(ValueError, SharedResponseCache, self.path, ways=0)
+
+    def test_hit_miss_and_other_processes(self):
+        self.assertIsNone(self.cache.get("a", "v1"))
+        self.cache.put("a", "v1", entry("a"))
+        self.assertEqual(self.cache.get("a", "v1"), entry("a"))
+        # Another worker opening the same file sees the entry
+        self.assertEqual(self.open().get("a", "v1"), entry("a"))
+        self.assertIsNone(self.cache.get("a", "v2"))
+
+    def test_expiry(self):
+        self.cache.put("a", "v1", entry("a"))
+        self.clock.now += 10
+        self.assertIsNone(self.cache.get("a", "v1"))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_too_large_is_not_cached(self):
+        self.cache.put("a", "v1", entry("x" * 256))
+        self.assertIsNone(self.cache.get("a", "v1"))
+        self.assertEqual(self.cache.stats()["too_large"], 1)
+
+    def test_colliding_keys_evict_the_least_recently_read(self):
+        for key in "abcd":
+            self.clock.now += 1
+            self.cache.put(key, "v1", entry(key))
+        for key in "bcd":
+            self.clock.now += 1
+            self.cache.get(key, "v1")
+        self.cache.put("e", "v1", entry("e"))
+        self.assertIsNone(self.cache.get("a", "v1"))
+        self.assertEqual([self.cache.get(key, "v1") for key in "bcde"], [entry(key) for key in "bcde"])
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        # Replacing an existing key reuses its slot
+        self.cache.put("b", "v1", entry("B"))
+        self.assertEqual(self.cache.get("b", "v1"), entry("B"))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_slot_being_written_is_skipped(self):
+        self.cache.put("a", "v1", entry("a"))
+        mm = self.cache.mapping()
+        offset = next(offset for offset in range(SharedResponseCache.HEADER_SIZE, self.cache.size_bytes, self.cache.slot_size)
+                      if struct.unpack_from("<16s", mm, offset + 8)[0] == self.cache.tag("a"))
+        sequence = struct.unpack_from("<Q", mm, offset)[0]
+        # An odd sequence marks a write in progress: readers miss, the next writer takes the slot over
+        struct.pack_into("<Q", mm, offset, sequence | 1)
+        self.assertIsNone(self.cache.get("a", "v1"))
+        self.cache.put("a", "v1", entry("A"))
+        self.assertEqual(self.cache.get("a", "v1"), entry("A"))
+        self.assertEqual(struct.unpack_from("<Q", mm, offset)[0] % 2, 0)
+
+    def test_readers_never_see_a_torn_entry(self):
+        stop = threading.Event()
+
+        def write():
+            index = 0
+            while not stop.is_set():
+                index += 1
+                self.cache.put("a", "v1", entry(str(index) * (index % 40 + 1)))
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for _ in range(20000):
+                value = self.cache.get("a", "v1")
+                if value is not None:
+                    self.assertEqual(value[0], make_etag(value[1]))
+        finally:
+            stop.set()
+            writer.join()
+
+
+class ConditionalRequestTest(unittest.TestCase):
+    def setUp(self):
+        original, main.response_cache = main.response_cache, ResponseCache()
+        self.addCleanup(setattr, main, "response_cache", original)
+        self.client = TestClient(main.app)
+
+    def test_etag_and_if_none_match(self):
+        body = {"procedure_cost": 4321}
+        first = self.client.post("/submit", json=body)
+        etag = first.headers["ETag"]
+        self.assertEqual(etag, make_etag(first.content))
+        second = self.client.post("/submit", json=body)
+        self.assertEqual((second.content, second.headers["ETag"]), (first.content, etag))
+        self.assertEqual(main.response_cache.stats()["hits"], 1)
+
+        for header in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+            response = self.client.post("/submit", json=body, headers={"If-None-Match": header})
+            self.assertEqual(response.status_code, 304, header)
+            self.assertEqual(response.content, b"")
+            self.assertEqual(response.headers["ETag"], etag)
+        self.assertEqual(self.client.post("/submit", json=body, headers={"If-None-Match": '"other"'}).status_code, 200)
+        self.assertFalse(etag_matches(None, etag))
+
+
+if __name__ == "__main__":
+    unittest.main()
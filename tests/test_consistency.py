@@ -0,0 +1,102 @@
+import os
+import unittest
+
+from fastapi.testclient import TestClient
+
+import main
+from bench import load_corpus
+from tables import DRUGS
+
+# The sensitivity, what-if, Monte Carlo and break-even endpoints each compute costs their own way (linear
+# form, patched session, array forms, analytic solve); on the corpus scenarios they must agree with /submit.
+
+CORPUS = os.path.join(os.path.dirname(__file__), "data", "corpus.jsonl")
+
+
+def cumulative_total(result, key, years):
+    # Indirect + Direct + Package cost at the end of the horizon of First_Drug_data or Second_Drug_data
+    return sum(series[years - 1] for series in result[key].values())
+
+
+class ConsistencyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.scenarios = [body for path, body in load_corpus(CORPUS) if path == "/submit"]
+
+    def setUp(self):
+        self.client = TestClient(main.app)
+
+    def submit(self, body):
+        response = self.client.post("/submit", json=body)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_sensitivity_grid_matches_submit(self):
+        for index, scenario in enumerate(self.scenarios):
+            with self.subTest(scenario=index):
+                values = [0, scenario["procedure_cost"] + 137]
+                response = self.client.post("/submit/sensitivity", json={"base": scenario, "parameters": [{"name": "procedure_cost", "values": values}]})
+                self.assertEqual(response.status_code, 200)
+                sweep = response.json()
+                years = int(scenario["time_horizon"])
+                for base, point in ((scenario, None), *((dict(scenario, procedure_cost=value), position) for position, value in enumerate(values))):
+                    result = self.submit(base)
+                    if point is None:
+                        per_patient = sweep["base"]["Total_Cost_Per_Patient"]
+                        cumulative = sweep["base"]["cumulative_total"]
+                    else:
+                        grid = sweep["sweeps"]["procedure_cost"]
+                        per_patient = {drug: costs[point] for drug, costs in grid["Total_Cost_Per_Patient"].items()}
+                        cumulative = {drug: sum(series[point][years - 1] for series in grid["cumulative"][drug].values()) for drug in DRUGS}
+                    self.assertEqual([per_patient[drug] for drug in DRUGS], result["bar_gragh_data"][5]["data"])
+                    for key in ("First_Drug", "Second_Drug"):
+                        self.assertEqual(cumulative[base[key]], cumulative_total(result, f"{key}_data", years))
+
+    def test_whatif_session_matches_submit(self):
+        for index, scenario in enumerate(self.scenarios):
+            with self.subTest(scenario=index):
+                created = self.client.post("/whatif", json=scenario)
+                self.assertEqual(created.status_code, 201)
+                session_id = created.json()["session_id"]
+                self.assertEqual(created.json()["result"], self.submit(scenario))
+                patch = {"procedure_cost": scenario["procedure_cost"] + 137, "time_horizon": str(int(scenario["time_horizon"]) % 5 + 1),
+                         "First_Drug": scenario["Second_Drug"], "Second_Drug": scenario["First_Drug"]}
+                self.assertEqual(self.client.patch(f"/whatif/{session_id}", json=patch).status_code, 200)
+                self.assertEqual(self.client.get(f"/whatif/{session_id}").json()["result"], self.submit(dict(scenario, **patch)))
+
+    def test_monte_carlo_with_fixed_inputs_matches_submit(self):
+        for index, scenario in enumerate(self.scenarios):
+            with self.subTest(scenario=index):
+                value = scenario["procedure_cost"] + 137
+                response = self.client.post("/submit/montecarlo", json={"base": scenario, "draws": 1,
+                                                                        "distributions": {"procedure_cost": {"kind": "fixed", "value": value}}})
+                self.assertEqual(response.status_code, 200)
+                simulated = response.json()
+                result = self.submit(dict(scenario, procedure_cost=value))
+                years = int(scenario["time_horizon"])
+                for drug, summary in simulated["Total_Cost_Per_Patient"].items():
+                    self.assertEqual(summary["mean"], result["bar_gragh_data"][5]["data"][DRUGS.index(drug)], drug)
+                for key in ("First_Drug", "Second_Drug"):
+                    self.assertEqual(simulated[f"{key}_cumulative"]["mean"], cumulative_total(result, f"{key}_data", years), key)
+
+    def test_break_even_base_costs_match_submit(self):
+        for index, scenario in enumerate(self.scenarios):
+            drug, reference = scenario["First_Drug"], scenario["Second_Drug"]
+            if drug == reference:
+                continue
+            selected = dict(scenario, drugs_selected=[*DRUGS])
+            result = self.submit(selected)
+            years = int(scenario["time_horizon"])
+            expected = {"per_patient": [result["bar_gragh_data"][5]["data"][DRUGS.index(name)] for name in (drug, reference)],
+                        "cumulative": [cumulative_total(result, key, years) for key in ("First_Drug_data", "Second_Drug_data")]}
+            for variable, metric in (("vial_price", "per_patient"), ("vial_price", "cumulative"), ("horizon", "cumulative")):
+                with self.subTest(scenario=index, variable=variable, metric=metric):
+                    response = self.client.post("/submit/breakeven", json={"base": scenario, "drug": drug, "reference": reference,
+                                                                          "variable": variable, "metric": metric})
+                    self.assertEqual(response.status_code, 200)
+                    base = response.json()["base"]
+                    self.assertEqual([base["drug_cost"], base["reference_cost"]], expected[metric])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import json
+import unittest
+
+from fastapi.testclient import TestClient
+
+import main
+import tables
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(main.app)
+
+    def export(self, body):
+        response = self.client.post("/submit/export", json=body)
+        self.assertEqual(response.status_code, 200, response.text)
+        return response, [json.loads(line) for line in response.content.splitlines()]
+
+    def test_unconstrained_axes_match_submit(self):
+        base = {"clinical_status": "RWE", "drugs_selected": list(tables.DRUGS)}
+        axes = {"account_type": ["Government Account", "Trade Account"], "time_horizon": ["1", "3"], "clinical_status": ["RWE", "Per Label"]}
+        response, lines = self.export({"base": base, "axes": axes})
+        self.assertEqual(response.headers["X-Grid-Size"], "8")
+        self.assertEqual([line["index"] for line in lines], list(range(8)))
+        for line in lines:
+            self.assertEqual(line["result"], self.client.post("/submit", json={**base, **line["scenario"]}).json(), line["scenario"])
+
+    def test_range_axis_and_gzip(self):
+        body = {"ranges": {"procedure_cost": {"low": 0, "high": 200, "step": 100}}}
+        _, lines = self.export(body)
+        response = self.client.post("/submit/export", json={**body, "gzip": True})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        # The client decoded the gzip body already; it must be the same lines
+        self.assertEqual([json.loads(line) for line in response.content.splitlines()], lines)
+        self.assertEqual([line["scenario"] for line in lines], [{"procedure_cost": value} for value in (0, 100, 200)])
+
+    def test_invalid_axes_are_rejected(self):
+        for axes, ranges in (({"unknown": [1]}, {}),
+                             ({"account_type": [1]}, {}),
+                             ({"procedure_cost": [tables.MAX_COST + 1]}, {}),
+                             ({"procedure_cost": []}, {}),
+                             ({}, {"account_type": {"low": 0, "high": 1}}),
+                             ({}, {"procedure_cost": {"low": 0, "high": 10 ** 19}})):
+            with self.subTest(axes=axes, ranges=ranges):
+                self.assertEqual(self.client.post("/submit/export", json={"axes": axes, "ranges": ranges}).status_code, 422)
+
+
+if __name__ == "__main__":
+    unittest.main()
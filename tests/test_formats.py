@@ -0,0 +1,62 @@
+import json
+import unittest
+
+import msgpack
+from fastapi.testclient import TestClient
+
+import main
+from cache import ResponseCache
+from formats import COLUMNAR_JSON, COLUMNAR_MSGPACK, JSON, MSGPACK, negotiate, to_columnar
+
+BODY = {"clinical_status": "RWE", "procedure_cost": 24680}
+
+
+class NegotiateTest(unittest.TestCase):
+    def test_accept_headers(self):
+        for accept, expected in ((None, JSON), ("*/*", JSON), ("text/html", JSON), ("application/x-msgpack", MSGPACK),
+                                 (f"{JSON};q=0.5, {MSGPACK}", MSGPACK), (f"{MSGPACK};q=0.2, {COLUMNAR_JSON};q=0.9", COLUMNAR_JSON),
+                                 (f"{COLUMNAR_MSGPACK}, {MSGPACK}", COLUMNAR_MSGPACK), (f"{MSGPACK};q=oops", JSON)):
+            self.assertEqual(negotiate(accept), expected, accept)
+
+
+class EncodingTest(unittest.TestCase):
+    def setUp(self):
+        original, main.response_cache = main.response_cache, ResponseCache()
+        self.addCleanup(setattr, main, "response_cache", original)
+        self.client = TestClient(main.app)
+
+    def post(self, path, body, accept=None):
+        response = self.client.post(path, json=body, headers={"Accept": accept} if accept else {})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_submit_encodings_carry_the_same_result(self):
+        plain = self.post("/submit", BODY)
+        self.assertEqual(plain.headers["content-type"], JSON)
+        expected = plain.json()
+        # The default stays byte for byte what the standard library writes
+        self.assertEqual(plain.content, json.dumps(expected, separators=(",", ":"), ensure_ascii=False).encode())
+        for accept, decode, columnar in ((MSGPACK, msgpack.unpackb, False), (COLUMNAR_JSON, json.loads, True),
+                                         (COLUMNAR_MSGPACK, msgpack.unpackb, True)):
+            with self.subTest(accept=accept):
+                response = self.post("/submit", BODY, accept)
+                self.assertEqual(response.headers["content-type"], accept)
+                self.assertIn("Accept", response.headers["Vary"].split(", "))
+                self.assertNotEqual(response.headers["ETag"], plain.headers["ETag"])
+                self.assertEqual(decode(response.content), to_columnar(expected) if columnar else expected)
+
+    def test_batch_encodings_carry_the_same_result(self):
+        scenarios = [BODY, {"procedure_cost": 13579}]
+        expected = self.post("/submit/batch", scenarios).json()
+        self.assertEqual(expected, [self.post("/submit", body).json() for body in scenarios])
+        self.assertEqual(msgpack.unpackb(self.post("/submit/batch", scenarios, MSGPACK).content), expected)
+        columnar = msgpack.unpackb(self.post("/submit/batch", scenarios, COLUMNAR_MSGPACK).content)
+        self.assertEqual(columnar, json.loads(self.post("/submit/batch", scenarios, COLUMNAR_JSON).content))
+        self.assertEqual(columnar["count"], len(scenarios))
+        for index, result in enumerate(expected):
+            self.assertEqual({name: values[index] for name, values in columnar["bar_gragh_data"].items()},
+                             to_columnar(result)["bar_gragh_data"])
+
+
+if __name__ == "__main__":
+    unittest.main()
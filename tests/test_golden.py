@@ -0,0 +1,44 @@
+import json
+import os
+import unittest
+
+from fastapi.testclient import TestClient
+
+import main
+from bench import load_corpus
+
+# Regenerate after an intended change in the responses with
+#   python bench.py golden --corpus tests/data/corpus.jsonl --record tests/data/golden.jsonl
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+
+class GoldenTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.requests = load_corpus(os.path.join(DATA, "corpus.jsonl"))
+        with open(os.path.join(DATA, "golden.jsonl")) as f:
+            cls.expected = [json.loads(line) for line in f if line.strip()]
+
+    def setUp(self):
+        self.client = TestClient(main.app)
+
+    def test_corpus_and_golden_file_match(self):
+        self.assertEqual(len(self.requests), len(self.expected))
+
+    def test_responses_are_unchanged(self):
+        for index, ((path, body), expected) in enumerate(zip(self.requests, self.expected)):
+            with self.subTest(line=index + 1):
+                response = self.client.post(path, json=body)
+                self.assertEqual({"status": response.status_code, "body": response.json()}, expected)
+
+    def test_batch_matches_the_golden_file(self):
+        bodies = [body for path, body in self.requests if path == "/submit"]
+        expected = [response["body"] for (path, _), response in zip(self.requests, self.expected) if path == "/submit"]
+        response = self.client.post("/submit/batch", json=bodies)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import math
+import unittest
+
+from fastapi.testclient import TestClient
+
+import main
+import tables
+from vectorized import resolve_horizon
+
+
+class DiscountRateTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(main.app)
+
+    def test_out_of_range_rate_is_rejected(self):
+        body = {"clinical_status": "RWE", "time_horizon": "5", "discount_rate": 1e200}
+        self.assertEqual(self.client.post("/submit", json=body).status_code, 422)
+        self.assertEqual(self.client.post("/submit/batch", json=[body]).status_code, 422)
+        self.assertEqual(self.client.post("/submit", json={"discount_rate": -0.01}).status_code, 422)
+
+    def test_non_finite_rate_is_rejected(self):
+        for literal in ("Infinity", "-Infinity", "NaN"):
+            response = self.client.post("/submit", content=f'{{"discount_rate": {literal}}}', headers={"content-type": "application/json"})
+            self.assertEqual(response.status_code, 422, literal)
+            self.assertEqual(response.json()["detail"][0]["type"], "finite_number")
+
+    def test_whatif_patch_is_rejected(self):
+        session_id = self.client.post("/whatif", json={"clinical_status": "RWE"}).json()["session_id"]
+        response = self.client.patch(f"/whatif/{session_id}", json={"time_horizon": "5", "discount_rate": 1e200})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.client.patch(f"/whatif/{session_id}", json={"discount_rate": 1.0}).status_code, 200)
+
+    def test_rate_set_without_validation_is_rejected(self):
+        for rate in (1e200, math.inf, math.nan, -0.5):
+            with self.assertRaises(ValueError):
+                resolve_horizon(main.InputData().model_copy(update={"discount_rate": rate}))
+
+
+class NaiveHorizonTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(main.app)
+        self.pricing = tables.current()
+
+    def test_derived_dosages_match_the_table_rows(self):
+        for (disease, time_horizon, naive_switch, _), dosages in self.pricing.drug_dosages.items():
+            if naive_switch == "Naive":
+                self.assertEqual(self.pricing.per_label_dosages[(disease, time_horizon, naive_switch, "Per Label")], dosages)
+
+    def test_thirty_year_monthly_horizon_in_the_default_mode(self):
+        body = {"time_horizon": str(tables.MAX_HORIZON_YEARS), "resolution": "monthly", "discount_rate": 0.03, "comparison": "pairs"}
+        response = self.client.post("/submit", json=body)
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(len(result["First_Drug_data"]["Package_Cost"]), tables.MAX_HORIZON_YEARS * 12)
+        y1, later = self.pricing.cumulative_dosage_y1["WET AMD"], self.pricing.cumulative_dosage_y2345
+        self.assertEqual(result["drug_dosages_side_bar_data"],
+                         {drug: y1[drug] + (tables.MAX_HORIZON_YEARS - 1) * later[drug] for drug in tables.DRUGS})
+        self.assertEqual(self.client.post("/submit/batch", json=[body]).json(), [result])
+
+    def test_horizon_beyond_the_limit_is_rejected(self):
+        self.assertEqual(self.client.post("/submit", json={"time_horizon": str(tables.MAX_HORIZON_YEARS + 1)}).status_code, 422)
+
+
+if __name__ == "__main__":
+    unittest.main()
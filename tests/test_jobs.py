@@ -0,0 +1,116 @@
+import os
+import tempfile
+import time
+import unittest
+
+from fastapi.testclient import TestClient
+
+import main
+import tables
+from jobs import JobManager, JobStore
+
+
+def crash(progress=None):
+    # Kills the pool process it runs in, which breaks the pool
+    os._exit(1)
+
+
+def total(*values, progress=None):
+    return sum(values)
+
+
+def wait(manager, job_id):
+    for _ in range(600):
+        job = manager.store.get(job_id)
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    return job
+
+
+class JobLeaseTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = JobStore(os.path.join(directory.name, "jobs.sqlite3"))
+
+    def test_live_job_is_reused(self):
+        self.assertTrue(self.store.claim("job", "sensitivity", lease=60))
+        self.assertFalse(self.store.claim("job", "sensitivity", lease=60))
+        self.assertTrue(self.store.start("job"))
+        self.assertFalse(self.store.claim("job", "sensitivity", lease=60))
+
+    def test_abandoned_job_is_claimed_again(self):
+        for status in ("queued", "running"):
+            self.assertTrue(self.store.claim(status, "sensitivity", lease=60))
+            if status == "running":
+                self.store.start(status)
+            with self.store.connect() as db:
+                db.execute("UPDATE jobs SET updated = ? WHERE id = ?", (time.time() - 120, status))
+            self.assertTrue(self.store.claim(status, "sensitivity", lease=60), status)
+            self.assertEqual(self.store.get(status)["status"], "queued")
+
+    def test_renewed_job_is_not_claimed_again(self):
+        self.store.claim("job", "sensitivity", lease=60)
+        with self.store.connect() as db:
+            db.execute("UPDATE jobs SET updated = ? WHERE id = 'job'", (time.time() - 120,))
+        self.store.renew(["job"])
+        self.assertFalse(self.store.claim("job", "sensitivity", lease=60))
+
+    def test_finished_job_is_never_claimed_again(self):
+        self.store.claim("job", "sensitivity", lease=0)
+        self.store.start("job")
+        self.store.finish("job", b"{}")
+        time.sleep(0.01)
+        self.assertFalse(self.store.claim("job", "sensitivity", lease=0))
+
+
+class JobPoolTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.manager = JobManager(os.path.join(directory.name, "jobs.sqlite3"), max_workers=1)
+        self.addCleanup(self.manager.shutdown)
+
+    def test_broken_pool_is_replaced(self):
+        job = self.manager.submit("crash", {}, "v1", crash)
+        self.assertEqual(wait(self.manager, job["id"])["status"], "failed")
+        job = self.manager.submit("total", {"values": [1, 2]}, "v1", total, 1, 2)
+        self.assertEqual(wait(self.manager, job["id"])["status"], "done")
+        self.assertEqual(self.manager.store.result(job["id"]), b"3")
+
+    def test_failed_submit_releases_the_claim(self):
+        def refuse(job_id, fn, args):
+            raise RuntimeError("cannot schedule new futures after shutdown")
+
+        self.manager.run = refuse
+        job = self.manager.submit("total", {"values": []}, "v1", total)
+        self.assertEqual(job["status"], "failed")
+        self.assertTrue(self.manager.store.claim(job["id"], "total", self.manager.lease))
+
+
+class JobVersionTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        manager = JobManager(os.path.join(directory.name, "jobs.sqlite3"), max_workers=1)
+        self.addCleanup(manager.shutdown)
+        original, main.job_manager = main.job_manager, manager
+        self.addCleanup(setattr, main, "job_manager", original)
+        self.client = TestClient(main.app)
+
+    def test_job_is_keyed_and_priced_by_table_version(self):
+        body = {"base": {"clinical_status": "RWE"}, "parameters": [{"name": "travel_cost", "low": 0, "high": 100, "points": 3}]}
+        job = self.client.post("/jobs/sensitivity", json=body).json()
+        self.assertTrue(job["id"].startswith(f"{tables.current().version}-"))
+        for _ in range(600):
+            if self.client.get(f"/jobs/{job['id']}").json()["status"] not in ("queued", "running"):
+                break
+            time.sleep(0.05)
+        result = self.client.get(f"/jobs/{job['id']}/result")
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json(), self.client.post("/submit/sensitivity", json=body).json())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import warnings
+
+from fastapi.testclient import TestClient
+
+import main
+import tables
+
+
+class DistributionBoundsTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(main.app)
+
+    def simulate(self, distributions, base=None):
+        return self.client.post("/submit/montecarlo", json={"base": base or {}, "distributions": distributions, "draws": 2000})
+
+    def test_out_of_range_parameters_are_rejected(self):
+        for field, spec in (("travel_cost", {"kind": "normal", "mean": 1e300, "sd": 1e300}),
+                            ("travel_cost", {"kind": "uniform", "low": 0, "high": tables.MAX_COST + 1}),
+                            ("travel_cost", {"kind": "fixed", "value": -tables.MAX_COST - 1}),
+                            ("travel_cost", {"kind": "normal", "mean": 0, "sd": 1, "max": 1e19}),
+                            ("Drug 1", {"kind": "fixed", "value": tables.MAX_DOSAGE + 1})):
+            with self.subTest(field=field, spec=spec):
+                self.assertEqual(self.simulate({field: spec}, {"clinical_status": "RWE"}).status_code, 422)
+
+    def test_non_finite_parameters_are_rejected(self):
+        for literal in ("Infinity", "-Infinity", "NaN"):
+            body = f'{{"distributions": {{"travel_cost": {{"kind": "normal", "mean": 100, "sd": {literal}}}}}}}'
+            response = self.client.post("/submit/montecarlo", content=body, headers={"content-type": "application/json"})
+            self.assertEqual(response.status_code, 422, literal)
+
+    def test_draws_are_clipped_to_the_field_bounds(self):
+        base = {"drugs_selected": list(tables.DRUGS)}
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", RuntimeWarning)
+            response = self.simulate({"travel_cost": {"kind": "normal", "mean": tables.MAX_COST, "sd": tables.MAX_COST}}, base)
+        self.assertEqual(response.status_code, 200)
+        # Total Cost/Patient grows with travel_cost, so every draw lies between the two ends of its range
+        low, high = (self.client.post("/submit", json={**base, "travel_cost": value}).json()["bar_gragh_data"][5]["data"]
+                     for value in (-tables.MAX_COST, tables.MAX_COST))
+        for index, drug in enumerate(tables.DRUGS):
+            summary = response.json()["Total_Cost_Per_Patient"][drug]
+            for value in (summary["mean"], *summary["percentiles"].values()):
+                self.assertGreaterEqual(value, low[index], drug)
+                self.assertLessEqual(value, high[index], drug)
+            self.assertEqual(summary["percentiles"]["97.5"], high[index], drug)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+
+import t
+
+
+def result(key, passed=True):
+    return {"key": key, "passed": passed, "tests": 1, "duration": 0.1}
+
+
+class TestCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, t.TEST_CACHE)
+
+    def test_worktrees_keep_each_others_keys(self):
+        t.save_test_cache(self.path, {"tests.test_a": result("main")})
+        t.save_test_cache(self.path, {"tests.test_a": result("feature")})
+        self.assertEqual(t.load_test_cache(self.path)["tests.test_a"]["passed"], ["main", "feature"])
+
+    def test_failure_forgets_the_key(self):
+        t.save_test_cache(self.path, {"tests.test_a": result("main"), "tests.test_b": result("main")})
+        t.save_test_cache(self.path, {"tests.test_a": result("main", passed=False)})
+        cache = t.load_test_cache(self.path)
+        self.assertEqual(cache["tests.test_a"]["passed"], [])
+        self.assertEqual(cache["tests.test_b"]["passed"], ["main"])
+
+    def test_keys_are_bounded_per_module(self):
+        for index in range(t.TEST_CACHE_KEYS + 3):
+            t.save_test_cache(self.path, {"tests.test_a": result(str(index))})
+        passed = t.load_test_cache(self.path)["tests.test_a"]["passed"]
+        self.assertEqual(passed, [str(index) for index in range(3, t.TEST_CACHE_KEYS + 3)])
+
+    def test_old_layout_is_dropped(self):
+        with open(self.path, "w") as f:
+            f.write('{"tests.test_a": {"key": "main", "passed": true, "tests": 1, "duration": 0.1}}')
+        self.assertEqual(t.load_test_cache(self.path), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
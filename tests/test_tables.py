@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+import unittest
+
+from fastapi.testclient import TestClient
+
+import main
+import tables
+from cache import ResponseCache
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pricing_tables.json")
+
+
+class HotReloadTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, "pricing_tables.json")
+        with open(DATA) as file:
+            self.document = json.load(file)
+        self.write(self.document)
+        self.source = tables.TableSource(self.path, interval=60)
+        original, tables.source = tables.source, self.source
+        self.addCleanup(setattr, tables, "source", original)
+        original, main.response_cache = main.response_cache, ResponseCache()
+        self.addCleanup(setattr, main, "response_cache", original)
+        self.client = TestClient(main.app)
+
+    def write(self, document):
+        # Replaced atomically, as TableSource asks
+        staging = os.path.join(self.directory, "staging.json")
+        with open(staging, "w") as file:
+            file.write(document if isinstance(document, str) else json.dumps(document))
+        os.replace(staging, self.path)
+
+    def poll(self):
+        # As if the check interval had passed since the last check
+        self.source.checked -= self.source.interval
+        return tables.current()
+
+    def doubled_prices(self):
+        document = json.loads(json.dumps(self.document))
+        for by_support in document["vial_prices"].values():
+            for prices in by_support.values():
+                for drug in prices:
+                    prices[drug] *= 2
+        return document
+
+    def test_new_file_is_served_after_the_interval(self):
+        before = self.client.post("/submit", json={})
+        version = before.headers["X-Table-Version"]
+        self.assertEqual(version, self.source.tables.version)
+
+        self.write(self.doubled_prices())
+        # Until the interval passes the loaded version keeps being served
+        self.assertEqual(tables.current().version, version)
+        self.assertNotEqual(self.poll().version, version)
+
+        after = self.client.post("/submit", json={})
+        self.assertEqual(after.headers["X-Table-Version"], self.source.tables.version)
+        self.assertNotEqual(after.headers["ETag"], before.headers["ETag"])
+        # Only the vial prices changed: Package_Cost and Total_Cost go up by the same amount, the charges stay
+        (package, *charges, total), (new_package, *new_charges, new_total) = ([row["data"] for row in response.json()["bar_gragh_data"]]
+                                                                              for response in (before, after))
+        self.assertEqual(new_charges, charges)
+        increase = [new - old for new, old in zip(new_package, package)]
+        self.assertTrue(all(amount > 0 for amount in increase))
+        self.assertEqual([new - old for new, old in zip(new_total, total)], increase)
+        stats = self.client.get("/tables").json()
+        self.assertEqual((stats["version"], stats["reloads"], stats["errors"]), (self.source.tables.version, 1, 0))
+
+    def test_bad_files_keep_the_current_tables(self):
+        version = self.source.tables.version
+        renamed = json.loads(json.dumps(self.document).replace("Drug 5", "Drug 6"))
+        with self.assertLogs("tables", "ERROR"):
+            for document in ("{not json", {"vial_prices": {}}, renamed):
+                self.write(document)
+                self.assertEqual(self.poll().version, version)
+        stats = self.source.stats()
+        self.assertEqual((stats["reloads"], stats["errors"]), (0, 3))
+        self.assertIn("the drugs change", stats["last_error"])
+        self.assertEqual(self.client.post("/submit", json={}).headers["X-Table-Version"], version)
+
+        # A valid file afterwards loads and clears the error
+        self.write(self.doubled_prices())
+        self.assertNotEqual(self.poll().version, version)
+        self.assertIsNone(self.source.stats()["last_error"])
+
+    def test_same_content_is_not_a_new_version(self):
+        version = self.source.tables.version
+        self.write(self.document)
+        self.assertEqual(self.poll().version, version)
+        self.assertEqual(self.source.reloads, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
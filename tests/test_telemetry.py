@@ -0,0 +1,80 @@
+import io
+import json
+import logging
+import re
+import unittest
+
+from fastapi.testclient import TestClient
+
+import main
+from cache import ResponseCache
+from telemetry import JsonFormatter, RequestLog
+
+BODY = {"procedure_cost": 97531}
+MISS_STAGES = {"validate", "cache", "lookup", "costs", "assemble", "cumulative", "serialize", "queue", "total"}
+
+
+def server_timing(response):
+    stages = {}
+    for part in response.headers["Server-Timing"].split(", "):
+        name, duration = part.split(";dur=")
+        stages[name] = float(duration)
+    return stages
+
+
+class TelemetryTest(unittest.TestCase):
+    def setUp(self):
+        original, main.response_cache = main.response_cache, ResponseCache()
+        self.addCleanup(setattr, main, "response_cache", original)
+        self.client = TestClient(main.app)
+
+    def metric(self, name, **labels):
+        text = self.client.get("/metrics").text
+        selector = ",".join(f'{label}="{value}"' for label, value in labels.items())
+        match = re.search(rf"^{re.escape(name)}{re.escape('{' + selector + '}') if labels else ''} (\S+)$", text, re.MULTILINE)
+        return float(match.group(1)) if match else 0.0
+
+    def test_server_timing_lists_the_stages(self):
+        miss = server_timing(self.client.post("/submit", json=BODY))
+        self.assertEqual(set(miss), MISS_STAGES)
+        self.assertTrue(all(duration >= 0 for duration in miss.values()))
+        self.assertGreaterEqual(miss["total"], miss["validate"] + miss["cache"])
+        # A cache hit skips the calculation stages
+        self.assertEqual(set(server_timing(self.client.post("/submit", json=BODY))), {"validate", "cache", "total"})
+        # Every route gets at least the total
+        self.assertEqual(set(server_timing(self.client.get("/"))), {"total"})
+
+    def test_metrics_count_requests_errors_and_stages(self):
+        ok = {"path": "/submit", "method": "POST", "status": "200"}
+        invalid = {"path": "/submit", "method": "POST", "status": "422"}
+        before = (self.metric("http_requests_total", **ok), self.metric("http_request_errors_total", **invalid),
+                  self.metric("submit_stage_duration_seconds_count", stage="serialize"), self.metric("submit_cache_hits_total"))
+        self.client.post("/submit", json=BODY)
+        self.client.post("/submit", json=BODY)
+        self.assertEqual(self.client.post("/submit", json={"procedure_cost": "many"}).status_code, 422)
+        after = (self.metric("http_requests_total", **ok), self.metric("http_request_errors_total", **invalid),
+                 self.metric("submit_stage_duration_seconds_count", stage="serialize"), self.metric("submit_cache_hits_total"))
+        self.assertEqual([b - a for a, b in zip(before, after)], [2, 1, 1, 1])
+        self.assertIn('http_request_duration_seconds_bucket{path="/submit",method="POST",le="+Inf"}', self.client.get("/metrics").text)
+
+    def test_request_log_writes_json_lines(self):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        log = RequestLog("test-submit")
+        log.listener.handlers = (handler,)
+        original, main.request_log = main.request_log, log
+        self.addCleanup(setattr, main, "request_log", original)
+        log.start()
+        self.client.post("/submit", json=BODY)
+        self.client.post("/submit", json=BODY)
+        log.stop()
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([(record["event"], record["cache"]) for record in records], [("submit", "miss"), ("submit", "hit")])
+        self.assertEqual(records[0]["input"]["procedure_cost"], BODY["procedure_cost"])
+        self.assertEqual(set(records[0]["timings"]), MISS_STAGES - {"total"})
+        self.assertFalse(RequestLog("test-unsampled", sample_rate=0).sampled())
+
+
+if __name__ == "__main__":
+    unittest.main()
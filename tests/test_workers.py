@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from fastapi.testclient import TestClient
+
+import main
+from workers import CalculatorPool, process_context
+
+
+class PoolTest(unittest.TestCase):
+    def use_pool(self, pool):
+        original, main.calculator_pool = main.calculator_pool, pool
+        self.addCleanup(setattr, main, "calculator_pool", original)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+
+class LoadSheddingTest(PoolTest):
+    def setUp(self):
+        self.pool = self.use_pool(CalculatorPool("thread", max_workers=1, max_queue=1, timeout=10))
+        self.client = TestClient(main.app)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def saturate(self):
+        # One call running and one queued, both until release is set
+        threads = [threading.Thread(target=asyncio.run, args=(self.pool.run(self.release.wait),)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for _ in range(200):
+            if self.pool.in_flight == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.pool.in_flight, 2)
+        return threads
+
+    def test_full_pool_sheds_load_and_root_still_answers(self):
+        threads = self.saturate()
+        response = self.client.post("/submit", json={"procedure_cost": 123457})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+        started = time.perf_counter()
+        self.assertEqual(self.client.get("/").status_code, 200)
+        self.assertLess(time.perf_counter() - started, 1.0)
+        stats = self.client.get("/pool/stats").json()
+        self.assertEqual((stats["in_flight"], stats["queued"], stats["rejected"]), (2, 1, 1))
+
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.pool.in_flight, 0)
+        self.assertEqual(self.client.post("/submit", json={"procedure_cost": 123457}).status_code, 200)
+
+
+class ProcessPoolTest(PoolTest):
+    def test_process_pool_uses_the_shared_context(self):
+        pool = self.use_pool(CalculatorPool("process", max_workers=1))
+        self.assertEqual(pool.start()._mp_context.get_start_method(), process_context().get_start_method())
+        client = TestClient(main.app)
+        body = {"clinical_status": "RWE", "procedure_cost": 654321}
+        response = client.post("/submit/batch", json=[body])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [client.post("/submit", json=body).json()])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import io
+import os
+import subprocess
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+import t
+
+PASSING_TEST = """import unittest
+
+import calc
+
+
+class CalcTest(unittest.TestCase):
+    def test_add(self):
+        self.assertEqual(calc.add(2, 3), 5)
+"""
+
+FAILING_TEST = """import unittest
+
+
+class BrokenTest(unittest.TestCase):
+    def test_broken(self):
+        self.fail("broken on purpose")
+"""
+
+
+def git(path, *args):
+    return subprocess.run(["git", *args], cwd=path, capture_output=True, text=True, check=True).stdout
+
+
+def writer(files):
+    # apply callable of a feature: writes files (relative path -> text) into the worktree
+    def apply(path):
+        for name, text in files.items():
+            with open(os.path.join(path, name), "w") as f:
+                f.write(text)
+    return apply
+
+
+class BatchWorkflowTest(unittest.TestCase):
+    """
+    batch_branching_workflow and run_tests against a throwaway repository whose origin is a bare
+    repository in a temporary directory.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.origin = os.path.join(directory.name, "origin.git")
+        self.repo = os.path.join(directory.name, "work")
+        self.worktrees = os.path.join(directory.name, "worktrees")
+        git(directory.name, "init", "-q", "--bare", "-b", "main", self.origin)
+        git(directory.name, "init", "-q", "-b", "main", self.repo)
+        git(self.repo, "config", "user.name", "Test")
+        git(self.repo, "config", "user.email", "test@example.com")
+        os.makedirs(os.path.join(self.repo, "tests"))
+        writer({"calc.py": "def add(a, b):\n    return a + b\n", "notes.txt": "first line\n",
+                "tests/__init__.py": "", "tests/test_calc.py": PASSING_TEST})(self.repo)
+        git(self.repo, "add", "-A")
+        git(self.repo, "commit", "-q", "-m", "Initial commit")
+        git(self.repo, "remote", "add", "origin", self.origin)
+        git(self.repo, "push", "-q", "origin", "main")
+
+    def run_batch(self, features):
+        with redirect_stdout(io.StringIO()):
+            return t.batch_branching_workflow(self.repo, features, worktree_root=self.worktrees)
+
+    def test_clean_merge(self):
+        result = self.run_batch([{"name": "double", "message": "Add double", "apply": writer({"double.py": "def double(a):\n    return 2 * a\n"})},
+                                 {"name": "notes", "message": "Edit notes", "apply": writer({"notes.txt": "edited\n"})}])
+        self.assertEqual(result["merged"], ["double", "notes"])
+        self.assertEqual(result["failed"], {})
+        self.assertTrue(result["pushed"])
+        self.assertEqual(git(self.origin, "show", "main:double.py"), "def double(a):\n    return 2 * a\n")
+        self.assertEqual(git(self.origin, "show", "main:notes.txt"), "edited\n")
+        self.assertIn("refs/heads/feature/double", git(self.origin, "for-each-ref", "--format=%(refname)"))
+        # The user's working copy and its branch are left alone
+        self.assertEqual(git(self.repo, "rev-parse", "--abbrev-ref", "HEAD").strip(), "main")
+        self.assertFalse(os.path.exists(os.path.join(self.repo, "double.py")))
+        self.assertEqual(git(self.repo, "worktree", "list").count("\n"), 1)
+
+    def test_merge_conflict(self):
+        result = self.run_batch([{"name": "first", "message": "Edit notes", "apply": writer({"notes.txt": "first edit\n"})},
+                                 {"name": "second", "message": "Edit notes again", "apply": writer({"notes.txt": "second edit\n"})}])
+        self.assertEqual(result["merged"], ["first"])
+        self.assertEqual(result["failed"], {"second": "merge conflict in notes.txt"})
+        self.assertEqual(git(self.origin, "show", "main:notes.txt"), "first edit\n")
+        # The conflicting branch is still pushed so it can be rebased
+        self.assertIn("refs/heads/feature/second", git(self.origin, "for-each-ref", "--format=%(refname)"))
+
+    def test_failing_tests(self):
+        main = git(self.origin, "rev-parse", "main")
+        result = self.run_batch([{"name": "broken", "message": "Add a failing test", "apply": writer({"tests/test_broken.py": FAILING_TEST})}])
+        self.assertEqual(result["merged"], [])
+        self.assertEqual(result["failed"], {"broken": "tests failed"})
+        self.assertEqual(git(self.origin, "rev-parse", "main"), main)
+
+    def test_feature_without_changes(self):
+        result = self.run_batch([{"name": "empty", "message": "Nothing", "apply": writer({})}])
+        self.assertEqual(result["failed"], {"empty": "prepare: No changes to commit."})
+        self.assertNotIn("feature/empty", git(self.repo, "branch"))
+
+
+class RunTestsTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.repo = directory.name
+        git(self.repo, "init", "-q")
+        os.makedirs(os.path.join(self.repo, "tests"))
+        writer({"calc.py": "def add(a, b):\n    return a + b\n", "tests/__init__.py": "", "tests/test_calc.py": PASSING_TEST})(self.repo)
+        self.lines = []
+
+    def run_tests(self):
+        self.lines.clear()
+        return t.run_tests(self.repo, workers=1, log=self.lines.append)
+
+    def test_unchanged_modules_are_skipped(self):
+        self.assertTrue(self.run_tests())
+        self.assertIn("1 test modules: 0 unchanged since they passed, running 1 on 1 workers", self.lines)
+        self.assertTrue(self.run_tests())
+        self.assertIn("1 test modules: 1 unchanged since they passed, running 0 on 1 workers", self.lines)
+        # A change in an imported module reruns the tests that depend on it
+        writer({"calc.py": "def add(a, b):\n    return b + a\n"})(self.repo)
+        self.assertTrue(self.run_tests())
+        self.assertIn("1 test modules: 0 unchanged since they passed, running 1 on 1 workers", self.lines)
+
+    def test_failures_are_reported_and_rerun(self):
+        writer({"tests/test_broken.py": FAILING_TEST})(self.repo)
+        self.assertFalse(self.run_tests())
+        self.assertIn("Tests failed in tests.test_broken. Please fix the issues before merging.", self.lines)
+        self.assertFalse(self.run_tests())
+        self.assertIn("2 test modules: 1 unchanged since they passed, running 1 on 1 workers", self.lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
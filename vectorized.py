@@ -0,0 +1,381 @@
+import numpy as np
+
+from tables import (DRUGS, COST_FIELDS, MAX_HORIZON_YEARS, current, dosage_key, rwe_dosages, unit_vector_sum, bar_unit_vectors,
+                    cumulative_unit_vectors, rwe_cumulative_unit_vectors)
+
+# Vectorized form of the /submit calculation: a whole batch of scenarios is priced at once with
+# array operations shaped (scenarios x drugs x cost components) instead of one request at a time.
+
+CUMULATIVE_SERIES = ("Indirect_Costs", "Direct_Costs", "Package_Cost")
+
+# Names of the rows of bar_gragh_data and of each drug's Total_Package_Cost, used by the columnar layout
+BAR_COMPONENTS = ("Package_Cost", "Consulting_Charges", "OCT_Charges", "Travel_Food_Cost", "Opportunity_Cost", "Total_Cost")
+PACKAGE_COMPONENTS = ("Package_Cost", "Direct_Costs", "Indirect_Costs")
+
+COMPARISONS = (None, "selected", "pairs")
+
+# Periods per year of the cumulative series
+RESOLUTIONS = {"yearly": 1, "quarterly": 4, "monthly": 12}
+
+# Largest annual discount rate; beyond it the discount factors of a long horizon overflow
+MAX_DISCOUNT_RATE = 1.0
+
+
+def resolve_horizon(data):
+    """
+    Validate the time horizon settings of one scenario.
+
+    Returns:
+        tuple: (years, periods per year, annual discount rate)
+
+    Raises:
+        ValueError: If the horizon, resolution or discount rate is invalid.
+    """
+    try:
+        years = int(data.time_horizon)
+    except ValueError:
+        raise ValueError(f"Invalid time_horizon: {data.time_horizon!r}")
+    if years > MAX_HORIZON_YEARS:
+        raise ValueError(f"time_horizon must not exceed {MAX_HORIZON_YEARS} years")
+    if data.resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution: {data.resolution!r}; expected one of {tuple(RESOLUTIONS)}")
+    if not 0 <= data.discount_rate <= MAX_DISCOUNT_RATE:
+        raise ValueError(f"discount_rate must be between 0 and {MAX_DISCOUNT_RATE}")
+    return years, RESOLUTIONS[data.resolution], data.discount_rate
+
+
+def resolve_scenario(data, pricing=None):
+    """
+    Resolve the table lookups of one scenario into plain numbers.
+
+    Args:
+        data (InputData): Validated scenario.
+        pricing (PricingTables): Tables to price with; the current ones by default.
+
+    Returns:
+        dict: Side bar dosages, per-drug dosages, vial prices and first/later year cumulative dosages,
+              the first/second drug indices, the time horizon settings and the RWE flag.
+
+    Raises:
+        ValueError: If the scenario cannot be priced (the same inputs make /submit fail).
+    """
+    pricing = pricing or current()
+    if data.account_type not in pricing.vial_prices:
+        raise ValueError(f"Unknown account_type: {data.account_type!r}")
+    if data.clinical_status not in ("Per Label", "RWE"):
+        raise ValueError(f"Unknown clinical_status: {data.clinical_status!r}")
+    if data.disease_indication not in pricing.cumulative_dosage_y1:
+        raise ValueError(f"Unknown disease_indication: {data.disease_indication!r}")
+    for drug in (data.First_Drug, data.Second_Drug):
+        if drug not in DRUGS:
+            raise ValueError(f"Unknown drug: {drug!r}")
+    if data.comparison not in COMPARISONS:
+        raise ValueError(f"Unknown comparison: {data.comparison!r}; expected one of {COMPARISONS[1:]}")
+    years, periods, discount_rate = resolve_horizon(data)
+
+    selected = [drug in data.drugs_selected for drug in DRUGS]
+    side_bar = rwe_dosages(data)
+    input_dosages = list(side_bar.values())
+    rwe = data.clinical_status == "RWE"
+
+    if rwe:
+        dosages = input_dosages
+    else:
+        key = dosage_key(data.disease_indication, data.time_horizon, data.naive_switch, data.clinical_status)
+        side_bar = pricing.per_label_dosages.get(key, {})
+        if any(selected) and not side_bar:
+            raise ValueError(f"No per-label dosages for {key!r}")
+        dosages = [side_bar.get(drug, 0) for drug in DRUGS]
+
+    prices = pricing.prices(data.account_type, data.patient_support)
+    y1 = pricing.cumulative_dosage_y1[data.disease_indication]
+
+    return {
+        "side_bar": side_bar,
+        "dosage": [dosage if sel else 0 for dosage, sel in zip(dosages, selected)],
+        "selected": selected,
+        "input_dosage": input_dosages,
+        "cost_per_vial": [prices[drug] for drug in DRUGS],
+        "y1": [y1[drug] for drug in DRUGS],
+        "y2345": [pricing.cumulative_dosage_y2345[drug] for drug in DRUGS],
+        "first": DRUGS.index(data.First_Drug),
+        "second": DRUGS.index(data.Second_Drug),
+        "years": years,
+        "periods": periods,
+        "discount_rate": discount_rate,
+        "rwe": rwe,
+    }
+
+
+def apply_unit_vectors(vector, costs):
+    """
+    Array form of tables.apply_unit_vector, for a unit vector built from arrays.
+
+    Args:
+        vector (tuple): Unit vector whose constant and coefficients are scalars or int64 arrays
+                        shaped (scenarios, drugs), as returned by the tables unit vector builders
+                        when given arrays.
+        costs (np.ndarray): int64 cost inputs in COST_FIELDS order, shape (scenarios, 8).
+
+    Returns:
+        np.ndarray: int64 amounts, shape (scenarios, drugs).
+    """
+    constant, total = unit_vector_sum(vector, costs.T[..., None])
+    return constant + np.where(total >= 0, total // 2, -(-total // 2))
+
+
+def calculate_costs(dosage, cost_per_vial, costs, total_only=False):
+    """
+    Bar graph rows of every drug, from the same unit vectors as /submit.
+
+    Args:
+        dosage (np.ndarray): int64 dosages, shape (scenarios, drugs).
+        cost_per_vial (np.ndarray): int64 vial prices, shape (scenarios, drugs).
+        costs (np.ndarray): int64 cost inputs in COST_FIELDS order, shape (scenarios, 8).
+        total_only (bool): Return only the total cost per patient, shape (scenarios, drugs).
+
+    Returns:
+        np.ndarray: int64 costs, shape (scenarios, drugs, 6): package, consulting, OCT,
+                    travel and food, opportunity cost lost and total cost per patient.
+    """
+    rows = [apply_unit_vectors(vector, costs) for vector in bar_unit_vectors(dosage, cost_per_vial)]
+    total_cost_per_patient = sum(rows)
+    if total_only:
+        return total_cost_per_patient
+    return np.stack(np.broadcast_arrays(*rows, total_cost_per_patient), axis=2)
+
+
+def calculate_yearly_costs(rwe, y1, y2345, dosage, cost_per_vial, costs):
+    """
+    Amounts added up by the cumulative series, from the same unit vectors as /submit.
+
+    Args:
+        rwe (np.ndarray): True where clinical_status is "RWE", shape (scenarios,).
+        y1 (np.ndarray): int64 predefined first year dosages, shape (scenarios, drugs).
+        y2345 (np.ndarray): int64 predefined later year dosages, shape (drugs,) or (scenarios, drugs).
+        dosage (np.ndarray): int64 user dosages (RWE direct/indirect costs), shape (scenarios, drugs).
+        cost_per_vial (np.ndarray): int64 vial prices, shape (scenarios, drugs).
+        costs (np.ndarray): int64 cost inputs in COST_FIELDS order, shape (scenarios, 8).
+
+    Returns:
+        np.ndarray: int64 amounts, shape (scenarios, drugs, 3, 2): CUMULATIVE_SERIES for the
+                    first year and for every later year.
+    """
+    rwe = np.asarray(rwe)[:, None]
+
+    def amounts(per_label, user):
+        # (indirect, direct, package) of one year; the package rows are the same in both modes
+        indirect, direct, package = (apply_unit_vectors(vector, costs) for vector in per_label)
+        if rwe.any():
+            indirect = np.where(rwe, apply_unit_vectors(user[0], costs), indirect)
+            direct = np.where(rwe, apply_unit_vectors(user[1], costs), direct)
+        return np.stack(np.broadcast_arrays(indirect, direct, package), axis=2)
+
+    per_label = cumulative_unit_vectors(y1, y2345, cost_per_vial)
+    user = rwe_cumulative_unit_vectors(y1, y2345, dosage, cost_per_vial)
+    return np.stack([amounts(per_label[0], user[0]), amounts(per_label[1], user[1])], axis=3)
+
+
+def calculate_cumulative_series(yearly, years, length, periods=1, discount_rate=0.0):
+    """
+    Running totals of calculate_yearly_costs over the time horizon, zero padded.
+
+    Closed form, so the cost does not depend on the horizon: each year's amount accrues evenly over
+    its periods (integer division, so every year ends on the exact yearly total), and with a discount
+    rate each year's amounts are discounted to the start of the horizon before the prefix sum.
+
+    Args:
+        yearly (np.ndarray): Output of calculate_yearly_costs, shape (..., 2).
+        years (np.ndarray): Time horizon per scenario, shape (scenarios,).
+        length (int): Number of entries per series.
+        periods (int | np.ndarray): Periods per year, scalar or per scenario.
+        discount_rate (float | np.ndarray): Annual discount rate, scalar or per scenario; the first
+                                            year is not discounted.
+
+    Returns:
+        np.ndarray: int64 series, shape (..., length).
+    """
+    def per_scenario(values):
+        values = np.asarray(values)
+        return values.reshape(values.shape + (1,) * (yearly.ndim - 1))
+
+    years, periods, discount_rate = per_scenario(years), per_scenario(periods), per_scenario(discount_rate)
+    j = np.arange(1, length + 1)
+    series = yearly[..., :1] * np.minimum(j, periods) // periods + yearly[..., 1:] * np.maximum(j - periods, 0) // periods
+
+    if np.any(discount_rate):
+        amounts = np.diff(series, prepend=0, axis=-1) / (1 + discount_rate) ** ((j - 1) // periods)
+        series = np.rint(np.cumsum(amounts, axis=-1)).astype(np.int64)
+
+    return np.where(j <= years * periods, series, 0)
+
+
+def compare_cumulative(drugs, yearly, years, comparison, periods=1, discount_rate=0.0):
+    """
+    Cumulative series of several drugs at once, optionally with every pairwise difference.
+
+    Args:
+        drugs (list): Drug names, one per row of yearly.
+        yearly (np.ndarray): (indirect, direct, package) for the first and every later year, shape (drugs, 3, 2).
+        years (int): Time horizon in years.
+        comparison (str): "selected" for the per-drug series, "pairs" to add each pair's differences.
+        periods (int): Periods per year.
+        discount_rate (float): Annual discount rate.
+
+    Returns:
+        dict: Cumulative_Costs per drug and, for "pairs", Cumulative_Pairs with First_Drug minus
+              Second_Drug for every pair of drugs in order.
+    """
+    series = calculate_cumulative_series(np.asarray(yearly, dtype=np.int64).reshape(len(drugs), 3, 2),
+                                         np.array(years), max(5, years) * periods, periods, discount_rate)
+    result = {"Cumulative_Costs": {drug: dict(zip(CUMULATIVE_SERIES, rows)) for drug, rows in zip(drugs, series.tolist())}}
+
+    if comparison == "pairs":
+        first, second = np.triu_indices(len(drugs), 1)
+        differences = series[first] - series[second]
+        totals = differences.sum(axis=1)
+        result["Cumulative_Pairs"] = [dict(zip(CUMULATIVE_SERIES, rows), First_Drug=drugs[a], Second_Drug=drugs[b], Total_Cost=total)
+                                      for a, b, rows, total in zip(first.tolist(), second.tolist(), differences.tolist(), totals.tolist())]
+    return result
+
+
+def calculate_batch(scenarios, pricing=None):
+    """
+    Price a batch of scenarios in one pass.
+
+    Args:
+        scenarios (List[InputData]): Validated scenarios.
+        pricing (PricingTables): Tables to price with; the current ones by default.
+
+    Returns:
+        list: One dict per scenario, identical to the /submit response for it.
+
+    Raises:
+        ValueError: If any scenario cannot be priced; the message names its index.
+    """
+    return calculate_resolved(scenarios, resolve_batch(scenarios, pricing))
+
+
+def resolve_batch(scenarios, pricing=None):
+    # One version of the tables for the whole batch
+    pricing = pricing or current()
+    resolved = []
+    for index, data in enumerate(scenarios):
+        try:
+            resolved.append(resolve_scenario(data, pricing))
+        except ValueError as e:
+            raise ValueError(f"Scenario {index}: {e}")
+    return resolved
+
+
+def price_resolved(scenarios, resolved):
+    """
+    Array form of a batch of scenarios already passed through resolve_scenario.
+
+    Returns:
+        tuple: bar graph components (scenarios, drugs, 6), package totals (scenarios, drugs, 3), yearly
+               amounts of every drug, First/Second drug cumulative series (scenarios, 2, 3, periods)
+               and the length of each scenario's series.
+    """
+    def column(name):
+        return np.array([r[name] for r in resolved], dtype=np.int64)
+
+    costs = np.array([[getattr(data, field) for field in COST_FIELDS] for data in scenarios], dtype=np.int64)
+    cost_per_vial = column("cost_per_vial")
+    years = column("years")
+    periods = column("periods")
+    discount_rates = np.array([r["discount_rate"] for r in resolved], dtype=np.float64)
+    rows = np.arange(len(scenarios))
+
+    components = calculate_costs(column("dosage"), cost_per_vial, costs)
+    package_totals = np.stack([components[..., 0], components[..., 1] + components[..., 2],
+                               components[..., 3] + components[..., 4]], axis=2)
+
+    yearly = calculate_yearly_costs(np.array([r["rwe"] for r in resolved]), column("y1"), column("y2345"),
+                                    column("input_dosage"), cost_per_vial, costs)
+    pair = np.stack([yearly[rows, column("first")], yearly[rows, column("second")]], axis=1)
+    lengths = np.maximum(years, 5) * periods
+    cumulative = calculate_cumulative_series(pair, years, int(lengths.max()), periods, discount_rates)
+    return components, package_totals, yearly, cumulative, lengths
+
+
+def calculate_resolved(scenarios, resolved):
+    """
+    Price a batch of scenarios already passed through resolve_scenario.
+
+    Args:
+        scenarios (List[InputData]): Validated scenarios.
+        resolved (list): resolve_scenario output of each scenario.
+
+    Returns:
+        list: One dict per scenario, identical to the /submit response for it.
+    """
+    if not scenarios:
+        return []
+    components, package_totals, yearly, cumulative, lengths = price_resolved(scenarios, resolved)
+
+    results = []
+    for index, (data, r, bars, totals, series, length) in enumerate(zip(scenarios, resolved, components.transpose(0, 2, 1).tolist(),
+                                                                        package_totals.tolist(), cumulative.tolist(), lengths.tolist())):
+        first, second = ({name: values[:length] for name, values in zip(CUMULATIVE_SERIES, drug)} for drug in series)
+        result = {"drug_dosages_side_bar_data": r["side_bar"],
+                  "bar_gragh_data": [{"data": data} for data in bars],
+                  "Total_Package_Cost": [{"data": data} for data in totals],
+                  "First_Drug_data": first,
+                  "Second_Drug_data": second}
+        if data.comparison:
+            compared = [drug_index for drug_index, selected in enumerate(r["selected"]) if selected]
+            result.update(compare_cumulative([DRUGS[i] for i in compared], yearly[index, compared], r["years"], data.comparison,
+                                             r["periods"], r["discount_rate"]))
+        results.append(result)
+    return results
+
+
+def columnar_comparison(compared):
+    """
+    Columnar layout of a compare_cumulative result: Cumulative_Costs as {"drugs", series: [[...] per
+    drug]} and Cumulative_Pairs as {"First_Drug", "Second_Drug", "Total_Cost", series: [[...] per pair]}.
+    """
+    costs = compared["Cumulative_Costs"]
+    columnar = {"Cumulative_Costs": {"drugs": list(costs), **{name: [drug[name] for drug in costs.values()] for name in CUMULATIVE_SERIES}}}
+    if "Cumulative_Pairs" in compared:
+        pairs = compared["Cumulative_Pairs"]
+        columnar["Cumulative_Pairs"] = {name: [pair[name] for pair in pairs] for name in ("First_Drug", "Second_Drug", "Total_Cost") + CUMULATIVE_SERIES}
+    return columnar
+
+
+def calculate_batch_columnar(scenarios, pricing=None):
+    """
+    Price a batch of scenarios in one pass into the columnar layout, read straight off the arrays.
+
+    Every key holds one entry per scenario: bar_gragh_data {component: [[value per drug] per scenario]},
+    Total_Package_Cost likewise, First_Drug_data / Second_Drug_data {series: [[value per period] per
+    scenario]}, and Cumulative_Costs / Cumulative_Pairs (only if a scenario sets comparison) in the
+    columnar_comparison layout, None for scenarios without a comparison.
+
+    Raises:
+        ValueError: If any scenario cannot be priced; the message names its index.
+    """
+    resolved = resolve_batch(scenarios, pricing)
+    batch = {"drugs": list(DRUGS), "count": len(scenarios), "drug_dosages_side_bar_data": [r["side_bar"] for r in resolved]}
+    if not scenarios:
+        return batch
+    components, package_totals, yearly, cumulative, lengths = price_resolved(scenarios, resolved)
+
+    batch["bar_gragh_data"] = dict(zip(BAR_COMPONENTS, components.transpose(2, 0, 1).tolist()))
+    batch["Total_Package_Cost"] = dict(zip(PACKAGE_COMPONENTS, package_totals.transpose(2, 0, 1).tolist()))
+    lengths = lengths.tolist()
+    for key, drug in (("First_Drug_data", 0), ("Second_Drug_data", 1)):
+        batch[key] = {name: [values[:length] for values, length in zip(series, lengths)]
+                      for name, series in zip(CUMULATIVE_SERIES, cumulative[:, drug].transpose(1, 0, 2).tolist())}
+
+    comparisons = [None] * len(scenarios)
+    for index, (data, r) in enumerate(zip(scenarios, resolved)):
+        if data.comparison:
+            compared = [drug_index for drug_index, selected in enumerate(r["selected"]) if selected]
+            comparisons[index] = columnar_comparison(compare_cumulative([DRUGS[i] for i in compared], yearly[index, compared], r["years"],
+                                                                        data.comparison, r["periods"], r["discount_rate"]))
+    if any(comparisons):
+        for key in ("Cumulative_Costs", "Cumulative_Pairs"):
+            batch[key] = [compared.get(key) if compared else None for compared in comparisons]
+    return batch
@@ -0,0 +1,273 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from engine import NO_COSTS, bar_outputs, calculate_cumulative_costs, check_series_settings, rwe_unit_vectors, scenario_unit_vectors
+from formats import dumps_json
+from tables import DRUGS, COST_FIELDS, DOSAGE_FIELDS, apply_unit_vector, rwe_dosages
+from vectorized import compare_cumulative
+
+# Stateful what-if sessions. A session keeps the inputs, unit-cost vectors and outputs of one scenario,
+# so a PATCH of a few fields only re-evaluates the outputs that depend on them and is answered with a
+# JSON Patch (RFC 6902) of the /submit response instead of the whole response.
+
+# Fields only the cumulative series depend on
+SERIES_FIELDS = frozenset({"First_Drug", "Second_Drug", "comparison", "resolution", "discount_rate"})
+# RWE dosage inputs; Per Label dosages come from the tables
+DOSAGE_INPUTS = frozenset(DOSAGE_FIELDS.values()) | {"drug_dosages"}
+COST_INDEX = {field: index for index, field in enumerate(COST_FIELDS)}
+
+
+def merge_patch(target, patch):
+    # RFC 7396: objects merge recursively and null removes a member, so a field set to null gets its default
+    if not isinstance(patch, dict):
+        return patch
+    merged = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            merged.pop(key, None)
+        else:
+            merged[key] = merge_patch(merged.get(key), value)
+    return merged
+
+
+def pointer(path):
+    return "".join("/" + str(part).replace("~", "~0").replace("/", "~1") for part in path)
+
+
+def diff(old, new, path=(), ops=None):
+    """
+    JSON Patch operations turning old into new.
+
+    Subtrees that are the same object are skipped without being compared. Lists of objects of equal
+    length are compared item by item; a list of numbers that differs is replaced whole, since a
+    cumulative series that changes at all changes from that period on.
+    """
+    ops = [] if ops is None else ops
+    if old is new:
+        return ops
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": pointer(path + (key,))})
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": pointer(path + (key,)), "value": value})
+            else:
+                diff(old[key], value, path + (key,), ops)
+    elif isinstance(old, list) and isinstance(new, list) and len(old) == len(new) and new and isinstance(new[0], dict):
+        for index, (a, b) in enumerate(zip(old, new)):
+            diff(a, b, path + (index,), ops)
+    elif old != new:
+        ops.append({"op": "replace", "path": pointer(path), "value": new})
+    return ops
+
+
+class Session:
+    """
+    Inputs, unit-cost vectors and outputs of one what-if scenario.
+
+    Args:
+        data (InputData): Validated scenario.
+        pricing (PricingTables): Tables to price with.
+
+    Raises:
+        ValueError: If the scenario is outside the pricing tables.
+    """
+
+    def __init__(self, data, pricing):
+        self.lock = threading.Lock()
+        self.result = {}
+        self.compute(data, pricing)
+
+    def compute(self, data, pricing):
+        # Everything from scratch, as calculate_submit does
+        side_bar, bar, cumulative = scenario_unit_vectors(data, pricing)
+        self.data, self.pricing = data, pricing
+        self.side_bar, self.bar, self.cumulative = side_bar, dict(bar), dict(cumulative)
+        self.costs = tuple(getattr(data, field) for field in COST_FIELDS)
+        self.drug_costs = {drug: self.bar_costs(drug) for drug in DRUGS}
+        self.yearly = {drug: self.yearly_amounts(drug) for drug in DRUGS}
+        self.result = self.assemble(self.result, side_bar=True, bar=True, series=(True, True), comparison=True)
+
+    def bar_costs(self, drug, fields=None):
+        # Rows of one drug; with fields, only the rows whose vector uses one of them are re-evaluated
+        if self.bar[drug] is None:
+            return NO_COSTS
+        if fields is None:
+            rows = [apply_unit_vector(vector, self.costs) for vector in self.bar[drug]]
+        else:
+            rows = [self.reevaluate(vector, row, fields) for vector, row in zip(self.bar[drug], self.drug_costs[drug])]
+        return (*rows, sum(rows))
+
+    def yearly_amounts(self, drug, fields=None):
+        # (indirect, direct, package) of the first year and of every later year
+        if fields is None:
+            return tuple(tuple(apply_unit_vector(vector, self.costs) for vector in vectors) for vectors in self.cumulative[drug])
+        return tuple(tuple(self.reevaluate(vector, amount, fields) for vector, amount in zip(vectors, amounts))
+                     for vectors, amounts in zip(self.cumulative[drug], self.yearly[drug]))
+
+    def reevaluate(self, vector, value, fields):
+        if any(vector[1][COST_INDEX[field]] for field in fields):
+            return apply_unit_vector(vector, self.costs)
+        return value
+
+    def assemble(self, result, side_bar=False, bar=False, series=(False, False), comparison=False):
+        # A new response dict; parts that were not recomputed are the same objects as before, which diff() skips
+        result = dict(result)
+        years, periods, discount_rate = check_series_settings(self.data)
+        if side_bar:
+            result["drug_dosages_side_bar_data"] = self.side_bar
+        if bar:
+            result["bar_gragh_data"], result["Total_Package_Cost"] = bar_outputs([self.drug_costs[drug] for drug in DRUGS])
+        for key, drug, changed in (("First_Drug_data", self.data.First_Drug, series[0]), ("Second_Drug_data", self.data.Second_Drug, series[1])):
+            if changed:
+                result[key] = calculate_cumulative_costs(years, *self.yearly[drug], periods, discount_rate)
+        if comparison:
+            result.pop("Cumulative_Costs", None)
+            result.pop("Cumulative_Pairs", None)
+            if self.data.comparison:
+                selected = [drug for drug in DRUGS if self.bar[drug] is not None]
+                yearly = [list(zip(*self.yearly[drug])) for drug in selected]
+                result.update(compare_cumulative(selected, yearly, years, self.data.comparison, periods, discount_rate))
+        return result
+
+    def update(self, patch, pricing):
+        """
+        Apply a merge patch to the inputs and re-evaluate only what depends on the fields it changes.
+
+        Cost fields re-evaluate the outputs whose unit vectors use them, an RWE dosage the outputs of
+        its drug, First/Second drug, comparison and horizon settings only the cumulative series; any
+        other field, or a new version of the pricing tables, recomputes the whole scenario.
+
+        Args:
+            patch (dict): JSON merge patch of InputData fields.
+            pricing (PricingTables): Current tables.
+
+        Returns:
+            tuple: (sorted names of the fields that changed, JSON Patch of the response, or a single
+                replace of the whole response when that is smaller)
+
+        Raises:
+            ValueError: If a field is unknown or the updated scenario is invalid; the session is unchanged.
+        """
+        model = type(self.data)
+        unknown = set(patch) - set(model.model_fields)
+        if unknown:
+            raise ValueError(f"Unknown field: {', '.join(sorted(unknown))}")
+
+        with self.lock:
+            data = model.model_validate(merge_patch(self.data.model_dump(), patch))
+            changed = {field for field in model.model_fields if getattr(data, field) != getattr(self.data, field)}
+            before = self.result
+            structural = changed - SERIES_FIELDS - DOSAGE_INPUTS - set(COST_FIELDS)
+            whole = structural or pricing.version != self.pricing.version
+            if whole:
+                self.compute(data, pricing)
+            elif changed:
+                self.apply(data, changed)
+            operations = diff(before, self.result)
+            if len(operations) > 1 and len(dumps_json(operations)) > len(dumps_json(self.result)):
+                # Most of the response changed (say a new horizon or drug selection); sending it whole is smaller
+                operations = [{"op": "replace", "path": "", "value": self.result}]
+            return sorted(changed), operations
+
+    def apply(self, data, changed):
+        check_series_settings(data)
+        side_bar = rwe_dosages(data) if data.clinical_status == "RWE" and changed & DOSAGE_INPUTS else self.side_bar
+        self.data = data
+        self.costs = tuple(getattr(data, field) for field in COST_FIELDS)
+
+        # Drugs whose RWE dosage moved get new vectors and are re-evaluated entirely
+        redone = [drug for drug in DRUGS if side_bar is not self.side_bar and side_bar[drug] != self.side_bar[drug]]
+        for drug in redone:
+            self.bar[drug], self.cumulative[drug] = rwe_unit_vectors(data, self.pricing, drug, side_bar[drug])
+        cost_fields = changed & set(COST_FIELDS)
+
+        bar_changed, yearly_changed = False, set()
+        for drug in DRUGS:
+            if drug in redone or cost_fields:
+                fields = None if drug in redone else cost_fields
+                costs, yearly = self.bar_costs(drug, fields), self.yearly_amounts(drug, fields)
+                bar_changed |= costs != self.drug_costs[drug]
+                if yearly != self.yearly[drug]:
+                    yearly_changed.add(drug)
+                self.drug_costs[drug], self.yearly[drug] = costs, yearly
+
+        horizon = bool(changed & {"resolution", "discount_rate"})
+        first = horizon or "First_Drug" in changed or data.First_Drug in yearly_changed
+        second = horizon or "Second_Drug" in changed or data.Second_Drug in yearly_changed
+        comparison = "comparison" in changed or bool(data.comparison) and (horizon or any(self.bar[drug] is not None for drug in yearly_changed))
+        self.side_bar, previous = side_bar, self.side_bar
+        self.result = self.assemble(self.result, side_bar=side_bar is not previous, bar=bar_changed, series=(first, second),
+                                    comparison=comparison)
+
+
+class SessionStore:
+    """
+    What-if sessions of this API worker, least recently used first.
+
+    Sessions live in the memory of the worker that created them; behind several workers a client
+    that gets a 404 simply starts a new session.
+
+    Args:
+        max_sessions (int): Sessions kept before the least recently used one is evicted.
+        idle_ttl (float): Seconds a session may go unused before it is dropped.
+    """
+
+    def __init__(self, max_sessions=1000, idle_ttl=900.0, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.created = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def create(self, data, pricing):
+        session = Session(data, pricing)
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            self._expire()
+            self.sessions[session_id] = (self.clock(), session)
+            self.created += 1
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evictions += 1
+        return session_id, session
+
+    def get(self, session_id):
+        with self.lock:
+            self._expire()
+            item = self.sessions.get(session_id)
+            if item is None:
+                return None
+            self.sessions[session_id] = (self.clock(), item[1])
+            self.sessions.move_to_end(session_id)
+            return item[1]
+
+    def delete(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def _expire(self):
+        # Oldest use first, so idle sessions are always at the front
+        deadline = self.clock() - self.idle_ttl
+        while self.sessions:
+            session_id, (used, _) = next(iter(self.sessions.items()))
+            if used > deadline:
+                break
+            del self.sessions[session_id]
+            self.expirations += 1
+
+    def stats(self):
+        with self.lock:
+            self._expire()
+            return {"sessions": len(self.sessions),
+                    "max_sessions": self.max_sessions,
+                    "idle_ttl": self.idle_ttl,
+                    "created": self.created,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations}
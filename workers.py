@@ -0,0 +1,152 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Bounded worker pool for the calculator endpoints. The handlers only await here, so the event loop
+# (and GET /) stays responsive while the CPU work runs on the pool.
+
+
+class Overloaded(Exception):
+    """Raised when the pool already holds as many requests as it may queue."""
+
+
+class CalculatorPool:
+    """
+    Run CPU-bound calculations off the event loop with admission control.
+
+    At most max_workers calls run at once and at most max_queue more wait for a worker; anything
+    beyond that is rejected immediately with Overloaded so the caller can shed load.
+
+    Args:
+        kind (str): "thread" or "process".
+        max_workers (int): Concurrent calculations.
+        max_queue (int): Calls allowed to wait for a free worker.
+        timeout (float): Seconds a call may take, queueing included, before asyncio.TimeoutError.
+    """
+
+    def __init__(self, kind="thread", max_workers=4, max_queue=64, timeout=30.0):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown pool kind: {kind!r}; expected 'thread' or 'process'")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.executor = None
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.finished = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def start(self):
+        if self.executor is None:
+            if self.kind == "process":
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=process_context())
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    async def run(self, fn, *args, timeout=None):
+        """
+        Run fn(*args) on the pool.
+
+        With the process pool, fn and its arguments must be picklable (module-level functions).
+        A timed out call is no longer awaited; one that is still queued is cancelled, one that already
+        started runs to completion and keeps its slot until then, so a backlog of timed out calls
+        still counts against max_workers + max_queue.
+
+        Raises:
+            Overloaded: If max_workers + max_queue calls are already in flight.
+            asyncio.TimeoutError: If the call did not finish within the timeout.
+        """
+        with self.lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise Overloaded(f"{self.in_flight} calculations in flight")
+            self.in_flight += 1
+
+        try:
+            future = self.start().submit(fn, *args)
+        except BaseException:
+            self.release(None)
+            raise
+        # Called from the executor once the call really ends (or is cancelled), not when we stop waiting
+        future.add_done_callback(self.release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            with self.lock:
+                self.timeouts += 1
+            raise
+
+    def release(self, future):
+        with self.lock:
+            self.in_flight -= 1
+            self.finished += 1
+
+    def stats(self):
+        return {"kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "timeout": self.timeout,
+                "in_flight": self.in_flight,
+                "queued": max(self.in_flight - self.max_workers, 0),
+                "finished": self.finished,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts}
+
+
+def process_context():
+    # Pool processes come from a fork server (spawn where there is none), so a multi-threaded API
+    # process is never forked
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def pool_from_environment():
+    return CalculatorPool(kind=os.environ.get("CALCULATOR_POOL", "thread"),
+                          max_workers=int(os.environ.get("CALCULATOR_WORKERS", os.cpu_count() or 1)),
+                          max_queue=int(os.environ.get("CALCULATOR_QUEUE", "64")),
+                          timeout=float(os.environ.get("CALCULATOR_TIMEOUT", "30")))
+
+
+class SimulationPool:
+    """
+    Processes the chunked simulations (Monte Carlo, budget impact) spread their chunks over.
+
+    One per process, sized by the server and started on first use, so a request never decides how
+    many processes are created. The processes come from process_context().
+
+    Args:
+        max_workers (int): Processes; 0 or 1 runs every chunk in the calling process.
+    """
+
+    def __init__(self, max_workers=0):
+        self.max_workers = max_workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def map(self, fn, *iterables):
+        if self.max_workers <= 1:
+            return map(fn, *iterables)
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=process_context())
+            executor = self.executor
+        return executor.map(fn, *iterables)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+                self.executor = None
+
+
+simulation_pool = SimulationPool(max_workers=int(os.environ.get("SIMULATION_WORKERS", "0")))